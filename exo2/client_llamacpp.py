@@ -1,7 +1,12 @@
-import requests
+import sys
+from pathlib import Path
 from typing import List, Dict, Optional
 
-LLAMA_SERVER_URL = "http://localhost:8080/v1/chat/completions"
+# Le client partagé (llama_client/) est à la racine du dépôt
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llama_client import build_messages, extract_content, get_default_client
+
 MODEL_NAME = "Qwen_Qwen3-0.6B-Q8_0"
 
 
@@ -23,15 +28,8 @@ def send_llama_chat(
     :param max_tokens: Nombre max de tokens générés.
     :return: La réponse texte du modèle.
     """
-    if history is None:
-        history = []
-
     # Construction de la liste des messages pour un endpoint style OpenAI
-    messages = [
-        {"role": "system", "content": system_prompt},
-        *history,
-        {"role": "user", "content": user_content},
-    ]
+    messages = build_messages(user_content, system_prompt, history)
 
     payload = {
         "model": MODEL_NAME,
@@ -43,20 +41,13 @@ def send_llama_chat(
         # "stream": False,
     }
 
-    try:
-        response = requests.post(LLAMA_SERVER_URL, json=payload, timeout=60)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        raise RuntimeError(f"Erreur lors de l'appel à llama-server: {e}") from e
-
-    data = response.json()
+    # Connexions keep-alive réutilisées via le client partagé (URL : la sienne,
+    # voir llama_client.set_default_client)
+    data = get_default_client().post_chat(payload)
 
-    # Pour une API type OpenAI, la réponse est souvent dans:
+    # Pour une API type OpenAI, la réponse est dans:
     # data["choices"][0]["message"]["content"]
-    try:
-        return data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError) as e:
-        raise RuntimeError(f"Format de réponse inattendu: {data}") from e
+    return extract_content(data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+Client partagé pour llama-server (API style OpenAI).
+
+Utilisé par tp_final/agent.py et exo2/client_llamacpp.py.
+"""
+
+from .balancer import BACKEND_URL, Backend, BackendPool
+from .batching import AsyncMicroBatcher, MicroBatcher
+from .cache import ResponseCache, is_deterministic, payload_key
+from .cancel import CancelToken, RequestCancelled, cancel_scope, current_cancel_token
+from .cassette import Cassette, CassetteMiss, cassette_from_env
+from .deadline import (
+    Deadline,
+    DeadlineExceeded,
+    current_deadline,
+    deadline_scope,
+    optional_step_allowed,
+)
+from .memory import ConversationMemory, TokenCounter
+from .pool import (
+    LLAMA_SERVER_URL,
+    LlamaClient,
+    PoolStats,
+    Timeouts,
+    build_messages,
+    extract_content,
+    extract_finish_reason,
+    extract_tool_call,
+    get_client_for,
+    get_default_client,
+    set_default_client,
+)
+from .resilience import (
+    ANSWER_POLICY,
+    DEFAULT_POLICIES,
+    ROUTING_POLICY,
+    CallPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    LlamaRequestError,
+    RetryBudget,
+)
+from .scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    AsyncScheduler,
+    BusyError,
+    PriorityClass,
+    Scheduler,
+)
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .slots import SlotAffinity, SlotStats
+from .streaming import JsonObjectScanner, collect_stream, collect_stream_async, first_json_object, iter_deltas
+from .tracing import (
+    DEBUG,
+    INFO,
+    OFF,
+    Span,
+    annotate,
+    configure_tracing,
+    event,
+    export_chrome_trace,
+    get_tracer,
+    span,
+    tracing_enabled,
+)
+from .usage import (
+    TokenUsage,
+    UsageLedger,
+    budget_exhausted,
+    record_usage,
+    usage_scope,
+)
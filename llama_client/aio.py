@@ -0,0 +1,454 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, List, Optional, TypeVar
+
+import aiohttp
+
+from .balancer import BACKEND_URL, BackendPool
+from .batching import AsyncMicroBatcher
+from .cache import ResponseCache
+from .calls import Attempts, ChatCall, prepare_stream, record_stream_outcome
+from .cancel import CancelToken, RequestCancelled
+from .cassette import Cassette, cassette_from_env
+from .config import LLAMA_SERVER_URL, Timeouts
+from .deadline import Deadline
+from .pool import PoolStats, request_body
+from .resilience import (
+    DEFAULT_POLICIES,
+    CallPolicy,
+    CircuitBreaker,
+    HedgeStats,
+    LatencyTracker,
+    LlamaRequestError,
+    RetryBudget,
+    is_request_error,
+)
+from .scheduler import AsyncScheduler
+from .singleflight import AsyncSingleFlight
+from .streaming import (
+    SSE_DONE,
+    STOP_AT_JSON,
+    JsonObjectScanner,
+    chunk_finish_reason,
+    delta_text,
+    json_stream_response,
+    parse_sse_line,
+)
+from .tracing import annotate
+from .usage import record_usage
+
+T = TypeVar("T")
+
+
+class AsyncLlamaClient:
+    """
+    Équivalent asyncio de LlamaClient, basé sur une aiohttp.ClientSession.
+
+    Toutes les coroutines d'une même boucle partagent le même pool de
+    connexions keep-alive : des centaines de sessions peuvent attendre
+    llama-server en parallèle sans un thread chacune.
+
+    coalesce=True : les appels déterministes identiques en cours sont
+    mutualisés (une seule requête, tous reçoivent le résultat).
+
+    backends : BackendPool partageable avec un LlamaClient synchrone.
+
+    Même politique d'appel que LlamaClient (calls.py : cache, échéance,
+    policies par site d'appel, RetryBudget, hedge au-delà du p95,
+    CircuitBreaker) ; seules les entrées / sorties diffèrent. Le doublon
+    perdant est annulé, ce qui coupe sa requête HTTP.
+
+    batcher : AsyncMicroBatcher qui limite les requêtes en cours des sessions
+    concurrentes au nombre de slots du serveur.
+
+    scheduler : AsyncScheduler (priorités, admission, BusyError).
+
+    cassette : enregistrement / replay du trafic (voir cassette.py).
+    """
+
+    def __init__(
+        self,
+        url: str = LLAMA_SERVER_URL,
+        pool_maxsize: int = 100,
+        timeouts: Optional[Timeouts] = None,
+        cache: Optional[ResponseCache] = None,
+        coalesce: bool = True,
+        backends: Optional[BackendPool] = None,
+        policies: Optional[Dict[str, CallPolicy]] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        batcher: Optional[AsyncMicroBatcher] = None,
+        scheduler: Optional[AsyncScheduler] = None,
+        cassette: Optional[Cassette] = None,
+    ):
+        self.url = url
+        self.backends = backends
+        self.batcher = batcher
+        self.scheduler = scheduler
+        self.cassette = cassette
+        self.policies: Dict[str, CallPolicy] = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.default_policy = CallPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.latencies = LatencyTracker()
+        self.hedge_stats = HedgeStats()
+        self.pool_maxsize = pool_maxsize
+        self.timeouts = timeouts or Timeouts()
+        self.cache = cache
+        self.singleflight: Optional[AsyncSingleFlight] = AsyncSingleFlight() if coalesce else None
+        self.stats = PoolStats()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _client_timeout(self, timeouts: Timeouts) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(sock_connect=timeouts.connect, sock_read=timeouts.read)
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_reuse(session, ctx, params):
+            self.stats.record(reused=True)
+
+        async def on_create(session, ctx, params):
+            self.stats.record(reused=False)
+
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_connection_create_end.append(on_create)
+        return trace
+
+    @contextmanager
+    def _endpoint(self, deadline: Optional[Deadline] = None, base_url: Optional[str] = None) -> Iterator[str]:
+        if self.backends is None:
+            yield self.url
+        else:
+            with self.backends.use(deadline, base_url) as backend:
+                yield backend.chat_url
+
+    async def session(self) -> aiohttp.ClientSession:
+        """
+        Session aiohttp liée à la boucle courante (recréée si la boucle a changé).
+        """
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+                timeout=self._client_timeout(self.timeouts),
+                trace_configs=[self._trace_config()],
+            )
+            self._session_loop = loop
+        return self._session
+
+    def policy_for(self, call_site: Optional[str]) -> CallPolicy:
+        return self.policies.get(call_site or "", self.default_policy)
+
+    async def post_chat(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Optional[Timeouts] = None,
+        use_cache: bool = False,
+        call_site: Optional[str] = None,
+        priority: str = "interactive",
+        stop_at_json: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        POST du payload sur l'endpoint chat, retourne le JSON décodé.
+        use_cache : autorise le cache pour cet appel (ignoré si temperature != 0).
+        call_site : sélectionne la CallPolicy.
+        priority : classe de priorité pour le scheduler.
+        stop_at_json : voir LlamaClient.post_chat.
+        """
+        call = ChatCall.prepare(payload, self.cache if use_cache else None, call_site, stop_at_json)
+        cached = call.cached()
+        if cached is not None:
+            return cached
+
+        async def fetch() -> Dict[str, Any]:
+            send = lambda: self._resilient_post(call, timeouts)
+            if self.batcher is not None:
+                send = lambda inner=send: self.batcher.submit(inner)
+            if self.scheduler is not None:
+                data = await self.scheduler.submit(send, priority)
+            else:
+                data = await send()
+            return call.finish(data)
+
+        key = call.coalesce_key() if self.singleflight is not None else None
+        if key is not None:
+            return await self.singleflight.do(key, fetch)
+        return await fetch()
+
+    async def _resilient_post(self, call: ChatCall, timeouts: Optional[Timeouts]) -> Dict[str, Any]:
+        attempts = Attempts(self, call.call_site, timeouts, call.deadline, call.cancel)
+        while True:
+            attempt_timeouts = attempts.begin()
+            try:
+                data = await self._hedged_post(call.sent, attempt_timeouts, attempts, call.cancel, call.deadline)
+            except BaseException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            return attempts.succeeded(data)
+
+    async def _hedged_post(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        attempts: Attempts,
+        cancel: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Voir LlamaClient._hedged_post ; le perdant est une tâche annulée, ce
+        qui ferme sa connexion.
+        """
+        delay = attempts.hedge_after()
+        if delay is None:
+            return await self._post(payload, timeouts, cancel, deadline)
+
+        primary = asyncio.ensure_future(self._post(payload, timeouts, cancel, deadline))
+        pending = {primary}
+        error: Optional[BaseException] = None
+        # appelant annulé à n'importe quelle étape : les requêtes en cours sont annulées
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done or not attempts.try_hedge():
+                return await primary
+
+            hedge = asyncio.ensure_future(self._post(payload, timeouts, cancel, deadline))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            attempts.hedge_won()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        cancel: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        if self.cassette is not None and self.cassette.replaying:
+            recording = self.cassette.lookup(payload)
+            await asyncio.sleep(self.cassette.delay(recording))
+            return recording.response
+
+        start = time.monotonic()
+        data = await _cancellable(self._send(payload, timeouts, deadline), cancel)
+        if self.cassette is not None:
+            self.cassette.record(payload, data, time.monotonic() - start)
+        return data
+
+    async def _send(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        session = await self.session()
+        timeout = self._client_timeout(timeouts)
+        with self._endpoint(deadline, payload.get(BACKEND_URL)) as url:
+            try:
+                if payload.get(STOP_AT_JSON):
+                    return await self._post_until_json(session, url, payload, timeout)
+                async with session.post(url, json=request_body(payload), timeout=timeout) as response:
+                    response.raise_for_status()
+                    # corps illisible : ContentTypeError (ClientError) ou ValueError
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                raise _http_error(e) from e
+
+    async def _post_until_json(
+        self,
+        session: aiohttp.ClientSession,
+        url: str,
+        payload: Dict[str, Any],
+        timeout: Optional[aiohttp.ClientTimeout],
+    ) -> Dict[str, Any]:
+        """
+        Version asyncio de LlamaClient._post_until_json (l'annulation passe
+        par _cancellable, qui annule la tâche et donc ferme la connexion).
+        """
+        sent = request_body(payload)
+        sent.update(stream=True, stream_options={"include_usage": True})
+        scanner = JsonObjectScanner()
+        usage = finish = None
+        pieces = 0
+        async with session.post(url, json=sent, timeout=timeout) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                chunk = parse_sse_line(line)
+                if chunk is None:
+                    continue
+                if chunk == SSE_DONE:
+                    break
+                usage = chunk.get("usage") or usage
+                finish = chunk_finish_reason(chunk) or finish
+                text = delta_text(chunk)
+                if text:
+                    pieces += 1
+                    if scanner.feed(text) and scanner.trailing_text():
+                        # connexion fermée (pas rendue au pool) : llama-server arrête de générer
+                        response.close()
+                        break
+        annotate(stopped_at_json=scanner.done)
+        return json_stream_response(scanner, sent, usage, pieces, finish)
+
+    async def stream_chat(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Optional[Timeouts] = None,
+        call_site: Optional[str] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Même appel avec "stream": true : itérateur asynchrone des morceaux de texte.
+        Pas de retry ni de hedge, mais le circuit breaker s'applique.
+        Un consommateur qui s'arrête avant la fin doit le fermer (aclose(),
+        contextlib.aclosing) pour couper la connexion aussitôt.
+        """
+        timeouts = timeouts or self.policy_for(call_site).timeouts or self.timeouts
+        payload, timeouts, deadline, cancel = prepare_stream(payload, timeouts)
+        if self.cassette is not None and self.cassette.replaying:
+            recording = self.cassette.lookup(payload)
+            pause = self.cassette.delay(recording) / max(len(recording.chunks), 1)
+            for text in recording.chunks:
+                await asyncio.sleep(pause)
+                yield text
+            record_usage(call_site, {"usage": recording.usage})
+            return
+
+        session = await self.session()
+        timeout = self._client_timeout(timeouts)
+        self.breaker.before_call()
+        start = time.monotonic()
+        chunks: List[str] = []
+        usage = None
+        connected = False
+        try:
+            with self._endpoint(deadline, payload.get(BACKEND_URL)) as url:
+                try:
+                    async with session.post(url, json=request_body(payload), timeout=timeout) as response:
+                        response.raise_for_status()
+                        self.breaker.record_success()
+                        connected = True
+                        # annulation pendant le flux : on ferme la connexion qui le porte
+                        loop = asyncio.get_running_loop()
+                        unlink = cancel.on_cancel(lambda: loop.call_soon_threadsafe(response.close)) if cancel else None
+                        try:
+                            async for line in response.content:
+                                chunk = parse_sse_line(line)
+                                if chunk is None:
+                                    continue
+                                if chunk == SSE_DONE:
+                                    break
+                                usage = chunk.get("usage") or usage
+                                text = delta_text(chunk)
+                                if text:
+                                    chunks.append(text)
+                                    yield text
+                        except (GeneratorExit, asyncio.CancelledError):
+                            # consommateur parti avant la fin (aclose, annulation) : connexion
+                            # fermée plutôt que rendue au pool, llama-server arrête de générer
+                            response.close()
+                            raise
+                        finally:
+                            if unlink is not None:
+                                unlink()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if cancel is not None and cancel.cancelled:
+                        raise RequestCancelled("Flux llama-server annulé") from e
+                    raise _http_error(e) from e
+                if cancel is not None:
+                    cancel.check()
+        except BaseException as e:
+            record_stream_outcome(self.breaker, e, connected, deadline)
+            raise
+        record_usage(call_site, {"usage": usage})
+        if self.cassette is not None:
+            self.cassette.record_stream(payload, chunks, time.monotonic() - start, usage)
+
+    async def close(self) -> None:
+        if self.cassette is not None:
+            self.cassette.close()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+def _http_error(e: BaseException) -> Exception:
+    """
+    Version aiohttp de pool._http_error (l'annulation est traitée à part).
+    """
+    if isinstance(e, aiohttp.ClientResponseError) and is_request_error(e.status):
+        return LlamaRequestError(f"Requête refusée par llama-server ({e.status}): {e.message}", e.status)
+    return RuntimeError(f"Erreur lors de l'appel à llama-server: {e!r}")
+
+
+async def _cancellable(call: Awaitable[T], cancel: Optional[CancelToken]) -> T:
+    """
+    Attend `call` ; si `cancel` est annulé (depuis n'importe quel thread), la
+    tâche est annulée, ce qui ferme sa connexion aiohttp et libère le slot.
+    """
+    if cancel is None:
+        return await call
+    task = asyncio.ensure_future(call)
+    loop = asyncio.get_running_loop()
+    unlink = cancel.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        current = asyncio.current_task()
+        if cancel.cancelled and not (current is not None and current.cancelling()):
+            raise RequestCancelled("Appel llama-server annulé") from None
+        raise
+    finally:
+        unlink()
+
+
+# =========================
+# Client asynchrone partagé par défaut
+# =========================
+
+_default_async_client: Optional[AsyncLlamaClient] = None
+
+
+def get_default_async_client() -> AsyncLlamaClient:
+    global _default_async_client
+    if _default_async_client is None:
+        _default_async_client = AsyncLlamaClient(cache=ResponseCache(), cassette=cassette_from_env())
+    return _default_async_client
+
+
+def set_default_async_client(client: AsyncLlamaClient) -> None:
+    global _default_async_client
+    _default_async_client = client
+
+
+_async_clients_by_url: Dict[str, AsyncLlamaClient] = {}
+
+
+def get_async_client_for(url: Optional[str]) -> AsyncLlamaClient:
+    """
+    Version asyncio de llama_client.get_client_for.
+    """
+    default = get_default_async_client()
+    if url is None or url == default.url:
+        return default
+    client = _async_clients_by_url.get(url)
+    if client is None:
+        client = AsyncLlamaClient(url=url, cache=default.cache, cassette=default.cassette)
+        _async_clients_by_url[url] = client
+    return client
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+from .deadline import Deadline
+from .resilience import LlamaRequestError
+from .tracing import INFO, event
+
+CHAT_PATH = "/v1/chat/completions"
+
+# Champ de payload (retiré avant l'envoi) : backend imposé pour cet appel,
+# celui du slot épinglé par SlotAffinity
+BACKEND_URL = "_backend_url"
+
+
+@dataclass
+class Backend:
+    """
+    Une instance llama-server et ce qu'on sait de sa charge.
+    - outstanding : requêtes envoyées par ce processus et pas encore terminées
+    - slots_idle / slots_total : lus sur /slots (ou /metrics) par le health check
+    """
+    base_url: str
+    outstanding: int = 0
+    healthy: bool = True
+    consecutive_failures: int = 0
+    slots_idle: Optional[int] = None
+    slots_total: Optional[int] = None
+
+    @property
+    def chat_url(self) -> str:
+        return self.base_url + CHAT_PATH
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "slots_idle": self.slots_idle,
+            "slots_total": self.slots_total,
+        }
+
+
+class BackendPool:
+    """
+    Répartit les requêtes sur plusieurs llama-server (least outstanding requests).
+
+    - pick() choisit le backend sain avec le moins de requêtes en cours
+      (à égalité, celui qui a le plus de slots libres d'après /slots)
+    - un backend qui échoue max_failures fois de suite est retiré de la
+      rotation (drainé) jusqu'à ce qu'un health check /health repasse
+    - start_health_checks() lance les vérifications dans un thread de fond
+    """
+
+    def __init__(
+        self,
+        base_urls: List[str],
+        max_failures: int = 2,
+        health_interval: float = 5.0,
+        health_timeout: float = 2.0,
+    ):
+        if not base_urls:
+            raise ValueError("BackendPool a besoin d'au moins une URL")
+        self.backends: List[Backend] = [Backend(u.rstrip("/")) for u in base_urls]
+        self.max_failures = max_failures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._http = requests.Session()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Sélection ---
+
+    def pick(self, base_url: Optional[str] = None) -> Backend:
+        """
+        base_url : backend imposé (slot épinglé), s'il est sain ; sinon le
+        moins chargé.
+        """
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy]
+            if not candidates:
+                raise RuntimeError("Aucun backend llama-server disponible (tous drainés)")
+            pinned = [b for b in candidates if b.base_url == base_url]
+            backend = pinned[0] if pinned else min(candidates, key=lambda b: (b.outstanding, -(b.slots_idle or 0)))
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend: Backend, ok: Optional[bool]) -> None:
+        """
+        ok=None : requête abandonnée côté client, ni succès ni échec.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if ok is None:
+                return
+            if ok:
+                backend.consecutive_failures = 0
+                return
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures and backend.healthy:
+                backend.healthy = False
+                event("backend_drained", INFO, url=backend.base_url, failures=backend.consecutive_failures)
+
+    @contextmanager
+    def use(self, deadline: Optional[Deadline] = None, base_url: Optional[str] = None) -> Iterator[Backend]:
+        """
+        with pool.use() as backend: ... -> compte la requête en cours et
+        enregistre le succès ou l'échec (RuntimeError du client ; une requête
+        refusée, LlamaRequestError, est une réponse normale du backend).
+        deadline : échéance du tour ; une erreur après son expiration (timeout
+        raccourci par l'échéance) n'est pas comptée contre le backend.
+        base_url : voir pick().
+        """
+        backend = self.pick(base_url)
+        try:
+            yield backend
+        except LlamaRequestError:
+            self.release(backend, ok=True)
+            raise
+        except RuntimeError:
+            self.release(backend, ok=None if deadline is not None and deadline.expired() else False)
+            raise
+        except BaseException:
+            self.release(backend, ok=True)
+            raise
+        else:
+            self.release(backend, ok=True)
+
+    # --- Health checks ---
+
+    def check(self, backend: Backend) -> bool:
+        """
+        GET /health, puis lecture de la charge sur /slots (ou /metrics à défaut).
+        """
+        try:
+            r = self._http.get(backend.base_url + "/health", timeout=self.health_timeout)
+            ok = r.status_code == 200
+        except requests.RequestException:
+            ok = False
+
+        if ok:
+            self._read_load(backend)
+
+        with self._lock:
+            if ok and not backend.healthy:
+                event("backend_recovered", INFO, url=backend.base_url)
+            backend.healthy = ok
+            if ok:
+                backend.consecutive_failures = 0
+        return ok
+
+    def _read_load(self, backend: Backend) -> None:
+        try:
+            r = self._http.get(backend.base_url + "/slots", timeout=self.health_timeout)
+            if r.status_code == 200:
+                slots = r.json()
+                busy = sum(1 for s in slots if _slot_is_busy(s))
+                backend.slots_total = len(slots)
+                backend.slots_idle = len(slots) - busy
+                return
+
+            # /slots désactivé (--no-slots) : on essaie /metrics (--metrics)
+            r = self._http.get(backend.base_url + "/metrics", timeout=self.health_timeout)
+            if r.status_code == 200:
+                processing = _prometheus_value(r.text, "llamacpp:requests_processing")
+                if processing is not None and backend.slots_total:
+                    backend.slots_idle = max(backend.slots_total - int(processing), 0)
+        except (requests.RequestException, ValueError):
+            pass
+
+    def check_all(self) -> None:
+        for backend in self.backends:
+            self.check(backend)
+
+    def start_health_checks(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.is_set():
+                self.check_all()
+                self._stop.wait(self.health_interval)
+
+        self._thread = threading.Thread(target=loop, name="llama-health", daemon=True)
+        self._thread.start()
+
+    def stop_health_checks(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.snapshot() for b in self.backends]
+
+
+def _slot_is_busy(slot: Dict[str, Any]) -> bool:
+    # Versions récentes : "is_processing" ; anciennes : "state" (0 = idle)
+    if "is_processing" in slot:
+        return bool(slot["is_processing"])
+    return slot.get("state", 0) != 0
+
+
+def _prometheus_value(text: str, name: str) -> Optional[float]:
+    match = re.search(rf"^{re.escape(name)}(?:{{[^}}]*}})?\s+([0-9.eE+-]+)", text, re.MULTILINE)
+    return float(match.group(1)) if match else None
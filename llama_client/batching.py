@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from .balancer import BackendPool
+
+T = TypeVar("T")
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    requests: int = 0
+    largest: int = 0
+
+    def record(self, size: int) -> None:
+        self.batches += 1
+        self.requests += size
+        self.largest = max(self.largest, size)
+
+    @property
+    def mean_size(self) -> float:
+        return self.requests / self.batches if self.batches else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "largest": self.largest,
+            "mean_size": self.mean_size,
+        }
+
+
+class _BurstSizing:
+    """
+    Appels en cours autorisés = nombre de slots de décodage parallèles du serveur
+    (--parallel de llama-server), lu sur le BackendPool s'il est connu.
+    """
+
+    def __init__(self, slots: int, backends: Optional[BackendPool]):
+        self.slots = slots
+        self.backends = backends
+
+    def burst_size(self) -> int:
+        if self.backends is not None:
+            known = [
+                b.slots_total for b in self.backends.backends
+                if b.healthy and b.slots_total
+            ]
+            if known:
+                return sum(known)
+        return max(self.slots, 1)
+
+
+class AsyncMicroBatcher(_BurstSizing):
+    """
+    Garde au plus autant d'appels LLM en cours que le serveur a de slots :
+    quand tous les slots sont libres, les appels qui arrivent dans une courte
+    fenêtre (window, en s) partent ensemble ; ensuite chaque appel terminé
+    libère sa place pour le suivant de la file, sans attendre le plus lent
+    de sa vague. Chaque appelant reçoit son propre résultat.
+
+    Les appels sont des "thunks" (fonctions sans argument qui lancent la
+    requête) : AsyncLlamaClient y passe son appel HTTP après cache/single-flight.
+    """
+
+    def __init__(self, window: float = 0.005, slots: int = 4, backends: Optional[BackendPool] = None):
+        super().__init__(slots, backends)
+        self.window = window
+        self.stats = BatchStats()
+        self._queue: List[Tuple[Callable[[], Awaitable[Any]], asyncio.Future]] = []
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._inflight = 0
+        self._slot_freed: Optional[asyncio.Event] = None
+        self._running: Set[asyncio.Task] = set()
+
+    async def submit(self, thunk: Callable[[], Awaitable[T]]) -> T:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((thunk, future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        return await future
+
+    async def _dispatch(self) -> None:
+        slot_freed = self._slot_freed = asyncio.Event()
+        while self._queue:
+            free = self.burst_size() - self._inflight
+            if free <= 0:
+                slot_freed.clear()
+                await slot_freed.wait()
+                continue
+            if self._inflight == 0 and len(self._queue) < free:
+                await asyncio.sleep(self.window)  # fenêtre de collecte de la première vague
+                free = self.burst_size() - self._inflight
+            batch, self._queue = self._queue[:free], self._queue[free:]
+            self.stats.record(len(batch))
+            for thunk, future in batch:
+                self._inflight += 1
+                task = asyncio.ensure_future(self._run(thunk, future))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+    async def _run(self, thunk: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        try:
+            result = await thunk()
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._inflight -= 1
+            if self._slot_freed is not None:
+                self._slot_freed.set()
+
+
+class MicroBatcher(_BurstSizing):
+    """
+    Même chose pour LlamaClient (un thread par session) : un thread de
+    dispatch lance les appels dans un pool de threads, au plus un par slot,
+    et en relance un dès qu'un se termine ; l'appelant bloque jusqu'à son
+    propre résultat.
+    """
+
+    def __init__(
+        self,
+        window: float = 0.005,
+        slots: int = 4,
+        backends: Optional[BackendPool] = None,
+        max_workers: int = 32,
+    ):
+        super().__init__(slots, backends)
+        self.window = window
+        self.stats = BatchStats()
+        self._queue: List[Tuple[Callable[[], Any], Future]] = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llama-batch")
+        self._thread: Optional[threading.Thread] = None
+        self._inflight = 0
+
+    def submit(self, thunk: Callable[[], T]) -> T:
+        future: Future = Future()
+        with self._cond:
+            self._queue.append((thunk, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="llama-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future.result()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue or self._inflight >= self.burst_size():
+                    self._cond.wait()
+                first_wave = self._inflight == 0 and len(self._queue) < self.burst_size()
+            if first_wave:
+                time.sleep(self.window)  # fenêtre de collecte de la première vague
+
+            with self._cond:
+                free = self.burst_size() - self._inflight
+                batch, self._queue = self._queue[:free], self._queue[free:]
+                self._inflight += len(batch)
+            self.stats.record(len(batch))
+            for thunk, future in batch:
+                self._executor.submit(self._run, thunk, future)
+
+    def _run(self, thunk: Callable[[], Any], future: Future) -> None:
+        try:
+            future.set_result(thunk())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify()
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+from .balancer import BACKEND_URL
+
+
+# Champs qui choisissent où la requête est traitée, pas ce qu'elle répond
+PLACEMENT_KEYS = ("id_slot", BACKEND_URL)
+
+
+def payload_key(payload: Dict[str, Any]) -> str:
+    """
+    Clé stable d'un payload : sha256 du JSON canonique (clés triées, sans espaces).
+    Deux payloads égaux (model, messages, paramètres) ont la même clé,
+    quel que soit le slot (id_slot, backend) demandé.
+    """
+    payload = {k: v for k, v in payload.items() if k not in PLACEMENT_KEYS}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_deterministic(payload: Dict[str, Any]) -> bool:
+    """
+    Seuls les appels à temperature 0 (et non streamés) redonnent toujours
+    la même réponse : eux seuls peuvent être mis en cache ou mutualisés.
+    """
+    return not payload.get("stream") and float(payload.get("temperature", 1.0)) == 0.0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    disk_hits: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_ratio": self.hit_ratio,
+        }
+
+
+class ResponseCache:
+    """
+    Cache des réponses llama-server pour les appels déterministes.
+
+    - LRU borné en mémoire (maxsize entrées)
+    - optionnellement persistant dans un fichier SQLite (path), qui survit
+      aux redémarrages ; une entrée trouvée sur disque remonte dans le LRU.
+    """
+
+    def __init__(self, maxsize: int = 1024, path: Optional[Union[str, Path]] = None):
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def get(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        key = payload_key(payload)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return data
+
+            if self._db is not None:
+                row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    data = json.loads(row[0])
+                    self._remember(key, data)
+                    self.stats.hits += 1
+                    self.stats.disk_hits += 1
+                    return data
+
+            self.stats.misses += 1
+            return None
+
+    def put(self, payload: Dict[str, Any], data: Dict[str, Any]) -> None:
+        key = payload_key(payload)
+        with self._lock:
+            self._remember(key, data)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(data, ensure_ascii=False), time.time()),
+                )
+                self._db.commit()
+
+    def _remember(self, key: str, data: Dict[str, Any]) -> None:
+        self._entries[key] = data
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
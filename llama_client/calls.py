@@ -0,0 +1,281 @@
+"""
+Politique d'appel commune à LlamaClient (pool.py) et AsyncLlamaClient (aio.py) :
+cache, mutualisation, ajustement à l'échéance du tour, retries, hedge et
+comptabilité du circuit breaker. Les deux clients ne gardent que les
+entrées / sorties (requests ou aiohttp, threads ou tâches).
+"""
+
+from __future__ import annotations
+
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from .cache import ResponseCache, is_deterministic, payload_key
+from .cancel import CancelToken, current_cancel_token
+from .config import Timeouts
+from .deadline import Deadline, DeadlineExceeded, current_deadline
+from .resilience import CallPolicy, CircuitBreaker, LlamaRequestError
+from .streaming import STOP_AT_JSON
+from .tracing import INFO, annotate, event
+from .usage import record_usage
+
+
+# =========================
+# Préparation d'un appel
+# =========================
+
+@dataclass
+class ChatCall:
+    """
+    Un appel post_chat une fois le contexte du tour capturé.
+    - payload : payload demandé (clé du cache)
+    - sent : payload envoyé (max_tokens réduit au temps restant)
+    - deadline / cancel : échéance et jeton d'annulation du tour, capturés à
+      l'appel car les threads / tâches du batcher et du hedge ne voient pas le contexte
+    - cache : cache consulté, None si l'appel n'y a pas droit
+    - store : la réponse peut être mise en cache sous la clé de `payload`
+    """
+    payload: Dict[str, Any]
+    sent: Dict[str, Any]
+    call_site: Optional[str]
+    deadline: Optional[Deadline]
+    cancel: Optional[CancelToken]
+    cache: Optional[ResponseCache]
+    deterministic: bool
+    store: bool
+
+    @classmethod
+    def prepare(
+        cls,
+        payload: Dict[str, Any],
+        cache: Optional[ResponseCache],
+        call_site: Optional[str],
+        stop_at_json: bool = False,
+    ) -> "ChatCall":
+        """
+        cache : cache du client si l'appelant l'autorise (use_cache), sinon None.
+        """
+        deadline = current_deadline()
+        if deadline is not None:
+            deadline.check()
+        cancel = current_cancel_token()
+        if cancel is not None:
+            cancel.check()
+
+        if stop_at_json:
+            payload = {**payload, STOP_AT_JSON: True}
+        deterministic = is_deterministic(payload)
+
+        # max_tokens réduit au temps restant ; une réponse tronquée ainsi
+        # n'est pas mise en cache sous la clé du payload complet
+        sent = deadline.fit_payload(payload) if deadline is not None else payload
+        return cls(
+            payload=payload,
+            sent=sent,
+            call_site=call_site,
+            deadline=deadline,
+            cancel=cancel,
+            cache=cache if deterministic else None,
+            deterministic=deterministic,
+            store=sent is payload,
+        )
+
+    def cached(self) -> Optional[Dict[str, Any]]:
+        if self.cache is None:
+            return None
+        data = self.cache.get(self.payload)
+        if data is not None:
+            annotate(cache="hit")
+        return data
+
+    def coalesce_key(self) -> Optional[str]:
+        """
+        Clé de mutualisation (SingleFlight), None si l'appel ne doit pas être partagé.
+        """
+        # un appel annulable n'est pas partagé : l'annuler couperait celui des autres
+        if not self.deterministic or self.cancel is not None:
+            return None
+        return payload_key(self.sent)
+
+    def finish(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.cache is not None and self.store:
+            self.cache.put(self.payload, data)
+        record_usage(self.call_site, data)
+        return data
+
+
+def prepare_stream(
+    payload: Dict[str, Any],
+    timeouts: Timeouts,
+) -> Tuple[Dict[str, Any], Timeouts, Optional[Deadline], Optional[CancelToken]]:
+    """
+    Payload et timeouts d'un appel streamé, ajustés à l'échéance du tour,
+    avec l'échéance et le jeton d'annulation courants.
+    """
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check()
+        timeouts = deadline.fit_timeouts(timeouts)
+        payload = deadline.fit_payload(payload)
+    cancel = current_cancel_token()
+    if cancel is not None:
+        cancel.check()
+    return payload, timeouts, deadline, cancel
+
+
+# =========================
+# Tentatives
+# =========================
+
+def server_failed(error: BaseException, deadline: Optional[Deadline] = None) -> bool:
+    """
+    L'erreur est-elle un échec du serveur ? Seules les RuntimeError du client
+    comptent (connexion, timeout, 5xx, réponse illisible) ; une annulation,
+    une CassetteMiss, une CancelledError, une requête refusée (4xx) ou un
+    timeout raccourci par l'échéance du tour (expirée) ne sont pas la faute
+    du serveur.
+    """
+    if not isinstance(error, RuntimeError) or isinstance(error, LlamaRequestError):
+        return False
+    return deadline is None or not deadline.expired()
+
+
+def record_outcome(breaker: CircuitBreaker, error: BaseException, deadline: Optional[Deadline] = None) -> bool:
+    """
+    Enregistre dans `breaker` une tentative terminée par `error` : échec si
+    server_failed, abandon sinon. Dans les deux cas l'essai semi-ouvert
+    éventuel est libéré (sinon le circuit resterait semi-ouvert pour de bon).
+    Retourne server_failed.
+    """
+    if server_failed(error, deadline):
+        breaker.record_failure()
+        return True
+    breaker.record_abandoned()
+    return False
+
+
+def record_stream_outcome(
+    breaker: CircuitBreaker,
+    error: BaseException,
+    connected: bool,
+    deadline: Optional[Deadline] = None,
+) -> None:
+    """
+    Flux (sans retry) interrompu par `error`. Avant les en-têtes, comme
+    record_outcome ; après (succès déjà enregistré), seul un échec du
+    serveur est compté.
+    """
+    if not connected:
+        record_outcome(breaker, error, deadline)
+    elif server_failed(error, deadline):
+        breaker.record_failure()
+
+
+class Attempts:
+    """
+    Tentatives d'un appel : circuit breaker, retries (policy + RetryBudget),
+    hedge et latences observées. Chaque client n'écrit que la boucle, avec
+    son envoi et son attente :
+
+        attempts = Attempts(client, call_site, timeouts, deadline, cancel)
+        while True:
+            timeouts = attempts.begin()
+            try:
+                data = <envoi>
+            except BaseException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+                <attente de delay>
+                continue
+            return attempts.succeeded(data)
+
+    `client` : LlamaClient ou AsyncLlamaClient (policy_for, timeouts,
+    breaker, retry_budget, latencies, hedge_stats).
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        call_site: Optional[str],
+        timeouts: Optional[Timeouts],
+        deadline: Optional[Deadline] = None,
+        cancel: Optional[CancelToken] = None,
+    ):
+        self.client = client
+        self.policy: CallPolicy = client.policy_for(call_site)
+        self.site = call_site or "default"
+        self.timeouts = timeouts or self.policy.timeouts or client.timeouts
+        self.deadline = deadline
+        self.cancel = cancel
+        self.attempt = 0
+        self._start = 0.0
+        client.retry_budget.deposit()
+
+    def begin(self) -> Timeouts:
+        """
+        Avant chaque tentative : échéance, annulation, circuit breaker.
+        Retourne les timeouts de la tentative (réduits au temps restant).
+        """
+        timeouts = self.timeouts
+        if self.deadline is not None:
+            self.deadline.check()
+            timeouts = self.deadline.fit_timeouts(timeouts)
+        if self.cancel is not None:
+            self.cancel.check()
+        self.client.breaker.before_call()
+        self._start = time.monotonic()
+        return timeouts
+
+    def succeeded(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        self.client.breaker.record_success()
+        self.client.latencies.record(self.site, time.monotonic() - self._start)
+        return data
+
+    def failed(self, error: BaseException) -> Optional[float]:
+        """
+        Enregistre l'échec de la tentative, quelle que soit l'exception.
+        Retourne l'attente avant la suivante, ou None si `error` doit
+        remonter telle quelle.
+        """
+        if not record_outcome(self.client.breaker, error, self.deadline):
+            if server_failed(error) and self.deadline is not None and self.deadline.expired():
+                # timeout raccourci par l'échéance du tour : pas la faute du serveur
+                raise DeadlineExceeded(f"Temps alloué au tour écoulé pendant l'appel ({self.site})") from error
+            return None
+        if self.attempt >= self.policy.max_retries or not self.client.retry_budget.try_withdraw():
+            return None
+        delay = self.policy.retry_backoff * (2 ** self.attempt)
+        if self.deadline is not None and self.deadline.remaining() <= delay:
+            return None
+        self.attempt += 1
+        event("retry", INFO, site=self.site, attempt=self.attempt + 1, delay=delay, error=str(error))
+        return delay
+
+    # --- Hedge ---
+
+    def hedge_after(self) -> Optional[float]:
+        """
+        Attente avant d'envoyer un doublon, None si l'appel n'est pas doublé
+        (policy sans hedge, pas encore assez de latences observées).
+        """
+        if not self.policy.hedge:
+            return None
+        threshold = self.client.latencies.quantile(self.site, self.policy.hedge_quantile)
+        if threshold is None:
+            return None
+        return max(threshold, self.policy.hedge_min_delay)
+
+    def try_hedge(self) -> bool:
+        """
+        Le doublon est-il envoyé ? (il consomme un jeton du RetryBudget)
+        """
+        if not self.client.retry_budget.try_withdraw():
+            return False
+        self.client.hedge_stats.sent += 1
+        return True
+
+    def hedge_won(self) -> None:
+        self.client.hedge_stats.won += 1
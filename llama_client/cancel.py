@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+from .tracing import INFO, event
+
+
+class RequestCancelled(Exception):
+    """
+    L'appel LLM a été annulé (CancelToken.cancel()). Volontairement pas une
+    RuntimeError : ni retry, ni échec compté par le circuit breaker ou le
+    BackendPool.
+    """
+
+
+class CancelToken:
+    """
+    Jeton d'annulation partagé entre celui qui lance un tour et celui qui
+    l'abandonne (nouveau message, "reset"...).
+
+    cancel() peut être appelé depuis n'importe quel thread : les callbacks
+    enregistrés par le client coupent alors les connexions HTTP en cours,
+    ce qui libère le slot côté llama-server.
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                event("cancel_callback_error", INFO, error=str(e))
+
+    def check(self) -> None:
+        if self._cancelled:
+            raise RequestCancelled("Appel LLM annulé")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Enregistre `callback` (appelé tout de suite si déjà annulé).
+        Retourne la fonction qui le désenregistre.
+        """
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_current: contextvars.ContextVar[Optional[CancelToken]] = contextvars.ContextVar("llama_cancel", default=None)
+
+
+def current_cancel_token() -> Optional[CancelToken]:
+    return _current.get()
+
+
+@contextmanager
+def cancel_scope(token: Optional[CancelToken]) -> Iterator[Optional[CancelToken]]:
+    """
+    Les appels LLM faits dans le bloc sont annulés par `token`
+    (comme deadline_scope pour l'échéance du tour). Annuler un jeton
+    englobant annule aussi celui-ci.
+    """
+    outer = _current.get()
+    if token is None or token is outer:
+        yield outer
+        return
+    unlink = outer.on_cancel(token.cancel) if outer is not None else (lambda: None)
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+        unlink()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import atexit
+import gzip
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional
+
+from .cache import payload_key
+
+RECORD = "record"
+REPLAY = "replay"
+MODES = (RECORD, REPLAY)
+
+# Activation sans toucher au code : LLAMA_CASSETTE=fichier.jsonl[.gz]
+# et LLAMA_CASSETTE_MODE=record | replay | replay-realtime
+CASSETTE_ENV = "LLAMA_CASSETTE"
+CASSETTE_MODE_ENV = "LLAMA_CASSETTE_MODE"
+
+
+class CassetteMiss(LookupError):
+    """
+    Requête absente de la cassette en mode replay. Volontairement pas une
+    RuntimeError : ni retry ni circuit breaker, le prompt a changé depuis
+    l'enregistrement.
+    """
+
+
+@dataclass
+class Recording:
+    """
+    Une réponse enregistrée : réponse JSON complète (appel normal) ou
+    morceaux de texte et bloc usage (streaming), et la latence mesurée en secondes.
+    """
+    latency: float
+    response: Optional[Dict[str, Any]] = None
+    chunks: Optional[List[str]] = None
+    usage: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class CassetteStats:
+    recorded: int = 0
+    replayed: int = 0
+    missed: int = 0
+
+
+def cassette_key(payload: Dict[str, Any]) -> str:
+    """
+    Clé d'un échange : le payload sans max_tokens, qui varie d'une exécution
+    à l'autre quand une échéance de tour réduit la génération.
+    """
+    return payload_key({k: v for k, v in payload.items() if k != "max_tokens"})
+
+
+class Cassette:
+    """
+    Enregistre / rejoue le trafic llama-server (couche transport de LlamaClient
+    et AsyncLlamaClient, donc valable pour tp_final comme pour exo2).
+
+    - mode "record" : chaque échange réussi est ajouté au fichier (JSONL,
+      compressé si le nom finit par .gz) avec sa latence mesurée
+    - mode "replay" : les réponses sont servies depuis le fichier, sans réseau,
+      instantanément ou à la latence enregistrée (realtime=True)
+
+    Une même requête enregistrée plusieurs fois (temperature > 0) est rejouée
+    dans l'ordre d'enregistrement ; la dernière réponse sert ensuite en boucle.
+    """
+
+    def __init__(self, path: str | Path, mode: str = REPLAY, realtime: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"Mode de cassette inconnu: {mode!r} (attendu: {', '.join(MODES)})")
+        self.path = Path(path)
+        self.mode = mode
+        self.realtime = realtime
+        self.stats = CassetteStats()
+        self._lock = threading.Lock()
+        self._tapes: Dict[str, List[Recording]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._file: Optional[IO[str]] = None
+
+        if mode == REPLAY:
+            self._load()
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def _open(self, mode: str) -> IO[str]:
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        with self._open("r") as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    recording = Recording(
+                        entry["latency"], entry.get("response"), entry.get("chunks"), entry.get("usage")
+                    )
+                    self._tapes.setdefault(entry["key"], []).append(recording)
+            except (EOFError, json.JSONDecodeError):
+                pass  # fin tronquée (enregistrement interrompu) : on garde ce qui précède
+
+    # --- Mode record ---
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = self._open("a")
+                atexit.register(self.close)  # termine proprement le flux gzip
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.stats.recorded += 1
+
+    def record(self, payload: Dict[str, Any], response: Dict[str, Any], latency: float) -> None:
+        self._append({"key": cassette_key(payload), "latency": round(latency, 4), "response": response})
+
+    def record_stream(
+        self,
+        payload: Dict[str, Any],
+        chunks: List[str],
+        latency: float,
+        usage: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        entry = {"key": cassette_key(payload), "latency": round(latency, 4), "chunks": chunks}
+        if usage is not None:
+            entry["usage"] = usage
+        self._append(entry)
+
+    # --- Mode replay ---
+
+    def lookup(self, payload: Dict[str, Any]) -> Recording:
+        key = cassette_key(payload)
+        with self._lock:
+            tape = self._tapes.get(key)
+            if not tape:
+                self.stats.missed += 1
+                raise CassetteMiss(f"Requête absente de la cassette {self.path} (clé {key[:12]})")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            self.stats.replayed += 1
+            return tape[min(index, len(tape) - 1)]
+
+    def delay(self, recording: Recording) -> float:
+        """
+        Attente à simuler avant de rendre la réponse (0 en replay accéléré).
+        """
+        return recording.latency if self.realtime else 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def cassette_from_env() -> Optional[Cassette]:
+    """
+    Cassette décrite par LLAMA_CASSETTE / LLAMA_CASSETTE_MODE, ou None.
+    """
+    path = os.environ.get(CASSETTE_ENV)
+    if not path:
+        return None
+    mode = os.environ.get(CASSETTE_MODE_ENV, REPLAY)
+    realtime = mode == "replay-realtime"
+    return Cassette(path, mode=REPLAY if realtime else mode, realtime=realtime)
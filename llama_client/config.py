@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+LLAMA_SERVER_URL = "http://localhost:8080/v1/chat/completions"
+
+
+@dataclass
+class Timeouts:
+    """
+    Timeouts par phase (en secondes) :
+    - connect : ouverture de la connexion TCP
+    - read : attente entre deux paquets de la réponse (inférence comprise)
+    """
+    connect: float = 3.0
+    read: float = 60.0
+
+    def as_requests(self) -> tuple[float, float]:
+        return (self.connect, self.read)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .config import Timeouts
+
+# Vitesse de génération supposée pour adapter max_tokens au temps restant
+# (ordre de grandeur d'un modèle 3B quantifié sur CPU)
+DEFAULT_TOKENS_PER_SECOND = 20.0
+
+# En dessous de ce temps restant, on saute les étapes optionnelles
+# (escalade vers un modèle plus gros, reformulation LLM de la réponse finale)
+OPTIONAL_STEP_MIN_SECONDS = 3.0
+
+
+class DeadlineExceeded(Exception):
+    """
+    Le temps alloué au tour est écoulé : l'appel n'est pas envoyé, ou a été
+    interrompu. Volontairement pas une RuntimeError : ni retry, ni échec
+    compté par le circuit breaker ou le BackendPool.
+    """
+
+
+class Deadline:
+    """
+    Échéance absolue d'un tour de conversation.
+
+    Tous les appels LLM faits pendant le tour en héritent (via deadline_scope) :
+    leurs timeouts et leur max_tokens sont réduits au temps restant.
+    """
+
+    def __init__(self, seconds: float, tokens_per_second: float = DEFAULT_TOKENS_PER_SECOND):
+        self.expires_at = time.monotonic() + seconds
+        self.tokens_per_second = tokens_per_second
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def allows(self, seconds: float = OPTIONAL_STEP_MIN_SECONDS) -> bool:
+        """
+        True s'il reste au moins `seconds` : de quoi faire une étape optionnelle.
+        """
+        return self.remaining() >= seconds
+
+    def check(self) -> None:
+        if self.expired():
+            raise DeadlineExceeded("Temps alloué au tour écoulé, appel LLM annulé")
+
+    def fit_timeouts(self, timeouts: Timeouts) -> Timeouts:
+        remaining = self.remaining()
+        return Timeouts(connect=min(timeouts.connect, remaining), read=min(timeouts.read, remaining))
+
+    def fit_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Réduit max_tokens à ce qu'on peut générer dans le temps restant.
+        """
+        budget = max(int(self.remaining() * self.tokens_per_second), 1)
+        max_tokens = payload.get("max_tokens")
+        if max_tokens is not None and max_tokens <= budget:
+            return payload
+        return {**payload, "max_tokens": budget}
+
+
+_current: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("llama_deadline", default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Installe `deadline` pour le code appelé dans le bloc (threads et tâches
+    asyncio ont chacun leur contexte). Une échéance englobante plus proche
+    reste prioritaire.
+    """
+    outer = _current.get()
+    if deadline is None or (outer is not None and outer.expires_at <= deadline.expires_at):
+        deadline = outer
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def optional_step_allowed(min_seconds: float = OPTIONAL_STEP_MIN_SECONDS) -> bool:
+    """
+    Pour la logique de dialogue : une étape optionnelle peut-elle encore être faite ?
+    Toujours vrai sans échéance.
+    """
+    deadline = _current.get()
+    return deadline is None or deadline.allows(min_seconds)
@@ -0,0 +1,284 @@
+"""
+Embeddings de llama-server (POST /embedding, serveur lancé avec --embeddings)
+et recherche des plus proches voisins dans une matrice NumPy : index de
+skills (VectorIndex), cache de réponses par similarité (SemanticCache).
+
+Dépend de NumPy : importé explicitement (from llama_client.embeddings import ...),
+pas réexporté par le paquet.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from .pool import LlamaClient, get_default_client
+from .tracing import annotate
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class Embedder:
+    """
+    Vecteurs normalisés (similarité cosinus = produit scalaire) des textes,
+    avec un cache LRU : un même message embeddé par plusieurs étapes du tour
+    (routage, cache de réponses) ne coûte qu'une requête.
+
+    client : llama-server qui sert le modèle d'embedding (client par défaut sinon).
+    """
+
+    def __init__(self, client: Optional[LlamaClient] = None, max_entries: int = 4096):
+        self.client = client
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _client(self) -> LlamaClient:
+        return self.client or get_default_client()
+
+    @property
+    def source(self) -> str:
+        """
+        Identifie le serveur d'embedding (pour invalider les index sur disque).
+        """
+        return self._client().base_url
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Matrice (len(texts), dim) ; les textes pas encore en cache partent
+        en une seule requête.
+        """
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for text in texts:
+                vector = self._cache.get(text)
+                if vector is not None:
+                    self._cache.move_to_end(text)
+                    found[text] = vector
+            missing = list(dict.fromkeys(t for t in texts if t not in found))
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            found.update(zip(missing, self._fetch(missing)))
+            with self._lock:
+                for text in missing:
+                    self._cache[text] = found[text]
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return np.stack([found[text] for text in texts])
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    def _fetch(self, texts: List[str]) -> np.ndarray:
+        rows = []
+        for embedding in self._client().embed(texts):
+            vector = np.asarray(embedding, dtype=np.float32)
+            if vector.ndim == 2:
+                # une ligne par token (pas de pooling côté serveur) : moyenne
+                vector = vector.mean(axis=0)
+            rows.append(vector)
+        annotate(embedded=len(texts))
+        return normalize_rows(np.stack(rows))
+
+
+class VectorIndex:
+    """
+    Vecteurs normalisés dans une matrice (n, dim), chaque ligne rattachée à
+    une clé (plusieurs lignes possibles par clé : description, exemples...).
+    search() : score de chaque clé = meilleure similarité cosinus de ses
+    lignes, k meilleures clés.
+    """
+
+    def __init__(self, keys: List[str], owners: np.ndarray, matrix: np.ndarray):
+        self.keys = keys
+        self.owners = owners  # (n,) : indice dans keys de chaque ligne
+        self.matrix = matrix
+
+    @classmethod
+    def build(
+        cls,
+        embedder: Embedder,
+        texts_by_key: Dict[str, List[str]],
+        cache_path: Optional[Union[str, Path]] = None,
+    ) -> "VectorIndex":
+        """
+        Embedde tous les textes, ou recharge la matrice depuis cache_path (.npz)
+        si elle a été calculée pour les mêmes textes et le même serveur.
+        """
+        fingerprint = hashlib.sha1(
+            json.dumps([embedder.source, texts_by_key], ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        if cache_path is not None:
+            index = cls.load(cache_path, fingerprint)
+            if index is not None:
+                return index
+
+        keys = list(texts_by_key)
+        texts = [text for key in keys for text in texts_by_key[key]]
+        owners = np.array([i for i, key in enumerate(keys) for _ in texts_by_key[key]], dtype=np.int64)
+        matrix = embedder.embed(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+        index = cls(keys, owners, matrix)
+        if cache_path is not None:
+            index.save(cache_path, fingerprint)
+        return index
+
+    def save(self, path: Union[str, Path], fingerprint: str) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, keys=np.array(self.keys), owners=self.owners, matrix=self.matrix,
+                     fingerprint=np.array(fingerprint))
+
+    @classmethod
+    def load(cls, path: Union[str, Path], fingerprint: str) -> Optional["VectorIndex"]:
+        """
+        None si le fichier n'existe pas, est illisible ou ne correspond plus
+        (skills modifiés, autre serveur d'embedding).
+        """
+        try:
+            with np.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint:
+                    return None
+                return cls([str(k) for k in data["keys"]], data["owners"], data["matrix"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def search(self, vector: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        if not self.keys or self.matrix.size == 0:
+            return []
+        scores = self.matrix @ vector
+        best = np.full(len(self.keys), -np.inf, dtype=np.float32)
+        np.maximum.at(best, self.owners, scores)
+        top = np.argsort(-best)[:k]
+        return [(self.keys[i], float(best[i])) for i in top if np.isfinite(best[i])]
+
+
+# =========================
+# Cache sémantique de réponses
+# =========================
+
+@dataclass
+class SemanticCacheStats:
+    hits: int = 0
+    misses: int = 0
+    saved_seconds: float = 0.0  # temps de génération des réponses resservies
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 3),
+            "saved_seconds": round(self.saved_seconds, 3),
+        }
+
+
+@dataclass
+class _CachedAnswer:
+    vector: np.ndarray
+    answer: str
+    seconds: float   # temps mis à la générer
+    created: float
+
+
+class SemanticCache:
+    """
+    Réponses déjà générées, retrouvées par similarité du message (même
+    question formulée autrement) plutôt que par égalité exacte comme
+    ResponseCache. Pour les réponses qui ne dépendent que du message
+    (smalltalk, FAQ), pas de l'historique ni de données du moment.
+
+    - threshold : similarité cosinus minimale pour resservir une réponse
+    - max_entries : au-delà, la réponse la moins récemment servie est évincée
+    - ttl : durée de vie d'une réponse (secondes, None = illimitée)
+
+        cache = SemanticCache(Embedder(client), threshold=0.92)
+        vector = cache.embedder.embed_one(message)
+        answer = cache.lookup(vector)
+        if answer is None:
+            answer = generate(message)
+            cache.store(vector, answer, seconds=...)
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        threshold: float = 0.92,
+        max_entries: int = 512,
+        ttl: Optional[float] = 24 * 3600,
+    ):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = SemanticCacheStats()
+        self._entries: "OrderedDict[int, _CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        # vecteurs empilés, refaits seulement après un ajout ou une éviction
+        self._matrix: Optional[np.ndarray] = None
+        self._rows: List[int] = []  # entrée de chaque ligne de _matrix
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        expired = [i for i, e in self._entries.items() if now - e.created > self.ttl]
+        for i in expired:
+            del self._entries[i]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, vector: np.ndarray) -> Optional[str]:
+        with self._lock:
+            self._expire(time.monotonic())
+            if self._entries:
+                if self._matrix is None:
+                    self._rows = list(self._entries)
+                    self._matrix = np.stack([e.vector for e in self._entries.values()])
+                scores = self._matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entry_id = self._rows[best]
+                    entry = self._entries[entry_id]
+                    self._entries.move_to_end(entry_id)
+                    self.stats.hits += 1
+                    self.stats.saved_seconds += entry.seconds
+                    annotate(semantic_cache="hit", similarity=round(float(scores[best]), 3))
+                    return entry.answer
+            self.stats.misses += 1
+        annotate(semantic_cache="miss")
+        return None
+
+    def store(self, vector: np.ndarray, answer: str, seconds: float = 0.0) -> None:
+        with self._lock:
+            self._entries[self._next_id] = _CachedAnswer(vector, answer, seconds, time.monotonic())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
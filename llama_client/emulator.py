@@ -0,0 +1,681 @@
+"""
+Émulateur local de llama-server (/v1/chat/completions style OpenAI) pour
+travailler sur la charge et la latence sans modèle.
+
+    python -m llama_client.emulator --port 8080 --slots 4 --gen-tps 20
+
+Outil de test : importé explicitement (from llama_client.emulator import ...),
+pas réexporté par le paquet.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import select
+import socket
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qs, urlsplit
+
+from .balancer import CHAT_PATH
+from .streaming import first_json_object
+from .usage import estimate_tokens
+
+# Réponse scriptée : texte fixe ou fonction du corps de la requête
+Reply = Union[str, Callable[[Dict[str, Any]], str]]
+
+# Repères des prompts de tp_final/agent.py
+ROUTING_PROMPT = r"routeur de requêtes"
+SWITCH_PROMPT = r"classificateur de contexte"
+SLOTS_PROMPT = r'"slots"'
+
+# Tokens de prompt traités entre deux vérifications de déconnexion du client
+PROMPT_BATCH = 128
+
+# Taille des vecteurs de POST /embedding
+EMBEDDING_DIM = 256
+
+# Part minimale du prompt déjà en cache pour qu'un slot soit choisi pour lui
+# (--slot-prompt-similarity de llama-server) ; sinon slot le moins récemment utilisé
+SLOT_PROMPT_SIMILARITY = 0.5
+
+
+# =========================
+# Modèle de performance
+# =========================
+
+@dataclass
+class EmulatorConfig:
+    """
+    - prompt_tps : vitesse de traitement du prompt (tokens/s)
+    - gen_tps : vitesse de génération d'un slot seul (tokens/s)
+    - slots : requêtes traitées en parallèle (--parallel) ; au-delà, file d'attente
+    - batch_slowdown : ralentissement de chaque slot par slot actif en plus
+      (0.15 -> 4 slots actifs génèrent chacun 1.45x plus lentement)
+    - jitter : variation aléatoire des durées (+/- fraction)
+    - time_scale : multiplie toutes les durées (0 = instantané)
+    - default_reply : réponse libre quand aucune règle ne correspond
+    """
+    prompt_tps: float = 200.0
+    gen_tps: float = 20.0
+    slots: int = 4
+    batch_slowdown: float = 0.15
+    jitter: float = 0.0
+    time_scale: float = 1.0
+    default_reply: str = "Voici une réponse simulée par l'émulateur llama-server."
+    slot_save_path: Optional[str] = None  # dossier des sauvegardes de slots (--slot-save-path)
+
+
+def split_tokens(text: str) -> List[str]:
+    """
+    Découpe le texte en morceaux envoyés un par un en streaming.
+    """
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+# =========================
+# Réponses scriptées
+# =========================
+
+def intent_json(intent: Optional[str]) -> str:
+    return json.dumps({"intent": intent}, ensure_ascii=False)
+
+
+def switch_json(mode: str = "continue", intent: Optional[str] = None) -> str:
+    return json.dumps({"mode": mode, "intent": intent}, ensure_ascii=False)
+
+
+def slots_json(**values: Optional[str]) -> str:
+    return json.dumps({"slots": values}, ensure_ascii=False)
+
+
+def route_json(intent: Optional[str], **values: Optional[str]) -> str:
+    """
+    Réponse du routage en un seul appel (single_pass de l'agent) : skill et
+    slots. Pour une requête avec "tools", devient un appel de la fonction `intent`.
+    """
+    return json.dumps({"intent": intent, "slots": values}, ensure_ascii=False)
+
+
+def broken_json(text: str) -> str:
+    """
+    JSON volontairement inexploitable : du texte autour et une accolade en moins.
+    """
+    return "Bien sûr ! Voici le JSON : " + text.rstrip().rstrip("}")
+
+
+def schema_instance(schema: Dict[str, Any]) -> Any:
+    """
+    Plus petite valeur conforme à un schéma JSON (premier enum, null si permis,
+    propriétés requises seulement).
+    """
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "anyOf" in schema:
+        return schema_instance(schema["anyOf"][0])
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = "null" if "null" in kind else kind[0]
+    if kind == "object":
+        required = schema.get("required", [])
+        return {k: schema_instance(v) for k, v in schema.get("properties", {}).items() if k in required}
+    return {"array": [], "string": "", "integer": 0, "number": 0, "boolean": False}.get(kind)
+
+
+def constrain(reply: str, schema: Dict[str, Any]) -> str:
+    """
+    Imite le décodage contraint de llama-server (champ json_schema) : une
+    réponse scriptée qui n'est pas du JSON (broken_json...) est ramenée à
+    l'objet JSON qu'elle contient, sinon à schema_instance(schema).
+    """
+    start, end = reply.find("{"), reply.rfind("}")
+    if 0 <= start < end:
+        candidate = reply[start:end + 1]
+        try:
+            json.loads(candidate)
+            return candidate
+        except json.JSONDecodeError:
+            pass
+    return json.dumps(schema_instance(schema), ensure_ascii=False)
+
+
+def tool_call(reply: str, tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Imite l'appel de fonction de llama-server (--jinja, champ tools) : une
+    réponse scriptée {"intent": ..., "slots": {...}} (route_json) appelle la
+    fonction `intent` avec les slots en arguments ; sinon première fonction,
+    arguments à null.
+    """
+    names = [t.get("function", {}).get("name") for t in tools]
+    data = first_json_object(reply) or {}
+    name = data.get("intent", data.get("name"))
+    if name in names:
+        arguments = data.get("slots", data.get("arguments")) or {}
+    else:
+        function = tools[0].get("function", {})
+        name = function.get("name")
+        arguments = {k: None for k in function.get("parameters", {}).get("properties", {})}
+    return {"name": name, "arguments": arguments}
+
+
+def embedding_vector(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    """
+    Vecteur déterministe et normalisé : trigrammes de caractères des mots
+    (minuscules, sans accents) hachés dans `dim` cases. Des textes qui
+    partagent des mots ont des vecteurs proches, comme avec un vrai modèle.
+    """
+    folded = "".join(
+        c for c in unicodedata.normalize("NFD", text.casefold()) if not unicodedata.combining(c)
+    )
+    vector = [0.0] * dim
+    for word in re.findall(r"\w+", folded):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.md5(padded[i:i + 3].encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % dim] += 1.0
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+@dataclass
+class ScriptRule:
+    pattern: re.Pattern
+    reply: Reply
+    times: Optional[int] = None  # None = illimité
+
+
+def _all_text(body: Dict[str, Any]) -> str:
+    return "\n".join(str(m.get("content") or "") for m in body.get("messages", []))
+
+
+def _system_prompt(body: Dict[str, Any]) -> str:
+    for m in body.get("messages", []):
+        if m.get("role") == "system":
+            return str(m.get("content") or "")
+    return ""
+
+
+def _listed_names(text: str) -> List[str]:
+    return re.findall(r'^- "([^"]+)":', text, re.MULTILINE)
+
+
+def default_reply(body: Dict[str, Any], config: EmulatorConfig) -> str:
+    """
+    Réponses plausibles aux prompts de l'agent : premier skill listé pour le
+    routage (sans slots trouvés s'il extrait aussi), "continue" pour le smart
+    switch, slots à null pour l'extraction.
+    """
+    system = _system_prompt(body)
+    if re.search(ROUTING_PROMPT, system) and re.search(SLOTS_PROMPT, system):
+        # routage et extraction en un seul appel : slots non trouvés
+        names = _listed_names(system)
+        return route_json(names[0] if names else None)
+    if re.search(ROUTING_PROMPT, system):
+        names = _listed_names(system)
+        return intent_json(names[0] if names else None)
+    if re.search(SWITCH_PROMPT, system):
+        return switch_json("continue")
+    if re.search(SLOTS_PROMPT, system):
+        # les slots à remplir sont listés avant l'exemple du prompt
+        names = _listed_names(system.split("Exemple")[0])
+        return slots_json(**{name: None for name in names})
+    return config.default_reply
+
+
+# =========================
+# Serveur
+# =========================
+
+@dataclass
+class EmulatorStats:
+    requests: int = 0
+    streamed: int = 0
+    queued_max: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0  # tokens de prompt repris du cache KV des slots
+    disconnected: int = 0
+
+
+class _Server(ThreadingHTTPServer):
+    # file d'attente de listen() assez longue pour les tests de charge
+    # (5 par défaut : connexions refusées au-delà de quelques clients simultanés)
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class LlamaEmulator:
+    """
+    Serveur HTTP local qui imite llama-server :
+    POST /v1/chat/completions (JSON ou SSE), GET /health, /slots, /metrics,
+    POST /slots/{id}?action=save|restore|erase (avec config.slot_save_path),
+    POST /tokenize, POST /embedding.
+
+    Chaque requête attend un slot libre, "traite" son prompt à prompt_tps (sauf
+    le préfixe commun avec le prompt précédent du slot, gardé en cache) puis
+    "génère" sa réponse à gen_tps (ralenti par les autres slots actifs) ;
+    max_tokens tronque la réponse (finish_reason "length"). Une requête avec
+    id_slot attend ce slot précis.
+
+    Les réponses sont scriptées par expressions régulières sur le texte des
+    messages (première règle qui correspond) :
+
+        emu.script(ROUTING_PROMPT, intent_json("weather"))
+        emu.script(SLOTS_PROMPT, broken_json(slots_json(city="Paris")), times=1)
+    """
+
+    def __init__(self, config: Optional[EmulatorConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or EmulatorConfig()
+        self.stats = EmulatorStats()
+        self.rules: List[ScriptRule] = []
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._busy = [False] * self.config.slots
+        self._slot_prompts = [""] * self.config.slots  # prompt gardé dans le cache KV de chaque slot
+        self._slot_used = [0.0] * self.config.slots
+        self._waiting = 0
+        self._server = _Server((host, port), _make_handler(self))
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self) -> str:
+        return self.base_url + CHAT_PATH
+
+    def start(self) -> "LlamaEmulator":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="llama-emulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "LlamaEmulator":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    # --- Script ---
+
+    def script(self, pattern: str, reply: Reply, times: Optional[int] = None) -> None:
+        self.rules.append(ScriptRule(re.compile(pattern, re.DOTALL), reply, times))
+
+    def reply_for(self, body: Dict[str, Any]) -> str:
+        text = _all_text(body)
+        with self._lock:
+            for rule in self.rules:
+                if rule.pattern.search(text):
+                    if rule.times is not None:
+                        rule.times -= 1
+                        if rule.times <= 0:
+                            self.rules.remove(rule)
+                    reply = rule.reply
+                    break
+            else:
+                reply = None
+        if reply is None:
+            return default_reply(body, self.config)
+        return reply(body) if callable(reply) else reply
+
+    # --- Slots et durées ---
+
+    def _acquire_slot(self, prompt: str = "", id_slot: Optional[int] = None) -> int:
+        """
+        Comme llama-server, prend le slot `id_slot` s'il est donné, sinon
+        parmi les slots libres celui dont le prompt en cache partage le plus
+        long préfixe avec `prompt`, sinon le moins récemment utilisé.
+        """
+        if id_slot is not None and not 0 <= id_slot < self.config.slots:
+            id_slot = None
+        with self._slot_free:
+            self._waiting += 1
+            self.stats.queued_max = max(self.stats.queued_max, self._waiting)
+            while True:
+                if id_slot is not None:
+                    free = [] if self._busy[id_slot] else [id_slot]
+                else:
+                    free = [i for i, busy in enumerate(self._busy) if not busy]
+                if free:
+                    break
+                self._slot_free.wait()
+            self._waiting -= 1
+
+            def similarity(i: int) -> int:
+                common = len(os.path.commonprefix([self._slot_prompts[i], prompt]))
+                return common if common >= SLOT_PROMPT_SIMILARITY * len(prompt) else 0
+
+            slot = max(free, key=lambda i: (similarity(i), -self._slot_used[i]))
+            self._busy[slot] = True
+            self._slot_used[slot] = time.monotonic()
+            return slot
+
+    def _reuse_prompt(self, slot: int, prompt: str, cache_prompt: bool) -> int:
+        """
+        Tokens du prompt déjà dans le cache KV du slot (préfixe commun avec
+        le prompt précédent), qui n'ont pas à être retraités.
+        """
+        with self._lock:
+            prefix = os.path.commonprefix([self._slot_prompts[slot], prompt]) if cache_prompt else ""
+            self._slot_prompts[slot] = prompt
+        if not prefix:
+            return 0
+        # le dernier token est toujours réévalué
+        return min(estimate_tokens(prefix), estimate_tokens(prompt) - 1)
+
+    def _release_slot(self, slot: int) -> None:
+        with self._slot_free:
+            self._busy[slot] = False
+            self._slot_free.notify_all()
+
+    def slot_action(self, slot: int, action: str, filename: str = "") -> Dict[str, Any]:
+        """
+        Sauvegarde / restauration / effacement du cache KV d'un slot, comme
+        POST /slots/{id}?action=... de llama-server. Le "cache KV" émulé est le
+        texte du prompt, écrit dans config.slot_save_path.
+        """
+        if self.config.slot_save_path is None and action != "erase":
+            raise ValueError("slot_save_path non configuré (--slot-save-path)")
+        if not 0 <= slot < self.config.slots:
+            raise ValueError(f"slot inconnu: {slot}")
+        if action == "erase":
+            with self._lock:
+                n_erased = estimate_tokens(self._slot_prompts[slot]) if self._slot_prompts[slot] else 0
+                self._slot_prompts[slot] = ""
+            return {"id_slot": slot, "n_erased": n_erased}
+
+        path = Path(self.config.slot_save_path) / Path(filename).name
+        if action == "save":
+            with self._lock:
+                prompt = self._slot_prompts[slot]
+            path.write_text(prompt, encoding="utf-8")
+            return {"id_slot": slot, "filename": path.name, "n_saved": estimate_tokens(prompt) if prompt else 0}
+        if action == "restore":
+            prompt = path.read_text(encoding="utf-8")
+            with self._lock:
+                self._slot_prompts[slot] = prompt
+            return {"id_slot": slot, "filename": path.name, "n_restored": estimate_tokens(prompt) if prompt else 0}
+        raise ValueError(f"action inconnue: {action}")
+
+    def _active(self) -> int:
+        with self._lock:
+            return sum(self._busy)
+
+    def _sleep(self, seconds: float) -> None:
+        c = self.config
+        if c.jitter:
+            seconds *= 1.0 + random.uniform(-c.jitter, c.jitter)
+        seconds *= c.time_scale
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _token_delay(self) -> float:
+        c = self.config
+        return (1.0 + c.batch_slowdown * max(self._active() - 1, 0)) / c.gen_tps
+
+    def _completion(self, body: Dict[str, Any]) -> tuple[List[str], str, int]:
+        """
+        Morceaux de la réponse (tronqués à max_tokens), finish_reason, tokens du prompt.
+        """
+        prompt_tokens = estimate_tokens(_all_text(body))
+        reply = self.reply_for(body)
+        if isinstance(body.get("json_schema"), dict):
+            reply = constrain(reply, body["json_schema"])
+        if body.get("tools"):
+            # tokens générés : ceux des arguments, comme llama-server
+            reply = json.dumps(tool_call(reply, body["tools"]), ensure_ascii=False)
+        pieces = split_tokens(reply)
+        finish_reason = "stop"
+        max_tokens = body.get("max_tokens")
+        if max_tokens is not None and len(pieces) > max_tokens:
+            pieces, finish_reason = pieces[:max_tokens], "length"
+        return pieces, finish_reason, prompt_tokens
+
+    def snapshot_slots(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"id": i, "is_processing": busy} for i, busy in enumerate(self._busy)]
+
+    def metrics(self) -> str:
+        with self._lock:
+            lines = [
+                f"llamacpp:requests_processing {sum(self._busy)}",
+                f"llamacpp:requests_deferred {self._waiting}",
+                f"llamacpp:prompt_tokens_total {self.stats.prompt_tokens}",
+                f"llamacpp:tokens_predicted_total {self.stats.completion_tokens}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def _make_handler(emulator: LlamaEmulator) -> type:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def _send(self, status: int, data: bytes, content_type: str = "application/json") -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, obj: Any, status: int = 200) -> None:
+            self._send(status, json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self._send_json({"status": "ok"})
+            elif self.path == "/slots":
+                self._send_json(emulator.snapshot_slots())
+            elif self.path == "/metrics":
+                self._send(200, emulator.metrics().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send_json({"error": "not found"}, 404)
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json({"error": "invalid JSON body"}, 400)
+                return
+            url = urlsplit(self.path)
+            if url.path.startswith("/slots/"):
+                self._slot_action(url, body)
+                return
+            if url.path == "/embedding":
+                self._embedding(body)
+                return
+            if url.path == "/tokenize":
+                # même estimation que les comptes de tokens de l'émulateur
+                self._send_json({"tokens": list(range(estimate_tokens(str(body.get("content") or ""))))})
+                return
+            if url.path != CHAT_PATH:
+                self._send_json({"error": "not found"}, 404)
+                return
+
+            pieces, finish_reason, prompt_tokens = emulator._completion(body)
+            prompt = _all_text(body)
+            slot = emulator._acquire_slot(prompt, body.get("id_slot"))
+            cached = 0
+            try:
+                start = time.monotonic()
+                cached = emulator._reuse_prompt(slot, prompt, body.get("cache_prompt", True))
+                # reste du prompt traité par lots, comme le ubatch de llama-server
+                to_process = prompt_tokens - cached
+                for done in range(0, to_process, PROMPT_BATCH):
+                    emulator._sleep(min(PROMPT_BATCH, to_process - done) / emulator.config.prompt_tps)
+                    self._check_client()
+                prompt_ms = (time.monotonic() - start) * 1000
+                if body.get("stream"):
+                    self._stream(pieces, finish_reason, prompt_tokens, cached)
+                else:
+                    for _ in pieces:
+                        emulator._sleep(emulator._token_delay())
+                        self._check_client()
+                    predicted_ms = (time.monotonic() - start) * 1000 - prompt_ms
+                    self._send_json(
+                        _chat_response(body, pieces, finish_reason, prompt_tokens, cached, prompt_ms, predicted_ms)
+                    )
+            except (BrokenPipeError, ConnectionResetError):
+                # client parti (timeout, annulation) : le slot est libéré quand même
+                emulator.stats.disconnected += 1
+                self.close_connection = True
+            finally:
+                emulator._release_slot(slot)
+                with emulator._lock:
+                    emulator.stats.requests += 1
+                    emulator.stats.prompt_tokens += prompt_tokens
+                    emulator.stats.cached_tokens += cached
+                    emulator.stats.completion_tokens += len(pieces)
+
+        def _embedding(self, body: Dict[str, Any]) -> None:
+            content = body.get("content", "")
+            texts = content if isinstance(content, list) else [content]
+            emulator._sleep(sum(estimate_tokens(str(t)) for t in texts) / emulator.config.prompt_tps)
+            # format des versions récentes : une liste, vecteur poolé sur une ligne
+            self._send_json([
+                {"index": i, "embedding": [embedding_vector(str(t))]} for i, t in enumerate(texts)
+            ])
+
+        def _slot_action(self, url: Any, body: Dict[str, Any]) -> None:
+            action = parse_qs(url.query).get("action", [""])[0]
+            try:
+                result = emulator.slot_action(int(url.path.rsplit("/", 1)[1]), action, body.get("filename", ""))
+            except (ValueError, OSError) as e:
+                self._send_json({"error": {"message": str(e)}}, 400)
+                return
+            self._send_json(result)
+
+        def _stream(self, pieces: List[str], finish_reason: str, prompt_tokens: int, cached_tokens: int) -> None:
+            emulator.stats.streamed += 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for piece in pieces:
+                emulator._sleep(emulator._token_delay())
+                self._check_client()
+                self._event({"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+            self._event({
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                "usage": _usage(prompt_tokens, len(pieces), cached_tokens),
+            })
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+        def _check_client(self) -> None:
+            """
+            Comme llama-server : un client qui a fermé sa connexion pendant la
+            génération (annulation, timeout) l'interrompt et libère le slot.
+            """
+            try:
+                readable, _, _ = select.select([self.connection], [], [], 0)
+                gone = bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b""
+            except OSError:
+                gone = True
+            if gone:
+                raise ConnectionResetError("client déconnecté")
+
+        def _event(self, chunk: Dict[str, Any]) -> None:
+            self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def _usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Dict[str, Any]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _chat_response(
+    body: Dict[str, Any],
+    pieces: List[str],
+    finish_reason: str,
+    prompt_tokens: int,
+    cached_tokens: int,
+    prompt_ms: float,
+    predicted_ms: float,
+) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(pieces)}
+    if body.get("tools") and finish_reason == "stop":
+        call = json.loads(message["content"])
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_0",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call["arguments"], ensure_ascii=False)},
+            }],
+        }
+        finish_reason = "tool_calls"
+    return {
+        "object": "chat.completion",
+        "model": body.get("model", "emulator"),
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": finish_reason,
+        }],
+        "usage": _usage(prompt_tokens, len(pieces), cached_tokens),
+        "timings": {
+            "cache_n": cached_tokens,
+            "prompt_n": prompt_tokens - cached_tokens,
+            "prompt_ms": prompt_ms,
+            "predicted_n": len(pieces),
+            "predicted_ms": predicted_ms,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Émulateur local de llama-server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--prompt-tps", type=float, default=200.0)
+    parser.add_argument("--gen-tps", type=float, default=20.0)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--slot-save-path", default=None)
+    args = parser.parse_args()
+
+    config = EmulatorConfig(
+        prompt_tps=args.prompt_tps,
+        gen_tps=args.gen_tps,
+        slots=args.slots,
+        time_scale=args.time_scale,
+        slot_save_path=args.slot_save_path,
+    )
+    emulator = LlamaEmulator(config, host=args.host, port=args.port)
+    print(f"Émulateur llama-server sur {emulator.url} ({config.slots} slots, {config.gen_tps:g} tokens/s)")
+    try:
+        emulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator._server.server_close()
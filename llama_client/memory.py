@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from .pool import LlamaClient
+from .tracing import INFO, annotate, event, span
+from .usage import estimate_tokens
+
+# Tokens ajoutés par le modèle de chat autour de chaque message (rôle, balises)
+MESSAGE_OVERHEAD = 4
+
+# Résumé des messages les plus anciens (résumé précédent, messages) -> nouveau résumé
+Summarize = Callable[[Optional[str], List[Dict[str, str]]], str]
+
+
+class TokenCounter:
+    """
+    Compte les tokens d'un texte, avec un cache LRU : les messages de
+    l'historique sont recomptés à chaque tour, le calcul n'est fait qu'une fois.
+
+    client : compte exact par POST /tokenize de ce llama-server (un aller-retour
+    par texte jamais vu) ; sans client, ou si le serveur refuse, estimation
+    locale (~4 caractères par token).
+    """
+
+    def __init__(self, client: Optional[LlamaClient] = None, max_entries: int = 2048):
+        self.client = client
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return n
+            self.misses += 1
+        n = self._count(text)
+        with self._lock:
+            self._cache[text] = n
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return n
+
+    def _count(self, text: str) -> int:
+        if self.client is not None:
+            try:
+                return len(self.client.tokenize(text))
+            except RuntimeError as e:
+                event("tokenize_fallback", INFO, error=str(e))
+                self.client = None
+        return estimate_tokens(text)
+
+    def count_messages(self, messages: List[Dict[str, str]]) -> int:
+        return sum(self.count(m.get("content") or "") + MESSAGE_OVERHEAD for m in messages)
+
+
+class ConversationMemory:
+    """
+    Historique d'une conversation, borné en tokens, à injecter dans les
+    prompts (paramètre history de build_messages).
+
+    Quand l'historique dépasse max_tokens, les messages les plus anciens (tous
+    sauf les keep_recent derniers) sont résumés par `summarize` dans un thread,
+    sans retarder le tour en cours ; le résumé remplace ensuite ces messages.
+    En attendant (ou si le résumé échoue), les messages les plus anciens sont
+    simplement omis : messages() ne dépasse jamais max_tokens, ce qui borne
+    le temps de traitement du prompt.
+
+        memory = ConversationMemory(summarize, max_tokens=1024)
+        memory.add_turn(user_message, answer)
+        send_llama_chat(message, system_prompt, history=memory.messages())
+    """
+
+    def __init__(
+        self,
+        summarize: Summarize,
+        max_tokens: int = 1024,
+        keep_recent: int = 4,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.summarize = summarize
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.counter = counter or TokenCounter()
+        self.summary: Optional[str] = None
+        self.summaries = 0
+        self._messages: List[Dict[str, str]] = []
+        self._summarizing: Optional[threading.Thread] = None
+        self._generation = 0  # incrémenté par clear() : résumé en cours périmé
+        self._lock = threading.Lock()
+
+    def add(self, role: str, content: str) -> None:
+        with self._lock:
+            self._messages.append({"role": role, "content": content})
+        self._maybe_summarize()
+
+    def add_turn(self, user_message: str, answer: str) -> None:
+        with self._lock:
+            self._messages.append({"role": "user", "content": user_message})
+            self._messages.append({"role": "assistant", "content": answer})
+        self._maybe_summarize()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._messages = []
+            self.summary = None
+            self._generation += 1
+
+    def _summary_messages(self, summary: Optional[str]) -> List[Dict[str, str]]:
+        if not summary:
+            return []
+        # paire user / assistant : le prompt système reste identique d'un tour
+        # à l'autre (cache KV) et l'alternance des rôles reste valide
+        return [
+            {"role": "user", "content": f"Résumé de notre conversation jusqu'ici :\n{summary}"},
+            {"role": "assistant", "content": "D'accord, je m'en souviens."},
+        ]
+
+    def messages(self) -> List[Dict[str, str]]:
+        with self._lock:
+            head = self._summary_messages(self.summary)
+            recent = list(self._messages)
+        budget = self.max_tokens - self.counter.count_messages(head)
+        kept: List[Dict[str, str]] = []
+        for message in reversed(recent):
+            budget -= self.counter.count_messages([message])
+            if budget < 0:
+                break
+            kept.append(message)
+        kept.reverse()
+        # l'historique commence par un message utilisateur
+        while kept and kept[0]["role"] != "user":
+            kept.pop(0)
+        if len(kept) < len(recent):
+            annotate(history_dropped=len(recent) - len(kept))
+        return head + kept
+
+    @property
+    def tokens(self) -> int:
+        return self.counter.count_messages(self.messages())
+
+    def _maybe_summarize(self) -> None:
+        with self._lock:
+            if self._summarizing is not None:
+                return
+            total = self.counter.count_messages(self._summary_messages(self.summary) + self._messages)
+            n_old = len(self._messages) - self.keep_recent
+            if total <= self.max_tokens or n_old <= 0:
+                return
+            old = self._messages[:n_old]
+            thread = threading.Thread(
+                target=self._summarize,
+                args=(self.summary, old, self._generation),
+                name="conversation-summary",
+                daemon=True,
+            )
+            self._summarizing = thread
+        thread.start()
+
+    def _summarize(self, previous: Optional[str], old: List[Dict[str, str]], generation: int) -> None:
+        try:
+            with span("memory.summarize", messages=len(old)):
+                summary = self.summarize(previous, old).strip()
+        except Exception as e:
+            event("summary_failed", INFO, error=str(e))
+            summary = ""
+        with self._lock:
+            self._summarizing = None
+            if not summary or generation != self._generation:
+                return
+            self.summary = summary
+            self.summaries += 1
+            del self._messages[:len(old)]
+        # la conversation a pu continuer pendant le résumé
+        self._maybe_summarize()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Attend la fin du résumé en cours (fin de session, démos).
+        """
+        thread = self._summarizing
+        if thread is not None:
+            thread.join(timeout)
@@ -0,0 +1,780 @@
+from __future__ import annotations
+
+import json
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .balancer import BACKEND_URL, BackendPool
+from .batching import MicroBatcher
+from .cache import ResponseCache
+from .calls import Attempts, ChatCall, prepare_stream, record_stream_outcome
+from .cancel import CancelToken, RequestCancelled
+from .cassette import Cassette, cassette_from_env
+from .config import LLAMA_SERVER_URL, Timeouts
+from .deadline import Deadline
+from .resilience import (
+    DEFAULT_POLICIES,
+    CallPolicy,
+    CircuitBreaker,
+    HedgeStats,
+    LatencyTracker,
+    LlamaRequestError,
+    RetryBudget,
+    is_request_error,
+)
+from .scheduler import Scheduler
+from .singleflight import SingleFlight
+from .streaming import (
+    STOP_AT_JSON,
+    JsonObjectScanner,
+    chunk_finish_reason,
+    delta_text,
+    iter_sse_chunks,
+    json_stream_response,
+)
+from .tracing import INFO, annotate, event
+from .usage import record_usage
+
+
+# =========================
+# Statistiques du pool
+# =========================
+
+@dataclass
+class PoolStats:
+    """
+    Compteurs du pool de connexions :
+    - hits : requête servie par une connexion déjà ouverte (keep-alive)
+    - misses : requête qui a dû ouvrir une nouvelle connexion
+    - preconnected : connexions ouvertes à l'avance par preconnect()
+    """
+    hits: int = 0
+    misses: int = 0
+    preconnected: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, reused: bool) -> None:
+        with self._lock:
+            if reused:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "preconnected": self.preconnected,
+                "hit_ratio": self.hit_ratio,
+            }
+
+
+# Jeton d'annulation de la requête en cours d'envoi par ce thread (voir _abort_on_cancel)
+_cancel_watch = threading.local()
+
+
+def _shutdown_socket(sock: Optional[socket.socket]) -> None:
+    """
+    Coupe la connexion sous le thread qui attend la réponse : son recv()
+    échoue aussitôt et llama-server voit la déconnexion (slot libéré).
+    """
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _stream_socket(raw: Any) -> Optional[socket.socket]:
+    """
+    Socket d'une réponse urllib3 en streaming. La connexion l'a déjà lâchée
+    quand le serveur a annoncé "Connection: close" (cas du SSE) : on le
+    reprend alors dans le fichier de la réponse http.client.
+    """
+    sock = getattr(getattr(raw, "connection", None), "sock", None)
+    if sock is None:
+        fp = getattr(getattr(raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    return sock
+
+
+@contextmanager
+def _abort_on_cancel(cancel: Optional[CancelToken]) -> Iterator[None]:
+    """
+    Pendant le bloc, annuler `cancel` coupe les connexions empruntées au pool
+    par ce thread (l'appel requests est bloqué dedans, on ne peut pas
+    l'interrompre autrement).
+    """
+    if cancel is None:
+        yield
+        return
+    _cancel_watch.cancel = cancel
+    _cancel_watch.unlinks = []
+    try:
+        yield
+    finally:
+        for unlink in _cancel_watch.unlinks:
+            unlink()
+        _cancel_watch.cancel = None
+        _cancel_watch.unlinks = []
+
+
+def _http_error(e: requests.RequestException, cancel: Optional[CancelToken]) -> Exception:
+    """
+    Exception du client pour une erreur requests : RequestCancelled si l'appel
+    a été annulé, LlamaRequestError pour une requête refusée (4xx),
+    RuntimeError sinon (connexion, timeout, 5xx, corps illisible).
+    """
+    if cancel is not None and cancel.cancelled:
+        return RequestCancelled("Appel llama-server annulé")
+    status = getattr(e.response, "status_code", None)
+    if status is not None and is_request_error(status):
+        return LlamaRequestError(f"Requête refusée par llama-server ({status}): {e.response.text[:300]}", status)
+    return RuntimeError(f"Erreur lors de l'appel à llama-server: {e}")
+
+
+class _CountingPoolMixin:
+    """
+    Compte, à chaque emprunt de connexion, si elle était déjà connectée.
+    La classe concrète reçoit l'attribut `stats` à la création de l'adaptateur.
+    Si le thread envoie une requête annulable, la connexion est aussi
+    rattachée à son CancelToken.
+    """
+    stats: PoolStats
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)  # type: ignore[misc]
+        self.stats.record(reused=getattr(conn, "sock", None) is not None)
+        cancel = getattr(_cancel_watch, "cancel", None)
+        if cancel is not None:
+            _cancel_watch.unlinks.append(cancel.on_cancel(lambda: _shutdown_socket(conn.sock)))
+        return conn
+
+
+class PooledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter dont les pools urllib3 alimentent un PoolStats.
+    """
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {"stats": self.stats}
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("CountingHTTPConnectionPool", (_CountingPoolMixin, HTTPConnectionPool), attrs),
+            "https": type("CountingHTTPSConnectionPool", (_CountingPoolMixin, HTTPSConnectionPool), attrs),
+        }
+
+
+# =========================
+# Client
+# =========================
+
+def build_messages(
+    user_content: str | None,
+    system_prompt: str,
+    history: Optional[List[Dict[str, str]]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Construit la liste de messages style OpenAI.
+    Si user_content est None, tout est dans le system prompt / l'historique.
+    """
+    messages = [{"role": "system", "content": system_prompt}, *(history or [])]
+    if user_content is not None:
+        messages.append({"role": "user", "content": user_content})
+    return messages
+
+
+def extract_content(data: Dict[str, Any]) -> str:
+    """
+    Récupère data["choices"][0]["message"]["content"].
+    """
+    try:
+        return data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as e:
+        raise RuntimeError(f"Format de réponse inattendu: {data}") from e
+
+
+def extract_finish_reason(data: Dict[str, Any]) -> Optional[str]:
+    """
+    Récupère data["choices"][0]["finish_reason"] ("stop", "length" si la
+    réponse a été tronquée par max_tokens...), None s'il manque.
+    """
+    try:
+        return data["choices"][0].get("finish_reason")
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def extract_tool_call(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Premier appel de fonction de la réponse (requête avec "tools") :
+    {"name": ..., "arguments": {...}}, None si le modèle n'en a pas fait.
+    """
+    try:
+        function = data["choices"][0]["message"]["tool_calls"][0]["function"]
+    except (KeyError, IndexError, TypeError):
+        return None
+    arguments = function.get("arguments") or {}
+    if isinstance(arguments, str):
+        try:
+            arguments = json.loads(arguments)
+        except ValueError:
+            arguments = {}
+    return {"name": function.get("name"), "arguments": arguments}
+
+
+def request_body(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Payload tel qu'envoyé à llama-server : sans les champs propres au client
+    (STOP_AT_JSON, BACKEND_URL).
+    """
+    return {k: v for k, v in payload.items() if k not in (STOP_AT_JSON, BACKEND_URL)}
+
+
+class LlamaClient:
+    """
+    Client HTTP pour llama-server qui réutilise ses connexions.
+
+    Une seule requests.Session (donc un pool urllib3) est partagée par tous
+    les appels : les connexions restent ouvertes entre deux appels au lieu
+    de refaire un handshake TCP à chaque fois.
+
+    Si un ResponseCache est fourni, les appels qui le demandent (use_cache)
+    et qui sont déterministes (temperature 0) passent d'abord par le cache.
+
+    coalesce=True : des appels déterministes identiques lancés en même temps
+    (depuis plusieurs threads) partagent une seule requête à llama-server.
+
+    backends : si fourni, chaque requête part vers le llama-server le moins
+    chargé du BackendPool au lieu de `url`.
+
+    Robustesse (voir resilience.py), réglée par site d'appel via `policies` :
+    retries limités par un RetryBudget global, doublon (hedge) quand un appel
+    dépasse le p95 observé, et CircuitBreaker qui échoue tout de suite tant
+    que llama-server est en panne. Cette politique d'appel est dans calls.py,
+    partagée avec AsyncLlamaClient.
+
+    batcher : si fourni, les requêtes (hors cache) en cours sont limitées au
+    nombre de slots du serveur, la suivante part dès qu'un slot se libère
+    (voir batching.py).
+
+    scheduler : file de priorité + contrôle d'admission (voir scheduler.py) ;
+    un appel refusé lève BusyError tout de suite.
+
+    cassette : enregistre ou rejoue les échanges avec llama-server
+    (voir cassette.py) ; en replay aucune requête réseau n'est faite.
+    """
+
+    def __init__(
+        self,
+        url: str = LLAMA_SERVER_URL,
+        pool_maxsize: int = 10,
+        timeouts: Optional[Timeouts] = None,
+        cache: Optional[ResponseCache] = None,
+        coalesce: bool = True,
+        backends: Optional[BackendPool] = None,
+        policies: Optional[Dict[str, CallPolicy]] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+        batcher: Optional[MicroBatcher] = None,
+        scheduler: Optional[Scheduler] = None,
+        cassette: Optional[Cassette] = None,
+    ):
+        self.url = url
+        self.backends = backends
+        self.batcher = batcher
+        self.scheduler = scheduler
+        self.cassette = cassette
+        self.policies: Dict[str, CallPolicy] = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.default_policy = CallPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.latencies = LatencyTracker()
+        self.hedge_stats = HedgeStats()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pool_maxsize = pool_maxsize
+        self.timeouts = timeouts or Timeouts()
+        self.cache = cache
+        self.singleflight: Optional[SingleFlight] = SingleFlight() if coalesce else None
+        self.stats = PoolStats()
+
+        self.session = requests.Session()
+        adapter = PooledAdapter(
+            self.stats,
+            pool_connections=1,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @property
+    def base_url(self) -> str:
+        parts = urlsplit(self.url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @contextmanager
+    def _endpoint(self, deadline: Optional[Deadline] = None, base_url: Optional[str] = None) -> Iterator[str]:
+        """
+        URL à utiliser pour une requête : `url`, ou le backend le moins chargé
+        (celui de base_url s'il est imposé).
+        """
+        if self.backends is None:
+            yield self.url
+        else:
+            with self.backends.use(deadline, base_url) as backend:
+                yield backend.chat_url
+
+    @contextmanager
+    def _server(self) -> Iterator[str]:
+        """
+        URL de base pour /tokenize, /embedding... : celle de `url`, ou le
+        backend le moins chargé.
+        """
+        if self.backends is None:
+            yield self.base_url
+        else:
+            with self.backends.use() as backend:
+                yield backend.base_url
+
+    # --- Pré-connexion ---
+
+    def preconnect(self, n: int = 1) -> int:
+        """
+        Ouvre jusqu'à n connexions à l'avance (par backend) et les laisse dans
+        le pool. Retourne le nombre de connexions effectivement ouvertes.
+        Un serveur injoignable n'est pas une erreur ici : on réessaiera
+        au premier vrai appel.
+        """
+        if self.backends is None:
+            return self._preconnect(self.url, n)
+        return sum(self._preconnect(b.chat_url, n) for b in self.backends.backends)
+
+    def _preconnect(self, url: str, n: int) -> int:
+        adapter = self.session.get_adapter(url)
+        # Même clé de pool que celle utilisée par session.post()
+        request = requests.Request("POST", url).prepare()
+        settings = self.session.merge_environment_settings(url, {}, None, None, None)
+        pool = adapter.get_connection_with_tls_context(
+            request, settings["verify"], settings["proxies"], settings["cert"]
+        )
+        n = min(n, self.pool_maxsize)
+
+        conns = []
+        opened = 0
+        try:
+            for _ in range(n):
+                # _get_conn de la classe de base : on ne compte pas ça comme un miss
+                conn = HTTPConnectionPool._get_conn(pool)
+                conns.append(conn)
+                if getattr(conn, "sock", None) is None:
+                    conn.timeout = self.timeouts.connect
+                    conn.connect()
+                    opened += 1
+        except (OSError, urllib3.exceptions.HTTPError) as e:
+            event("preconnect_failed", INFO, url=url, error=str(e))
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+
+        with self.stats._lock:
+            self.stats.preconnected += opened
+        return opened
+
+    # --- Slots du serveur ---
+
+    def slot_action(
+        self,
+        id_slot: int,
+        action: str,
+        filename: Optional[str] = None,
+        base_url: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        POST /slots/{id_slot}?action=save|restore|erase : sauvegarde, restaure
+        ou efface le cache KV d'un slot (fichier `filename` dans le dossier
+        --slot-save-path du serveur). Sans effet en replay de cassette.
+        base_url : serveur du slot (backend qui a servi ses appels), celui
+        de `url` par défaut.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            return {}
+        body = {"filename": filename} if filename else {}
+        try:
+            response = self.session.post(
+                f"{base_url or self.base_url}/slots/{id_slot}",
+                params={"action": action},
+                json=body,
+                timeout=self.timeouts.as_requests(),
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise RuntimeError(f"Action {action} sur le slot {id_slot} impossible: {e}") from e
+        return response.json()
+
+    def tokenize(self, text: str) -> List[int]:
+        """
+        POST /tokenize : tokens de `text` pour le modèle du serveur (compte
+        exact, voir TokenCounter). Indisponible en replay de cassette.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            raise RuntimeError("Tokenisation indisponible en replay de cassette")
+        try:
+            with self._server() as base_url:
+                response = self.session.post(
+                    f"{base_url}/tokenize",
+                    json={"content": text},
+                    timeout=self.timeouts.as_requests(),
+                )
+                response.raise_for_status()
+                return response.json()["tokens"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise RuntimeError(f"Tokenisation impossible: {e}") from e
+
+    def embed(self, texts: List[str]) -> List[Any]:
+        """
+        POST /embedding (llama-server lancé avec --embeddings) : un vecteur par
+        texte, dans l'ordre (liste de lignes si le serveur ne fait pas le
+        pooling ; voir llama_client.embeddings). Indisponible en replay de cassette.
+        """
+        if self.cassette is not None and self.cassette.replaying:
+            raise RuntimeError("Embeddings indisponibles en replay de cassette")
+        try:
+            with self._server() as base_url:
+                response = self.session.post(
+                    f"{base_url}/embedding",
+                    json={"content": texts},
+                    timeout=self.timeouts.as_requests(),
+                )
+                response.raise_for_status()
+                data = response.json()
+            if isinstance(data, dict):
+                # anciennes versions : un seul texte, {"embedding": [...]}
+                data = [{"index": 0, **data}]
+            return [item["embedding"] for item in sorted(data, key=lambda item: item.get("index", 0))]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            raise RuntimeError(f"Embeddings impossibles: {e}") from e
+
+    # --- Appels ---
+
+    def policy_for(self, call_site: Optional[str]) -> CallPolicy:
+        return self.policies.get(call_site or "", self.default_policy)
+
+    def post_chat(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Optional[Timeouts] = None,
+        use_cache: bool = False,
+        call_site: Optional[str] = None,
+        priority: str = "interactive",
+        stop_at_json: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        POST du payload sur l'endpoint chat, retourne le JSON décodé.
+        use_cache : autorise le cache pour cet appel (ignoré si temperature != 0).
+        call_site : nom du site d'appel ("classify_intent", "final_answer", ...)
+        qui sélectionne la CallPolicy.
+        priority : classe de priorité pour le scheduler ("interactive", "background").
+        stop_at_json : la génération est arrêtée dès que le premier objet JSON
+        de la réponse est complet (appel streamé en interne, connexion fermée) ;
+        le contenu s'arrête à la fin de l'objet.
+        """
+        call = ChatCall.prepare(payload, self.cache if use_cache else None, call_site, stop_at_json)
+        cached = call.cached()
+        if cached is not None:
+            return cached
+
+        def fetch() -> Dict[str, Any]:
+            send = lambda: self._resilient_post(call, timeouts)
+            if self.batcher is not None:
+                send = lambda inner=send: self.batcher.submit(inner)
+            if self.scheduler is not None:
+                data = self.scheduler.submit(send, priority)
+            else:
+                data = send()
+            return call.finish(data)
+
+        key = call.coalesce_key() if self.singleflight is not None else None
+        if key is not None:
+            return self.singleflight.do(key, fetch)
+        return fetch()
+
+    def _resilient_post(self, call: ChatCall, timeouts: Optional[Timeouts]) -> Dict[str, Any]:
+        attempts = Attempts(self, call.call_site, timeouts, call.deadline, call.cancel)
+        while True:
+            attempt_timeouts = attempts.begin()
+            try:
+                data = self._hedged_post(call.sent, attempt_timeouts, attempts, call.cancel, call.deadline)
+            except BaseException as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            return attempts.succeeded(data)
+
+    def _hedged_post(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        attempts: Attempts,
+        cancel: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Lance l'appel ; s'il n'a pas répondu après le quantile observé, envoie
+        un doublon (autre connexion, autre backend si pool) et garde la première
+        réponse valide. Le perdant est annulé (son propre CancelToken, lié à
+        `cancel`) : sa connexion est coupée et son slot libéré.
+        """
+        delay = attempts.hedge_after()
+        if delay is None:
+            return self._post(payload, timeouts, cancel, deadline)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_maxsize, thread_name_prefix="llama-hedge")
+
+        tokens = [CancelToken(), CancelToken()]  # appel principal, doublon
+        unlinks = [cancel.on_cancel(token.cancel) for token in tokens] if cancel is not None else []
+        try:
+            primary = self._executor.submit(self._post, payload, timeouts, tokens[0], deadline)
+            done, _ = wait([primary], timeout=delay)
+            if done or not attempts.try_hedge():
+                return primary.result()
+
+            hedge = self._executor.submit(self._post, payload, timeouts, tokens[1], deadline)
+            pending = {primary, hedge}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if future is hedge:
+                            attempts.hedge_won()
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            # sans effet sur un appel déjà terminé
+            for token in tokens:
+                token.cancel()
+            for unlink in unlinks:
+                unlink()
+
+    def _post(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        cancel: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        if self.cassette is not None and self.cassette.replaying:
+            recording = self.cassette.lookup(payload)
+            time.sleep(self.cassette.delay(recording))
+            return recording.response
+
+        start = time.monotonic()
+        if payload.get(STOP_AT_JSON):
+            data = self._post_until_json(payload, timeouts, cancel, deadline)
+        else:
+            with self._endpoint(deadline, payload.get(BACKEND_URL)) as url:
+                try:
+                    with _abort_on_cancel(cancel):
+                        response = self.session.post(url, json=request_body(payload), timeout=timeouts.as_requests())
+                    response.raise_for_status()
+                    # corps illisible (page HTML d'un proxy...) : requests.JSONDecodeError
+                    data = response.json()
+                except requests.RequestException as e:
+                    raise _http_error(e, cancel) from e
+        if self.cassette is not None:
+            self.cassette.record(payload, data, time.monotonic() - start)
+        return data
+
+    def _post_until_json(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Timeouts,
+        cancel: Optional[CancelToken] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> Dict[str, Any]:
+        """
+        Appel streamé lu jusqu'à la fin du premier objet JSON, puis connexion
+        fermée dès que le modèle génère autre chose que des espaces :
+        llama-server voit la déconnexion et arrête de générer. Sous grammaire
+        (json_schema), le modèle s'arrête seul et le bloc usage final est lu.
+        """
+        sent = request_body(payload)
+        sent.update(stream=True, stream_options={"include_usage": True})
+        scanner = JsonObjectScanner()
+        usage = finish = None
+        pieces = 0
+        with self._endpoint(deadline, payload.get(BACKEND_URL)) as url:
+            try:
+                with _abort_on_cancel(cancel):
+                    response = self.session.post(url, json=sent, timeout=timeouts.as_requests(), stream=True)
+                response.raise_for_status()
+                unlink = cancel.on_cancel(lambda: _shutdown_socket(_stream_socket(response.raw))) if cancel else None
+                # fermée avant la fin du flux : urllib3 coupe la connexion au lieu de la rendre au pool
+                with response:
+                    try:
+                        for chunk in iter_sse_chunks(response.iter_lines()):
+                            usage = chunk.get("usage") or usage
+                            finish = chunk_finish_reason(chunk) or finish
+                            text = delta_text(chunk)
+                            if text:
+                                pieces += 1
+                                if scanner.feed(text) and scanner.trailing_text():
+                                    break
+                    finally:
+                        if unlink is not None:
+                            unlink()
+            except requests.RequestException as e:
+                raise _http_error(e, cancel) from e
+        if cancel is not None:
+            cancel.check()
+        annotate(stopped_at_json=scanner.done)
+        return json_stream_response(scanner, sent, usage, pieces, finish)
+
+    def stream_chat(
+        self,
+        payload: Dict[str, Any],
+        timeouts: Optional[Timeouts] = None,
+        call_site: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Même appel avec "stream": true : générateur des morceaux de texte
+        au fur et à mesure de leur génération. La connexion est rendue au pool
+        quand le générateur est épuisé ou fermé.
+        Pas de retry ni de hedge ici (le texte est déjà parti), mais le
+        circuit breaker s'applique.
+        """
+        timeouts = timeouts or self.policy_for(call_site).timeouts or self.timeouts
+        payload, timeouts, deadline, cancel = prepare_stream(payload, timeouts)
+        if self.cassette is not None and self.cassette.replaying:
+            recording = self.cassette.lookup(payload)
+            pause = self.cassette.delay(recording) / max(len(recording.chunks), 1)
+            for text in recording.chunks:
+                time.sleep(pause)
+                yield text
+            record_usage(call_site, {"usage": recording.usage})
+            return
+
+        self.breaker.before_call()
+        start = time.monotonic()
+        chunks: List[str] = []
+        usage = None
+        connected = False
+        try:
+            with self._endpoint(deadline, payload.get(BACKEND_URL)) as url:
+                try:
+                    with _abort_on_cancel(cancel):
+                        response = self.session.post(
+                            url, json=request_body(payload), timeout=timeouts.as_requests(), stream=True
+                        )
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    raise _http_error(e, cancel) from e
+                self.breaker.record_success()
+                connected = True
+
+                # annulation pendant le flux : on coupe la connexion qui le porte
+                unlink = cancel.on_cancel(lambda: _shutdown_socket(_stream_socket(response.raw))) if cancel else None
+                with response:
+                    try:
+                        for chunk in iter_sse_chunks(response.iter_lines()):
+                            # le dernier chunk porte le bloc usage (stream_options.include_usage)
+                            usage = chunk.get("usage") or usage
+                            text = delta_text(chunk)
+                            if text:
+                                chunks.append(text)
+                                yield text
+                    except requests.RequestException as e:
+                        if cancel is not None and cancel.cancelled:
+                            raise RequestCancelled("Flux llama-server annulé") from e
+                        raise RuntimeError(f"Flux llama-server interrompu: {e}") from e
+                    finally:
+                        if unlink is not None:
+                            unlink()
+                    if cancel is not None:
+                        cancel.check()
+        except BaseException as e:
+            record_stream_outcome(self.breaker, e, connected, deadline)
+            raise
+        record_usage(call_site, {"usage": usage})
+        if self.cassette is not None:
+            self.cassette.record_stream(payload, chunks, time.monotonic() - start, usage)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        if self.cassette is not None:
+            self.cassette.close()
+        self.session.close()
+
+
+# =========================
+# Client partagé par défaut
+# =========================
+
+_default_client: Optional[LlamaClient] = None
+_clients_by_url: Dict[str, LlamaClient] = {}
+_default_lock = threading.Lock()
+
+
+def get_default_client() -> LlamaClient:
+    """
+    Retourne le client partagé du processus (créé au premier appel,
+    avec un cache de réponses en mémoire, et la cassette de LLAMA_CASSETTE
+    si la variable est définie).
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LlamaClient(cache=ResponseCache(), cassette=cassette_from_env())
+        return _default_client
+
+
+def set_default_client(client: LlamaClient) -> None:
+    """
+    Remplace le client partagé (autre URL, autre taille de pool, ...).
+    """
+    global _default_client
+    with _default_lock:
+        _default_client = client
+
+
+def get_client_for(url: Optional[str]) -> LlamaClient:
+    """
+    Client partagé d'un autre llama-server (ex. celui d'un petit modèle),
+    créé au premier appel ; None ou l'URL du client par défaut -> client par défaut.
+    Le cache de réponses et la cassette sont ceux du client par défaut.
+    """
+    default = get_default_client()
+    if url is None or url == default.url:
+        return default
+    with _default_lock:
+        client = _clients_by_url.get(url)
+        if client is None:
+            client = LlamaClient(url=url, cache=default.cache, cassette=default.cassette)
+            _clients_by_url[url] = client
+        return client
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from .config import Timeouts
+from .tracing import INFO, event
+
+
+# =========================
+# Politique par site d'appel
+# =========================
+
+@dataclass
+class CallPolicy:
+    """
+    Réglages de robustesse pour un type d'appel (routing, réponse finale, ...).
+
+    - timeouts : remplace les timeouts du client pour ces appels
+    - max_retries : nombre de nouvelles tentatives après un échec
+      (limité en plus par le RetryBudget global du client)
+    - retry_backoff : attente avant la 1re nouvelle tentative (doublée ensuite)
+    - hedge : envoie un doublon si l'appel dépasse le quantile observé
+    - hedge_quantile / hedge_min_delay : seuil du doublon (jamais sous min_delay)
+    """
+    timeouts: Optional[Timeouts] = None
+    max_retries: int = 0
+    retry_backoff: float = 0.2
+    hedge: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_delay: float = 0.5
+
+
+# Appels courts et déterministes : on peut réessayer et doubler sans risque
+ROUTING_POLICY = CallPolicy(
+    timeouts=Timeouts(connect=2.0, read=20.0),
+    max_retries=2,
+    hedge=True,
+)
+
+# Réponse finale : longue à générer, on ne la double pas
+ANSWER_POLICY = CallPolicy(
+    timeouts=Timeouts(connect=2.0, read=60.0),
+    max_retries=1,
+)
+
+DEFAULT_POLICIES: Dict[str, CallPolicy] = {
+    "classify_intent": ROUTING_POLICY,
+    "smart_switch": ROUTING_POLICY,
+    "analyze_user_message": ROUTING_POLICY,
+    "route_and_extract": ROUTING_POLICY,
+    "final_answer": ANSWER_POLICY,
+}
+
+
+@dataclass
+class HedgeStats:
+    """
+    - sent : doublons envoyés
+    - won : doublons qui ont répondu avant l'appel d'origine
+    """
+    sent: int = 0
+    won: int = 0
+
+
+# =========================
+# Latences observées
+# =========================
+
+class LatencyTracker:
+    """
+    Fenêtre glissante des dernières latences réussies, par site d'appel.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, call_site: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(call_site, deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def quantile(self, call_site: str, q: float) -> Optional[float]:
+        """
+        None tant qu'on n'a pas assez d'échantillons pour que ce soit fiable.
+        """
+        with self._lock:
+            samples = self._samples.get(call_site)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+# =========================
+# Budget de retry
+# =========================
+
+class RetryBudget:
+    """
+    Limite globale des nouvelles tentatives (et des doublons hedgés).
+
+    Chaque requête dépose `ratio` jeton, chaque retry en consomme un : en régime
+    normal on ne dépasse pas ~ratio retries par requête, et une panne ne se
+    transforme pas en tempête de retries. `min_tokens` laisse quelques retries
+    possibles quand le trafic est faible.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 3.0, max_tokens: float = 50.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = min_tokens
+        self._lock = threading.Lock()
+        self.spent = 0
+        self.refused = 0
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                self.spent += 1
+                return True
+            self.refused += 1
+            return False
+
+
+# =========================
+# Circuit breaker
+# =========================
+
+class CircuitOpenError(RuntimeError):
+    """
+    Levée sans appeler llama-server quand le circuit est ouvert.
+    """
+
+
+class LlamaRequestError(RuntimeError):
+    """
+    Requête refusée par llama-server (4xx : payload invalide, json_schema ou
+    tools non supportés...). La renvoyer telle quelle échouerait pareil : ni
+    retry, ni échec compté par le circuit breaker ou le BackendPool.
+    """
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+
+# 4xx transitoires (timeout côté serveur, trop de requêtes) : traités comme un 5xx
+RETRYABLE_STATUSES = frozenset({408, 429})
+
+
+def is_request_error(status: int) -> bool:
+    """
+    True si le statut HTTP signale une requête refusée (voir LlamaRequestError).
+    """
+    return 400 <= status < 500 and status not in RETRYABLE_STATUSES
+
+
+class CircuitBreaker:
+    """
+    - closed : les appels passent ; failure_threshold échecs consécutifs -> open
+    - open : échec immédiat (CircuitOpenError) pendant reset_timeout secondes
+    - half-open : un seul appel d'essai ; succès -> closed, échec -> open
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"llama-server indisponible (circuit ouvert), nouvel essai dans {remaining:.0f}s"
+                    )
+                self.state = "half-open"
+            if self._trial_in_flight:
+                raise CircuitOpenError("llama-server en cours de vérification (circuit semi-ouvert)")
+            self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_abandoned(self) -> None:
+        """
+        Appel terminé sans que le serveur soit en cause (annulation,
+        échéance du tour, CancelledError, CassetteMiss...) : ni succès ni
+        échec, mais l'essai semi-ouvert éventuel est libéré.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half-open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    event("circuit_open", INFO, failures=self._failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures}
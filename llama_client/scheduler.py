@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class BusyError(RuntimeError):
+    """
+    Levée immédiatement quand la file d'une classe de priorité est pleine
+    (ou que l'attente dépasse max_wait) : mieux vaut un "occupé" tout de
+    suite qu'un timeout de 60 s.
+    """
+
+
+@dataclass
+class PriorityClass:
+    """
+    - priority : plus petit = servi en premier
+    - max_concurrency : appels de cette classe en cours en même temps
+    - max_queue : appels de cette classe en attente au maximum
+    - max_wait : attente maximale dans la file (None = illimitée)
+    """
+    name: str
+    priority: int
+    max_concurrency: int
+    max_queue: int
+    max_wait: Optional[float] = None
+
+
+INTERACTIVE = PriorityClass("interactive", priority=0, max_concurrency=8, max_queue=32, max_wait=10.0)
+BACKGROUND = PriorityClass("background", priority=1, max_concurrency=2, max_queue=256)
+
+
+@dataclass
+class ClassStats:
+    """
+    Le temps passé dans la file (queue_wait) est compté à part du temps
+    d'exécution de l'appel lui-même (service : HTTP + inférence).
+    """
+    admitted: int = 0
+    rejected: int = 0
+    completed: int = 0
+    queue_wait_total: float = 0.0
+    queue_wait_max: float = 0.0
+    service_total: float = 0.0
+    service_max: float = 0.0
+
+    def record(self, queue_wait: float, service: float) -> None:
+        self.completed += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.service_total += service
+        self.service_max = max(self.service_max, service)
+
+    def snapshot(self) -> Dict[str, Any]:
+        n = self.completed or 1
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "queue_wait_mean": self.queue_wait_total / n,
+            "queue_wait_max": self.queue_wait_max,
+            "service_mean": self.service_total / n,
+            "service_max": self.service_max,
+        }
+
+
+@dataclass
+class _ClassState:
+    spec: PriorityClass
+    running: int = 0
+    queued: int = 0
+    stats: ClassStats = field(default_factory=ClassStats)
+
+
+class _SchedulerBase:
+    """
+    Logique commune : file de priorité (priority, ordre d'arrivée), capacité
+    globale et limites par classe. Un ticket peut partir quand la capacité le
+    permet, que sa classe a de la place, et qu'aucun ticket plus prioritaire
+    éligible n'attend.
+    """
+
+    def __init__(self, classes: Optional[List[PriorityClass]] = None, capacity: int = 8):
+        classes = classes or [INTERACTIVE, BACKGROUND]
+        self.capacity = capacity
+        self.running = 0
+        self._classes: Dict[str, _ClassState] = {c.name: _ClassState(c) for c in classes}
+        self._waiting: List[Tuple[int, int, str]] = []
+        self._seq = itertools.count()
+
+    def _state(self, priority: str) -> _ClassState:
+        try:
+            return self._classes[priority]
+        except KeyError:
+            raise ValueError(f"Classe de priorité inconnue: {priority!r}") from None
+
+    def _admit(self, state: _ClassState) -> Tuple[int, int, str]:
+        if state.queued >= state.spec.max_queue:
+            state.stats.rejected += 1
+            raise BusyError(f"Serveur LLM saturé (file '{state.spec.name}' pleine)")
+        ticket = (state.spec.priority, next(self._seq), state.spec.name)
+        heapq.heappush(self._waiting, ticket)
+        state.queued += 1
+        return ticket
+
+    def _has_room(self, state: _ClassState) -> bool:
+        return self.running < self.capacity and state.running < state.spec.max_concurrency
+
+    def _can_start(self, ticket: Tuple[int, int, str]) -> bool:
+        for candidate in sorted(self._waiting):
+            if self._has_room(self._classes[candidate[2]]):
+                return candidate == ticket
+        return False
+
+    def _start(self, ticket: Tuple[int, int, str], state: _ClassState) -> None:
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        state.queued -= 1
+        state.running += 1
+        state.stats.admitted += 1
+        self.running += 1
+
+    def _abandon(self, ticket: Tuple[int, int, str], state: _ClassState) -> None:
+        self._waiting.remove(ticket)
+        heapq.heapify(self._waiting)
+        state.queued -= 1
+        state.stats.rejected += 1
+
+    def _finish(self, state: _ClassState) -> None:
+        state.running -= 1
+        self.running -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            name: {"running": s.running, "queued": s.queued, **s.stats.snapshot()}
+            for name, s in self._classes.items()
+        }
+
+
+class Scheduler(_SchedulerBase):
+    """
+    File de priorité + contrôle d'admission devant LlamaClient (threads).
+    """
+
+    def __init__(self, classes: Optional[List[PriorityClass]] = None, capacity: int = 8):
+        super().__init__(classes, capacity)
+        self._cond = threading.Condition()
+
+    def submit(self, thunk: Callable[[], T], priority: str = "interactive") -> T:
+        with self._cond:
+            state = self._state(priority)
+            ticket = self._admit(state)
+            enqueued = time.monotonic()
+            max_wait = state.spec.max_wait
+            while not self._can_start(ticket):
+                remaining = None if max_wait is None else max_wait - (time.monotonic() - enqueued)
+                if remaining is not None and remaining <= 0:
+                    self._abandon(ticket, state)
+                    self._cond.notify_all()
+                    raise BusyError(f"Serveur LLM saturé (attente '{priority}' > {max_wait:.0f}s)")
+                self._cond.wait(remaining)
+            self._start(ticket, state)
+
+        started = time.monotonic()
+        try:
+            return thunk()
+        finally:
+            with self._cond:
+                self._finish(state)
+                state.stats.record(started - enqueued, time.monotonic() - started)
+                self._cond.notify_all()
+
+
+class AsyncScheduler(_SchedulerBase):
+    """
+    Même chose pour AsyncLlamaClient (une seule boucle asyncio).
+    """
+
+    def __init__(self, classes: Optional[List[PriorityClass]] = None, capacity: int = 8):
+        super().__init__(classes, capacity)
+        self._cond = asyncio.Condition()
+
+    async def submit(self, thunk: Callable[[], Awaitable[T]], priority: str = "interactive") -> T:
+        async with self._cond:
+            state = self._state(priority)
+            ticket = self._admit(state)
+            enqueued = time.monotonic()
+            max_wait = state.spec.max_wait
+            try:
+                await asyncio.wait_for(self._cond.wait_for(lambda: self._can_start(ticket)), max_wait)
+            except asyncio.TimeoutError:
+                self._abandon(ticket, state)
+                self._cond.notify_all()
+                raise BusyError(f"Serveur LLM saturé (attente '{priority}' > {max_wait:.0f}s)") from None
+            except asyncio.CancelledError:
+                self._abandon(ticket, state)
+                self._cond.notify_all()
+                raise
+            self._start(ticket, state)
+
+        started = time.monotonic()
+        try:
+            return await thunk()
+        finally:
+            async with self._cond:
+                self._finish(state)
+                state.stats.record(started - enqueued, time.monotonic() - started)
+                self._cond.notify_all()
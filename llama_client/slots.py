@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from .pool import LlamaClient
+from .tracing import INFO, annotate, event
+
+
+@dataclass
+class SlotStats:
+    hits: int = 0       # clé déjà dans son slot : cache KV intact
+    assigned: int = 0   # nouvelle clé placée dans un slot
+    saves: int = 0      # clé évincée : cache KV de son slot sauvegardé sur disque
+    restores: int = 0   # clé revenue : cache KV restauré depuis le disque
+    unpinned: int = 0   # slot de la clé déjà pris, ou tous occupés : slot au choix du serveur
+    errors: int = 0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "assigned": self.assigned,
+            "saves": self.saves,
+            "restores": self.restores,
+            "unpinned": self.unpinned,
+            "errors": self.errors,
+        }
+
+
+class SlotAffinity:
+    """
+    Épingle chaque clé sur un slot de llama-server (champ id_slot), pour que
+    le cache KV du slot serve d'un appel à l'autre au lieu de dépendre du
+    slot libre. La clé désigne un préfixe de prompt commun (même prompt
+    système, partagé par toutes les conversations) ou une conversation.
+
+    - n_slots : nombre de slots de chaque serveur (option -np) ; avec un
+      BackendPool sur le client, les slots de tous les backends sont
+      répartis et route() donne le backend du slot
+    - un slot ne sert qu'un appel à la fois : si celui de la clé est déjà
+      pris (clé partagée), l'appel n'est pas épinglé plutôt que d'attendre
+    - save : quand une clé est évincée (plus de clés que de slots), le
+      cache KV de son slot est sauvegardé juste avant d'être réutilisé
+      (POST /slots/{id}?action=save, dans le --slot-save-path du serveur) ;
+      la clé est restaurée quand elle revient, au lieu de retraiter tout
+      son prompt. Tant que chaque clé a son slot, aucune sauvegarde.
+      Désactivé automatiquement si le serveur refuse (pas de --slot-save-path).
+
+        affinity = SlotAffinity(client, n_slots=4)
+        with affinity.pin("session-42") as slot:   # None si non épinglé
+            id_slot, base_url = affinity.route(slot)
+            ...
+    """
+
+    def __init__(self, client: LlamaClient, n_slots: int, save: bool = True, prefix: str = "llama-slot"):
+        self.client = client
+        self.n_slots = n_slots
+        self.save = save
+        self.prefix = prefix
+        self.stats = SlotStats()
+        backends = client.backends.backends if client.backends is not None else [None]
+        # backend de chaque slot (None : le serveur de client.url)
+        self._urls: List[Optional[str]] = [b and b.base_url for b in backends for _ in range(n_slots)]
+        self._lock = threading.Lock()
+        self._resident: "OrderedDict[str, int]" = OrderedDict()  # clé -> slot, de la moins à la plus récente
+        self._in_use = [0] * len(self._urls)
+        self._saved: Dict[str, Optional[str]] = {}  # clé -> backend qui a le fichier
+
+    def filename(self, key: str) -> str:
+        return f"{self.prefix}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]}.bin"
+
+    def route(self, slot: int) -> Tuple[int, Optional[str]]:
+        """
+        (id_slot sur son serveur, URL de base de son backend ou None).
+        """
+        return slot % self.n_slots, self._urls[slot]
+
+    def _acquire(self, key: str) -> Optional[int]:
+        evicted = None
+        with self._lock:
+            slot = self._resident.get(key)
+            if slot is not None:
+                self._resident.move_to_end(key)
+                if self._in_use[slot]:
+                    self.stats.unpinned += 1
+                    return None
+                self._in_use[slot] += 1
+                self.stats.hits += 1
+                return slot
+            free = sorted(set(range(len(self._urls))) - set(self._resident.values()))
+            if free:
+                slot = free[0]
+            else:
+                # clé la moins récemment utilisée dont le slot est inactif
+                evicted = next((k for k, s in self._resident.items() if self._in_use[s] == 0), None)
+                if evicted is None:
+                    self.stats.unpinned += 1
+                    return None
+                slot = self._resident.pop(evicted)
+            self._resident[key] = slot
+            self._in_use[slot] += 1
+            save = self.save and evicted is not None
+            restore = self.save and key in self._saved and self._saved[key] == self._urls[slot]
+
+        # sauvegarde de la clé évincée puis restauration hors verrou : le slot est déjà réservé
+        if save and self._action(slot, "save", evicted):
+            with self._lock:
+                self._saved[evicted] = self._urls[slot]
+                self.stats.saves += 1
+        if restore and self.save and self._action(slot, "restore", key):
+            with self._lock:
+                self.stats.restores += 1
+        else:
+            with self._lock:
+                self.stats.assigned += 1
+        return slot
+
+    def _release(self, slot: Optional[int]) -> None:
+        if slot is None:
+            return
+        with self._lock:
+            self._in_use[slot] -= 1
+
+    def _action(self, slot: int, action: str, key: str) -> bool:
+        id_slot, base_url = self.route(slot)
+        try:
+            self.client.slot_action(id_slot, action, self.filename(key), base_url=base_url)
+            return True
+        except RuntimeError as e:
+            with self._lock:
+                self.stats.errors += 1
+                disable = self.save
+                self.save = False
+            if disable:
+                event("slot_saves_disabled", INFO, action=action, slot=slot, error=str(e))
+            return False
+
+    @contextmanager
+    def pin(self, key: str) -> Iterator[Optional[int]]:
+        slot = self._acquire(key)
+        annotate(id_slot=slot)
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    @asynccontextmanager
+    async def pin_async(self, key: str) -> AsyncIterator[Optional[int]]:
+        # sauvegarde / restauration éventuelles en HTTP bloquant : dans un thread
+        slot = await asyncio.to_thread(self._acquire, key)
+        annotate(id_slot=slot)
+        try:
+            yield slot
+        finally:
+            self._release(slot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats.snapshot(),
+                "resident": dict(self._resident),
+                "saved": len(self._saved),
+            }
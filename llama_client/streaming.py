@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import json
+from typing import Any, AsyncIterable, Callable, Dict, Iterable, Iterator, Optional, Union
+
+from .usage import estimate_tokens
+
+# =========================
+# Parsing du flux SSE (stream: true)
+# =========================
+#
+# llama-server envoie une suite de lignes :
+#   data: {"choices": [{"delta": {"content": "Bon"}}], ...}
+#   data: {"choices": [{"delta": {"content": "jour"}}], ...}
+#   data: [DONE]
+
+SSE_DONE = "[DONE]"
+
+
+def parse_sse_line(line: Union[str, bytes]) -> Optional[Union[Dict[str, Any], str]]:
+    """
+    Retourne le chunk JSON d'une ligne "data: ...", SSE_DONE pour la fin du flux,
+    ou None pour les lignes à ignorer (vides, commentaires, autres champs).
+    """
+    if isinstance(line, bytes):
+        line = line.decode("utf-8")
+    line = line.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == SSE_DONE:
+        return SSE_DONE
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError as e:
+        raise RuntimeError(f"Chunk SSE illisible: {data!r}") from e
+
+
+def delta_text(chunk: Dict[str, Any]) -> str:
+    """
+    Texte apporté par un chunk (choices[0].delta.content), "" s'il n'y en a pas.
+    """
+    try:
+        return chunk["choices"][0]["delta"].get("content") or ""
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return ""
+
+
+def chunk_finish_reason(chunk: Dict[str, Any]) -> Optional[str]:
+    """
+    finish_reason du dernier chunk ("stop", "length"...), None avant.
+    """
+    try:
+        return chunk["choices"][0].get("finish_reason")
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def iter_sse_chunks(lines: Iterable[Union[str, bytes]]) -> Iterator[Dict[str, Any]]:
+    for line in lines:
+        chunk = parse_sse_line(line)
+        if chunk is None:
+            continue
+        if chunk == SSE_DONE:
+            return
+        yield chunk
+
+
+def iter_deltas(lines: Iterable[Union[str, bytes]]) -> Iterator[str]:
+    for chunk in iter_sse_chunks(lines):
+        text = delta_text(chunk)
+        if text:
+            yield text
+
+
+# =========================
+# Reconstruction du texte complet
+# =========================
+
+def collect_stream(
+    deltas: Iterable[str],
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Recolle les deltas en texte complet.
+    on_delta est appelé sur chaque morceau dès sa réception (affichage progressif).
+    """
+    parts = []
+    for delta in deltas:
+        if on_delta is not None:
+            on_delta(delta)
+        parts.append(delta)
+    return "".join(parts)
+
+
+async def collect_stream_async(
+    deltas: AsyncIterable[str],
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Version asyncio de collect_stream ; le flux est fermé (aclose) même si
+    on_delta lève ou si la tâche est annulée.
+    """
+    parts = []
+    try:
+        async for delta in deltas:
+            if on_delta is not None:
+                on_delta(delta)
+            parts.append(delta)
+    finally:
+        aclose = getattr(deltas, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    return "".join(parts)
+
+
+# =========================
+# Extraction incrémentale du premier objet JSON
+# =========================
+
+# Marqueur privé d'un payload à arrêter dès que le premier objet JSON de la
+# réponse est complet (retiré avant l'envoi ; distingue les clés de cache,
+# de coalescing et de cassette de celles de l'appel complet)
+STOP_AT_JSON = "_stop_at_json"
+
+
+class JsonObjectScanner:
+    """
+    Cherche le premier objet JSON {...} valide dans un texte reçu morceau par
+    morceau, sans jamais re-parcourir ce qui a déjà été vu. Les accolades
+    dans les chaînes (et les guillemets échappés) ne comptent pas ; un bloc
+    équilibré qui n'est pas du JSON (exemple dans de la prose) est sauté.
+
+    - feed(morceau) -> True dès que l'objet est complet
+    - value : l'objet trouvé, end : position juste après lui dans text
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.value: Optional[Dict[str, Any]] = None
+        self.end = 0
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def done(self) -> bool:
+        return self.value is not None
+
+    def trailing_text(self) -> str:
+        """
+        Texte non blanc reçu après l'objet (prose du modèle) : signal d'arrêt.
+        """
+        return self.text[self.end:].strip() if self.done else ""
+
+    def feed(self, piece: str) -> bool:
+        offset = len(self.text)
+        self.text += piece
+        if self.done:
+            return True
+        for i, ch in enumerate(piece, offset):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self._depth > 0
+            elif ch == "{":
+                if self._depth == 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == "}" and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0 and self._try_close(i + 1):
+                    return True
+        return False
+
+    def _try_close(self, end: int) -> bool:
+        try:
+            value = json.loads(self.text[self._start:end])
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(value, dict):
+            return False
+        self.value, self.end = value, end
+        return True
+
+
+def first_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Premier objet JSON valide du texte (fences markdown, prose autour ignorés).
+    """
+    scanner = JsonObjectScanner()
+    scanner.feed(text)
+    return scanner.value
+
+
+def json_stream_response(
+    scanner: JsonObjectScanner,
+    payload: Dict[str, Any],
+    usage: Optional[Dict[str, Any]],
+    completion_tokens: int,
+    finish_reason: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Réponse au format non-streamé d'un flux arrêté au premier objet JSON :
+    texte jusqu'à la fin de l'objet. Arrêté avant le bloc usage final, le
+    flux n'en a pas : les tokens sont alors estimés.
+    finish_reason : celui du flux, gardé si l'objet n'a pas été complété
+    ("length" : réponse tronquée par max_tokens).
+    """
+    content = scanner.text[:scanner.end] if scanner.done else scanner.text
+    if usage is None:
+        prompt = "\n".join(str(m.get("content") or "") for m in payload.get("messages", []))
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt),
+            "completion_tokens": completion_tokens,
+            "total_tokens": estimate_tokens(prompt) + completion_tokens,
+        }
+    return {
+        "object": "chat.completion",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop" if scanner.done else (finish_reason or "stop"),
+        }],
+        "usage": usage,
+    }
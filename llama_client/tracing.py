@@ -0,0 +1,241 @@
+"""
+Traces par tour : spans imbriqués (tour -> routage / extraction / handler /
+réponse finale -> appels LLM) avec durées et attributs.
+
+Désactivé par défaut : span() renvoie alors un objet inerte, le coût se limite
+à une comparaison d'entiers. Activation : LLAMA_TRACE=info | debug, ou
+configure_tracing("debug", echo=True). Au niveau debug, les prompts et les
+réponses brutes du modèle sont attachés aux spans.
+
+Les tours terminés sont gardés en mémoire et exportables au format Chrome
+trace (chrome://tracing, https://ui.perfetto.dev) avec export_chrome_trace().
+"""
+
+from __future__ import annotations
+
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+LEVELS = {"off": OFF, "info": INFO, "debug": DEBUG}
+
+TRACE_ENV = "LLAMA_TRACE"
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    trace_id: int
+    attrs: Dict[str, Any] = field(default_factory=dict)
+    end: Optional[float] = None
+    events: List[Tuple[float, str, Dict[str, Any]]] = field(default_factory=list)
+    children: List["Span"] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    """
+    Renvoyé quand le niveau de trace est trop bas : ne fait rien.
+    """
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    - level : OFF, INFO (structure et timings) ou DEBUG (+ prompts et sorties brutes)
+    - echo : affiche l'arbre de chaque tour terminé dans la console
+    - keep : nombre de tours gardés en mémoire pour l'export
+    """
+
+    def __init__(self, level: int = OFF, echo: bool = False, keep: int = 200):
+        self.level = level
+        self.echo = echo
+        self.traces: Deque[Span] = deque(maxlen=keep)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def enabled(self, level: int = INFO) -> bool:
+        return level <= self.level
+
+    def _finish(self, root: Span) -> None:
+        with self._lock:
+            self.traces.append(root)
+        if self.echo:
+            print(render_span(root))
+
+
+def _level_from_env() -> int:
+    return LEVELS.get(os.environ.get(TRACE_ENV, "off").lower(), OFF)
+
+
+_tracer = Tracer(level=_level_from_env(), echo=_level_from_env() > OFF)
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("llama_span", default=None)
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def configure_tracing(level: str | int = INFO, echo: bool = False, keep: int = 200) -> Tracer:
+    global _tracer
+    if isinstance(level, str):
+        level = LEVELS[level.lower()]
+    _tracer = Tracer(level=level, echo=echo, keep=keep)
+    return _tracer
+
+
+def tracing_enabled(level: int = INFO) -> bool:
+    return level <= _tracer.level
+
+
+# =========================
+# Spans et événements
+# =========================
+
+class _SpanContext:
+    __slots__ = ("tracer", "span", "token")
+
+    def __init__(self, tracer: Tracer, name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        parent = _current.get()
+        trace_id = parent.trace_id if parent is not None else next(tracer._ids)
+        self.span = Span(name, time.perf_counter(), trace_id, attrs)
+        if parent is not None:
+            parent.children.append(self.span)
+        self.token: Optional[contextvars.Token] = None
+
+    def __enter__(self) -> Span:
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> bool:
+        self.span.end = time.perf_counter()
+        if exc is not None:
+            self.span.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        _current.reset(self.token)
+        if _current.get() is None:
+            self.tracer._finish(self.span)
+        return False
+
+
+def span(name: str, level: int = INFO, **attrs: Any) -> Any:
+    """
+    with span("routing", skill=...) as s: ... s.set(intent=...)
+    Un span sans parent est la racine d'une nouvelle trace (un tour).
+    """
+    if level > _tracer.level:
+        return NOOP_SPAN
+    return _SpanContext(_tracer, name, attrs)
+
+
+def annotate(level: int = INFO, **attrs: Any) -> None:
+    """
+    Ajoute des attributs au span courant.
+    """
+    if level > _tracer.level:
+        return
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def event(name: str, level: int = DEBUG, **attrs: Any) -> None:
+    """
+    Événement ponctuel dans le span courant (prompt envoyé, sortie brute...).
+    """
+    if level > _tracer.level:
+        return
+    current = _current.get()
+    if current is not None:
+        current.events.append((time.perf_counter(), name, attrs))
+    elif _tracer.echo:
+        print(f"[trace] {name} {_format_attrs(attrs)}")
+
+
+# =========================
+# Affichage et export
+# =========================
+
+def _format_attrs(attrs: Dict[str, Any]) -> str:
+    return " ".join(f"{k}={v}" for k, v in attrs.items())
+
+
+def render_span(root: Span, indent: str = "") -> str:
+    lines = [f"{indent}{root.name} {root.duration * 1000:.1f}ms {_format_attrs(root.attrs)}".rstrip()]
+    for _, name, attrs in root.events:
+        lines.append(f"{indent}  · {name} {_format_attrs(attrs)}".rstrip())
+    for child in root.children:
+        lines.append(render_span(child, indent + "  "))
+    return "\n".join(lines)
+
+
+def chrome_trace_events(root: Span) -> List[Dict[str, Any]]:
+    """
+    Événements Chrome trace d'un tour : un span = un événement complet ("X"),
+    un tour = une ligne (tid) pour que les tours concurrents ne se chevauchent pas.
+    """
+    pid = os.getpid()
+    out: List[Dict[str, Any]] = []
+
+    def visit(s: Span) -> None:
+        out.append({
+            "name": s.name,
+            "ph": "X",
+            "ts": s.start * 1e6,
+            "dur": s.duration * 1e6,
+            "pid": pid,
+            "tid": s.trace_id,
+            "args": s.attrs,
+        })
+        for ts, name, attrs in s.events:
+            out.append({"name": name, "ph": "i", "s": "t", "ts": ts * 1e6, "pid": pid, "tid": s.trace_id, "args": attrs})
+        for child in s.children:
+            visit(child)
+
+    visit(root)
+    return out
+
+
+def export_chrome_trace(path: str | Path, traces: Optional[List[Span]] = None) -> int:
+    """
+    Écrit les tours gardés par le tracer (ou `traces`) au format Chrome trace JSON.
+    Retourne le nombre de tours exportés.
+    """
+    if traces is None:
+        with _tracer._lock:
+            traces = list(_tracer.traces)
+    events: List[Dict[str, Any]] = []
+    for root in traces:
+        events.extend(chrome_trace_events(root))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+    return len(traces)
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, Optional
+
+from .tracing import annotate
+
+
+@dataclass
+class TokenUsage:
+    """
+    Tokens consommés (bloc "usage" de la réponse llama-server).
+    """
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    calls: int = 0
+    cached_tokens: int = 0  # tokens du prompt repris du cache KV du slot (non retraités)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "TokenUsage") -> None:
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.calls += other.calls
+        self.cached_tokens += other.cached_tokens
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cached_tokens": self.cached_tokens,
+        }
+
+    @classmethod
+    def from_response(cls, data: Dict[str, Any]) -> Optional["TokenUsage"]:
+        """
+        None si la réponse n'a pas de bloc usage (vieux serveur, flux sans usage).
+        Tokens en cache : usage.prompt_tokens_details.cached_tokens, ou
+        timings.cache_n des versions de llama-server qui ne donnent que celui-ci.
+        """
+        usage = data.get("usage") if isinstance(data, dict) else None
+        if not isinstance(usage, dict):
+            return None
+        details = usage.get("prompt_tokens_details") or {}
+        timings = data.get("timings") or {}
+        return cls(
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+            calls=1,
+            cached_tokens=int(details.get("cached_tokens") or timings.get("cache_n") or 0),
+        )
+
+
+class UsageLedger:
+    """
+    Comptes de tokens d'une session, agrégés par étiquette :
+    par site d'appel ("call_site"), par tour ("turn"), par skill ("skill")...
+
+    budget : nombre de tokens (prompt + génération) au-delà duquel
+    `exhausted` passe à True ; l'agent bascule alors sur ses chemins économes.
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = budget
+        self.total = TokenUsage()
+        self._by: Dict[str, Dict[str, TokenUsage]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, usage: TokenUsage, **tags: Optional[str]) -> None:
+        with self._lock:
+            self.total.add(usage)
+            for dimension, value in tags.items():
+                if value is None:
+                    continue
+                bucket = self._by.setdefault(dimension, {})
+                bucket.setdefault(str(value), TokenUsage()).add(usage)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.budget is not None and self.total.total_tokens >= self.budget
+
+    def by(self, dimension: str) -> Dict[str, TokenUsage]:
+        with self._lock:
+            return dict(self._by.get(dimension, {}))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": self.total.snapshot(),
+                "budget": self.budget,
+                **{
+                    dimension: {key: usage.snapshot() for key, usage in bucket.items()}
+                    for dimension, bucket in self._by.items()
+                },
+            }
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximation grossière (~4 caractères par token), quand le serveur
+    n'a pas renvoyé de bloc usage.
+    """
+    return max(len(text) // 4, 1)
+
+
+# =========================
+# Portée courante (comme deadline_scope)
+# =========================
+
+@dataclass(frozen=True)
+class _Scope:
+    ledger: UsageLedger
+    tags: Dict[str, Optional[str]] = field(default_factory=dict)
+
+
+_current: contextvars.ContextVar[Optional[_Scope]] = contextvars.ContextVar("llama_usage", default=None)
+
+
+@contextmanager
+def usage_scope(ledger: Optional[UsageLedger] = None, **tags: Optional[str]) -> Iterator[Optional[UsageLedger]]:
+    """
+    Les appels LLM faits dans le bloc sont comptés dans `ledger` (ou celui de
+    la portée englobante) avec les étiquettes `tags` en plus des englobantes.
+    """
+    outer = _current.get()
+    if ledger is None and outer is not None:
+        ledger = outer.ledger
+    if ledger is None:
+        yield None
+        return
+    merged = {**outer.tags, **tags} if outer is not None and outer.ledger is ledger else dict(tags)
+    token = _current.set(_Scope(ledger, merged))
+    try:
+        yield ledger
+    finally:
+        _current.reset(token)
+
+
+def record_usage(call_site: Optional[str], data: Dict[str, Any]) -> Optional[TokenUsage]:
+    """
+    Appelé par le client après chaque réponse réellement calculée par
+    llama-server (pas pour les hits de cache ni les appels coalescés).
+    """
+    usage = TokenUsage.from_response(data)
+    if usage is None:
+        return None
+    annotate(
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        cached_tokens=usage.cached_tokens,
+    )
+    scope = _current.get()
+    if scope is not None:
+        scope.ledger.record(usage, call_site=call_site or "default", **scope.tags)
+    return usage
+
+
+def budget_exhausted() -> bool:
+    """
+    Le budget de tokens de la session courante est-il dépassé ?
+    Toujours faux sans portée ni budget.
+    """
+    scope = _current.get()
+    return scope is not None and scope.ledger.exhausted
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Les tests importent llama_client et tp_final depuis la racine du dépôt
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tp_final"))
@@ -0,0 +1,69 @@
+"""
+BackendPool devant plusieurs émulateurs llama-server locaux.
+"""
+
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from llama_client import BackendPool, Deadline, DeadlineExceeded, LlamaClient, deadline_scope
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+LONG_REPLY = "mot " * 200
+
+
+def payload() -> dict:
+    return {
+        "messages": [{"role": "user", "content": "Raconte une longue histoire."}],
+        "temperature": 0.7,
+    }
+
+
+@pytest.fixture
+def emulators():
+    servers = [LlamaEmulator(EmulatorConfig(slots=2, gen_tps=5)).start() for _ in range(2)]
+    for server in servers:
+        server.script("longue histoire", LONG_REPLY)
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def test_deadline_does_not_drain_backends(emulators):
+    pool = BackendPool([e.base_url for e in emulators], max_failures=2)
+    client = LlamaClient(backends=pool)
+
+    def turn() -> None:
+        with deadline_scope(Deadline(0.3)):
+            with pytest.raises(DeadlineExceeded):
+                client.post_chat(payload())
+
+    # deux tours simultanés à chaque fois : un par backend (least outstanding)
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for _ in range(2):
+                list(executor.map(lambda _: turn(), range(2)))
+    finally:
+        client.close()
+
+    # chaque backend a vu max_failures échéances dépassées sans être drainé
+    assert all(b.healthy and b.consecutive_failures == 0 for b in pool.backends)
+    assert all(b.outstanding == 0 for b in pool.backends)
+
+
+def test_real_failures_drain_backend(emulators):
+    # port libéré aussitôt réservé : connexion refusée
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        dead_url = "http://127.0.0.1:%d" % s.getsockname()[1]
+    pool = BackendPool([dead_url, emulators[0].base_url], max_failures=2)
+    client = LlamaClient(backends=pool)
+    try:
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                client.post_chat(payload())
+    finally:
+        client.close()
+
+    assert [b.healthy for b in pool.backends] == [False, True]
@@ -0,0 +1,63 @@
+"""
+MicroBatcher / AsyncMicroBatcher : un appel lent ne bloque pas les suivants.
+"""
+
+import asyncio
+import threading
+import time
+
+from llama_client import AsyncMicroBatcher, MicroBatcher
+
+SLOW = 1.0
+FAST = 0.05
+
+
+def test_sync_refills_free_slot():
+    batcher = MicroBatcher(slots=2)
+    durations = [SLOW] + [FAST] * 5
+    finished = {}
+    running = [0, 0]  # en cours, maximum observé
+    lock = threading.Lock()
+
+    def work(i: int) -> None:
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(durations[i])
+        with lock:
+            running[0] -= 1
+
+    def call(i: int) -> None:
+        batcher.submit(lambda: work(i))
+        finished[i] = time.monotonic()
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(durations))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # les appels rapides se relaient sur le second slot pendant l'appel lent
+    assert max(finished[i] for i in range(1, len(durations))) - start < SLOW
+    assert running[1] <= 2
+    assert batcher.stats.requests == len(durations)
+
+
+def test_async_refills_free_slot():
+    async def main():
+        batcher = AsyncMicroBatcher(slots=2)
+        durations = [SLOW] + [FAST] * 5
+        finished = {}
+
+        async def call(i: int) -> None:
+            await batcher.submit(lambda: asyncio.sleep(durations[i]))
+            finished[i] = time.monotonic()
+
+        start = time.monotonic()
+        await asyncio.gather(*(call(i) for i in range(len(durations))))
+        return start, finished, batcher
+
+    start, finished, batcher = asyncio.run(main())
+    assert max(finished[i] for i in range(1, 6)) - start < SLOW
+    assert batcher.stats.requests == 6
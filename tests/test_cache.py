@@ -0,0 +1,57 @@
+"""
+ResponseCache : LRU en mémoire et persistance SQLite.
+"""
+
+from llama_client import LlamaClient, ResponseCache
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+
+def payload(text: str = "Bonjour", temperature: float = 0.0) -> dict:
+    return {"messages": [{"role": "user", "content": text}], "temperature": temperature}
+
+
+def answer(text: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+def test_sqlite_round_trip(tmp_path):
+    path = tmp_path / "responses.sqlite"
+    cache = ResponseCache(path=path)
+    cache.put(payload(), answer("Salut !"))
+    cache.close()
+
+    # nouveau processus : LRU vide, réponse relue sur disque puis gardée en mémoire
+    cache = ResponseCache(path=path)
+    try:
+        assert cache.get(payload()) == answer("Salut !")
+        assert cache.get(payload()) == answer("Salut !")
+        assert cache.get(payload("Autre chose")) is None
+        assert (cache.stats.hits, cache.stats.disk_hits, cache.stats.misses) == (2, 1, 1)
+    finally:
+        cache.close()
+
+
+def test_eviction_keeps_disk_copy(tmp_path):
+    cache = ResponseCache(maxsize=1, path=tmp_path / "responses.sqlite")
+    try:
+        cache.put(payload("a"), answer("A"))
+        cache.put(payload("b"), answer("B"))
+        assert cache.stats.evictions == 1
+        assert cache.get(payload("a")) == answer("A")
+        assert cache.stats.disk_hits == 1
+    finally:
+        cache.close()
+
+
+def test_client_serves_deterministic_calls_from_cache(tmp_path):
+    with LlamaEmulator(EmulatorConfig(time_scale=0.0)) as emulator:
+        client = LlamaClient(url=emulator.url, cache=ResponseCache(path=tmp_path / "responses.sqlite"))
+        try:
+            first = client.post_chat(payload(), use_cache=True)
+            assert client.post_chat(payload(), use_cache=True) == first
+            # temperature > 0 : jamais servi par le cache
+            client.post_chat(payload(temperature=0.7), use_cache=True)
+            client.post_chat(payload(temperature=0.7), use_cache=True)
+        finally:
+            client.close()
+        assert emulator.stats.requests == 3
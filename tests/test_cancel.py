@@ -0,0 +1,141 @@
+"""
+Annulation : un appel LLM lent abandonné au bout de CANCEL_AFTER libère
+aussitôt le slot de l'émulateur llama-server, au lieu d'attendre la fin de
+la génération (~40 s).
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llama_client import CallPolicy, CancelToken, LlamaClient, RequestCancelled, cancel_scope, collect_stream_async
+from llama_client.aio import AsyncLlamaClient
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+LONG_REPLY = "mot " * 400  # ~40 s à 10 tokens/s
+CANCEL_AFTER = 0.3
+SLOT_FREED_WITHIN = 1.0
+
+
+def payload(stream: bool = False) -> dict:
+    return {
+        "messages": [{"role": "user", "content": "Raconte une longue histoire."}],
+        "temperature": 0.7,
+        "stream": stream,
+    }
+
+
+def wait_idle(emulator: LlamaEmulator, timeout: float = SLOT_FREED_WITHIN) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if not any(s["is_processing"] for s in emulator.snapshot_slots()):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+@pytest.fixture
+def emulator():
+    with LlamaEmulator(EmulatorConfig(slots=1, gen_tps=10)) as emulator:
+        emulator.script("longue histoire", LONG_REPLY)
+        yield emulator
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_sync_cancel_frees_slot(emulator, stream):
+    client = LlamaClient(url=emulator.url)
+    token = CancelToken()
+    threading.Timer(CANCEL_AFTER, token.cancel).start()
+    start = time.monotonic()
+    try:
+        with cancel_scope(token), pytest.raises(RequestCancelled):
+            if stream:
+                for _ in client.stream_chat(payload(stream=True)):
+                    pass
+            else:
+                client.post_chat(payload())
+    finally:
+        client.close()
+
+    assert time.monotonic() - start < CANCEL_AFTER + SLOT_FREED_WITHIN
+    assert wait_idle(emulator), "slot toujours occupé après l'annulation"
+    time.sleep(0.1)
+    assert emulator.stats.disconnected == 1
+
+
+def test_async_cancel_frees_slot(emulator):
+    async def main():
+        client = AsyncLlamaClient(url=emulator.url)
+        token = CancelToken()
+        asyncio.get_running_loop().call_later(CANCEL_AFTER, token.cancel)
+        try:
+            with cancel_scope(token), pytest.raises(RequestCancelled):
+                await client.post_chat(payload())
+        finally:
+            await client.close()
+
+    start = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - start < CANCEL_AFTER + SLOT_FREED_WITHIN
+    assert wait_idle(emulator), "slot toujours occupé après l'annulation"
+
+
+def test_async_hedged_cancel_frees_slot(emulator):
+    # le doublon n'est pas encore parti : l'annulation tombe pendant l'attente du premier appel
+    async def main():
+        client = AsyncLlamaClient(url=emulator.url, policies={"story": CallPolicy(hedge=True, hedge_min_delay=5.0)})
+        for _ in range(client.latencies.min_samples):
+            client.latencies.record("story", 0.1)
+        token = CancelToken()
+        asyncio.get_running_loop().call_later(CANCEL_AFTER, token.cancel)
+        try:
+            with cancel_scope(token), pytest.raises(RequestCancelled):
+                await client.post_chat(payload(), call_site="story")
+            # avant la fermeture de la session, qui couperait toutes ses connexions
+            return await asyncio.to_thread(wait_idle, emulator)
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()), "slot toujours occupé après l'annulation"
+
+
+def test_async_stream_closed_early_frees_slot(emulator):
+    class Stop(Exception):
+        pass
+
+    def on_delta(text: str) -> None:
+        raise Stop
+
+    async def main():
+        client = AsyncLlamaClient(url=emulator.url)
+        # référence gardée : le flux n'est pas finalisé par le ramasse-miettes
+        stream = client.stream_chat(payload(stream=True))
+        try:
+            with pytest.raises(Stop):
+                await collect_stream_async(stream, on_delta)
+            # avant la fermeture de la session, qui couperait toutes ses connexions
+            return await asyncio.to_thread(wait_idle, emulator)
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()), "slot toujours occupé après l'arrêt du flux"
+
+
+def test_sync_hedge_loser_frees_slot():
+    with LlamaEmulator(EmulatorConfig(slots=2, gen_tps=10)) as emulator:
+        # premier envoi interminable, le doublon répond tout de suite
+        emulator.script("longue histoire", LONG_REPLY, times=1)
+        emulator.script("longue histoire", "Il était une fois.")
+        client = LlamaClient(url=emulator.url, policies={"story": CallPolicy(hedge=True, hedge_min_delay=0.2)})
+        for _ in range(client.latencies.min_samples):
+            client.latencies.record("story", 0.1)
+        try:
+            data = client.post_chat(payload(), call_site="story")
+        finally:
+            client.close()
+
+        assert data["choices"][0]["message"]["content"] == "Il était une fois."
+        assert client.hedge_stats.won == 1
+        assert wait_idle(emulator), "le perdant occupe toujours son slot"
@@ -0,0 +1,78 @@
+"""
+Cascade petit modèle -> modèle principal : escalade sur une réponse
+tronquée (finish_reason "length") ou conforme au schéma mais inexploitable.
+"""
+
+from agent import SMALL_MODEL_NAME, LlmCall, ModelSpec, MultiSkillAgent, Skill, escalating, small_model_cascade
+from llama_client import LlamaClient, extract_finish_reason
+from llama_client.emulator import (
+    ROUTING_PROMPT,
+    SWITCH_PROMPT,
+    EmulatorConfig,
+    LlamaEmulator,
+    intent_json,
+    switch_json,
+)
+
+
+def skills():
+    return [Skill("weather", "la météo", [], ""), Skill("smalltalk", "discussion", [], "")]
+
+
+def emulator() -> LlamaEmulator:
+    return LlamaEmulator(EmulatorConfig(time_scale=0.0))
+
+
+def cascade_agent(small: LlamaEmulator, main: LlamaEmulator) -> MultiSkillAgent:
+    return MultiSkillAgent(
+        skills(),
+        model=ModelSpec("main", main.url),
+        models=small_model_cascade(ModelSpec(SMALL_MODEL_NAME, small.url)),
+    )
+
+
+def test_stop_at_json_keeps_truncation():
+    with emulator() as server:
+        server.script(ROUTING_PROMPT, intent_json("weather " + "encore " * 20))
+        client = LlamaClient(url=server.url)
+        try:
+            payload = {"messages": [{"role": "system", "content": "routeur de requêtes"}], "max_tokens": 5}
+            assert extract_finish_reason(client.post_chat(payload, stop_at_json=True)) == "length"
+            payload["max_tokens"] = 100
+            assert extract_finish_reason(client.post_chat(payload, stop_at_json=True)) == "stop"
+        finally:
+            client.close()
+
+
+def test_truncated_answer_is_escalated():
+    with emulator() as small, emulator() as main:
+        # intent valide pour le schéma, mais trop long pour max_tokens
+        small.script(ROUTING_PROMPT, intent_json("weather " + "encore " * 200))
+        main.script(ROUTING_PROMPT, intent_json("weather"))
+        agent = cascade_agent(small, main)
+
+        assert agent.classify_intent("quel temps demain ?") == "weather"
+        assert small.stats.requests == 1 and main.stats.requests == 1
+
+
+def test_unknown_switch_target_is_escalated():
+    with emulator() as small, emulator() as main:
+        # conforme au schéma, mais sans skill vers lequel changer
+        small.script(SWITCH_PROMPT, switch_json("switch", None))
+        main.script(SWITCH_PROMPT, switch_json("switch", "smalltalk"))
+        agent = cascade_agent(small, main)
+        agent.current_skill_name = "weather"
+        agent.awaiting_slot_answer = True
+
+        assert agent.smart_switch_decision("au fait, ça va ?") == ("switch", "smalltalk")
+        assert main.stats.requests == 1
+
+
+def test_truncation_escalates_even_if_accepted():
+    call = LlmCall(system_prompt="", escalation=ModelSpec("main"))
+    steps = escalating(call, lambda raw: True)
+    assert next(steps) is call
+    call.finish_reason = "length"
+    retry = steps.send('{"intent": "weather"}')
+    assert retry.model == ModelSpec("main") and retry.escalation is None
+    assert retry.finish_reason is None
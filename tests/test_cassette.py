@@ -0,0 +1,79 @@
+"""
+Cassette : trafic enregistré contre l'émulateur puis rejoué sans réseau.
+"""
+
+import asyncio
+
+import pytest
+
+from llama_client import Cassette, CassetteMiss, CircuitBreaker, LlamaClient, extract_content
+from llama_client.aio import AsyncLlamaClient
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+# aucun serveur n'écoute ici : en replay, toute requête réseau échouerait
+NOWHERE = "http://127.0.0.1:9/v1/chat/completions"
+
+
+def payload(text: str, temperature: float = 0.7) -> dict:
+    return {"messages": [{"role": "user", "content": text}], "temperature": temperature, "max_tokens": 64}
+
+
+def record(path) -> tuple:
+    with LlamaEmulator(EmulatorConfig(time_scale=0.0)) as emulator:
+        emulator.script("Bonjour", "Salut, comment vas-tu ?")
+        emulator.script("Raconte", "Il était une fois un modèle de langage.")
+        cassette = Cassette(path, mode="record")
+        client = LlamaClient(url=emulator.url, cassette=cassette)
+        try:
+            answer = extract_content(client.post_chat(payload("Bonjour")))
+            story = "".join(client.stream_chat(payload("Raconte")))
+        finally:
+            client.close()
+            cassette.close()
+        assert emulator.stats.requests == 2
+    assert cassette.stats.recorded == 2
+    return answer, story
+
+
+@pytest.mark.parametrize("name", ["traffic.jsonl", "traffic.jsonl.gz"])
+def test_record_then_replay(tmp_path, name):
+    path = tmp_path / name
+    answer, story = record(path)
+
+    cassette = Cassette(path)
+    client = LlamaClient(url=NOWHERE, cassette=cassette)
+    try:
+        # max_tokens ne fait pas partie de la clé (échéance de tour)
+        assert extract_content(client.post_chat({**payload("Bonjour"), "max_tokens": 8})) == answer
+        assert "".join(client.stream_chat(payload("Raconte"))) == story
+    finally:
+        client.close()
+    assert (cassette.stats.replayed, cassette.stats.missed) == (2, 0)
+
+
+def test_async_replay(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    answer, _ = record(path)
+
+    async def main():
+        client = AsyncLlamaClient(url=NOWHERE, cassette=Cassette(path))
+        try:
+            return extract_content(await client.post_chat(payload("Bonjour")))
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == answer
+
+
+def test_replay_miss_is_not_a_server_failure(tmp_path):
+    path = tmp_path / "traffic.jsonl"
+    record(path)
+
+    client = LlamaClient(url=NOWHERE, cassette=Cassette(path), breaker=CircuitBreaker(failure_threshold=1))
+    try:
+        for _ in range(2):
+            with pytest.raises(CassetteMiss):
+                client.post_chat(payload("Prompt modifié depuis l'enregistrement"))
+    finally:
+        client.close()
+    assert client.breaker.state == "closed"
@@ -0,0 +1,70 @@
+"""
+Deadline : max_tokens et timeouts ajustés au temps restant du tour.
+"""
+
+import pytest
+
+from llama_client import Deadline, DeadlineExceeded, LlamaClient, ResponseCache, Timeouts, deadline_scope
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+
+def payload(max_tokens: int = 512) -> dict:
+    return {"messages": [{"role": "user", "content": "Bonjour"}], "temperature": 0.0, "max_tokens": max_tokens}
+
+
+def test_fit_payload_caps_max_tokens():
+    deadline = Deadline(2.0, tokens_per_second=10.0)
+    fitted = deadline.fit_payload(payload(512))
+    assert 1 <= fitted["max_tokens"] <= 20
+    # payload d'origine intact, et inchangé quand il tient dans le temps restant
+    small = payload(5)
+    assert deadline.fit_payload(small) is small
+    assert payload(512)["max_tokens"] == 512
+
+
+def test_fit_payload_without_max_tokens():
+    fitted = Deadline(1.0, tokens_per_second=10.0).fit_payload({"messages": []})
+    assert 1 <= fitted["max_tokens"] <= 10
+
+
+def test_fit_timeouts():
+    fitted = Deadline(0.5).fit_timeouts(Timeouts(connect=3.0, read=60.0))
+    assert fitted.connect <= 0.5 and fitted.read <= 0.5
+    assert Deadline(100.0).fit_timeouts(Timeouts(connect=3.0, read=60.0)) == Timeouts(connect=3.0, read=60.0)
+
+
+def test_inner_scope_cannot_extend_outer():
+    outer = Deadline(1.0)
+    with deadline_scope(outer):
+        with deadline_scope(Deadline(60.0)) as inner:
+            assert inner is outer
+        shorter = Deadline(0.5)
+        with deadline_scope(shorter) as inner:
+            assert inner is shorter
+
+
+def test_client_sends_fitted_payload_and_does_not_cache_it():
+    sent = []
+
+    def reply(body):
+        sent.append(body.get("max_tokens"))
+        return "Bonjour !"
+
+    with LlamaEmulator(EmulatorConfig(time_scale=0.0)) as emulator:
+        emulator.script("Bonjour", reply)
+        client = LlamaClient(url=emulator.url, cache=ResponseCache())
+        try:
+            with deadline_scope(Deadline(2.0, tokens_per_second=10.0)):
+                client.post_chat(payload(512), use_cache=True)
+            # réponse tronquée par l'échéance : pas servie pour l'appel complet
+            client.post_chat(payload(512), use_cache=True)
+            client.post_chat(payload(512), use_cache=True)
+
+            with deadline_scope(Deadline(0.0)):
+                with pytest.raises(DeadlineExceeded):
+                    client.post_chat(payload(512))
+        finally:
+            client.close()
+
+    assert sent[0] <= 20
+    assert sent[1:] == [512]
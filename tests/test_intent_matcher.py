@@ -0,0 +1,38 @@
+"""
+IntentMatcher : routage local par keywords / patterns des skills.
+"""
+
+import re
+
+import pytest
+
+from agent import IntentMatcher, Skill
+
+
+def skill(name: str, keywords=(), patterns=()) -> Skill:
+    return Skill(name, name, [], "", keywords=list(keywords), patterns=list(patterns))
+
+
+def test_greedy_pattern_does_not_hide_other_skills():
+    matcher = IntentMatcher([
+        skill("file_reader", patterns=[r"\blis\b.*\bfichier\b"]),
+        skill("weather", keywords=["météo"]),
+    ])
+    assert matcher.candidates("lis la météo dans le fichier") == ["file_reader", "weather"]
+    assert matcher.match("lis la météo dans le fichier") is None
+    assert matcher.match("la météo à Paris") == "weather"
+    assert matcher.stats.snapshot()["ambiguous"] == 1
+
+
+def test_patterns_keep_their_own_syntax_and_flags():
+    matcher = IntentMatcher([
+        skill("booking", patterns=[r"(?i)\breserv", r"(?P<what>table)"]),
+        skill("music", patterns=[r"(?P<what>chanson)", re.compile(r"jou \s e  # jouer", re.VERBOSE)]),
+    ])
+    assert matcher.match("Réserve une table") == "booking"
+    assert matcher.match("joue une chanson") == "music"
+
+
+def test_invalid_pattern_names_its_skill():
+    with pytest.raises(ValueError, match="music"):
+        IntentMatcher([skill("music", patterns=["(chanson"])])
@@ -0,0 +1,40 @@
+"""
+Historique de la conversation (ConversationMemory) tenu par l'agent.
+"""
+
+import asyncio
+
+from agent import AsyncMultiSkillAgent, ModelSpec, MultiSkillAgent, Skill
+from llama_client.aio import get_async_client_for
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+
+def skills():
+    return [Skill("smalltalk", "discussion", [], "Tu discutes.", keywords=["bonjour"])]
+
+
+def test_reset_turn_is_not_remembered():
+    with LlamaEmulator(EmulatorConfig(time_scale=0.0)) as emulator:
+        agent = MultiSkillAgent(skills(), model=ModelSpec("main", emulator.url), history_tokens=1024)
+        agent.handle_user_message("bonjour")
+        assert len(agent.memory.messages()) == 2
+
+        agent.handle_user_message("reset")
+        assert agent.memory.messages() == []
+
+        agent.handle_user_message("bonjour encore")
+        assert [m["content"] for m in agent.memory.messages() if m["role"] == "user"] == ["bonjour encore"]
+
+
+def test_async_reset_turn_is_not_remembered():
+    async def main():
+        agent = AsyncMultiSkillAgent(skills(), model=ModelSpec("main", emulator.url), history_tokens=1024)
+        try:
+            await agent.handle_user_message("bonjour")
+            await agent.handle_user_message("Annule")
+        finally:
+            await get_async_client_for(emulator.url).close()
+        return agent.memory.messages()
+
+    with LlamaEmulator(EmulatorConfig(time_scale=0.0)) as emulator:
+        assert asyncio.run(main()) == []
@@ -0,0 +1,44 @@
+"""
+Prompts de routage mémorisés par l'agent, partagés entre threads
+(warm_up en arrière-plan pendant les premiers tours).
+"""
+
+import itertools
+import random
+import sys
+import threading
+
+from agent import MAX_CACHED_PROMPTS, MultiSkillAgent, Skill
+
+
+def test_prompt_cache_is_thread_safe():
+    skills = [Skill(f"skill{i}", f"description {i}", [], "") for i in range(10)]
+    agent = MultiSkillAgent(skills)
+    # toutes les listes de 3 skills : plus que MAX_CACHED_PROMPTS, pour forcer les évictions
+    shortlists = [list(names) for names in itertools.combinations(agent.skills, 3)]
+    assert len(shortlists) > MAX_CACHED_PROMPTS
+    errors = []
+
+    def hammer(seed):
+        rng = random.Random(seed)
+        try:
+            for _ in range(5000):
+                names = rng.choice(shortlists)
+                prompt = agent._routing_prompt(names)
+                assert all(f'"{name}"' in prompt for name in names)
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=hammer, args=(seed,)) for seed in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert len(agent._prompts) <= MAX_CACHED_PROMPTS
@@ -0,0 +1,162 @@
+"""
+Circuit breaker et retries face aux réponses anormales de llama-server,
+avec un faux serveur qui rejoue une liste de réponses HTTP.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llama_client import (
+    BackendPool,
+    CallPolicy,
+    CircuitBreaker,
+    CircuitOpenError,
+    LlamaClient,
+    LlamaRequestError,
+    RetryBudget,
+)
+from llama_client.aio import AsyncLlamaClient
+
+OK = (200, "application/json", json.dumps({"choices": [{"message": {"content": "ok"}}]}))
+HTML = (200, "text/html", "<html><body>502 Bad Gateway</body></html>")
+ERROR = (500, "application/json", json.dumps({"error": "boom"}))
+
+
+class StubServer:
+    """
+    Répond aux POST avec les réponses de `replies` dans l'ordre (la dernière
+    ensuite), après `delay` secondes.
+    """
+
+    def __init__(self, replies, delay: float = 0.0):
+        self.replies = list(replies)
+        self.delay = delay
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                status, content_type, body = stub.replies[min(stub.requests, len(stub.replies)) - 1]
+                time.sleep(stub.delay)
+                data = body.encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # client parti
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = "http://127.0.0.1:%d/v1/chat/completions" % self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def payload() -> dict:
+    return {"messages": [{"role": "user", "content": "Bonjour"}], "temperature": 0.7}
+
+
+def test_unreadable_body_does_not_wedge_breaker():
+    server = StubServer([ERROR, HTML, OK])
+    client = LlamaClient(url=server.url, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.0))
+    try:
+        with pytest.raises(RuntimeError):
+            client.post_chat(payload())
+        assert client.breaker.state == "open"
+        # essai semi-ouvert : corps HTML illisible, compté comme un échec du serveur
+        with pytest.raises(RuntimeError) as excinfo:
+            client.post_chat(payload())
+        assert not isinstance(excinfo.value, CircuitOpenError)
+        assert client.post_chat(payload())["choices"][0]["message"]["content"] == "ok"
+        assert client.breaker.state == "closed"
+    finally:
+        client.close()
+        server.close()
+
+
+def test_async_cancelled_trial_releases_breaker():
+    server = StubServer([ERROR, OK], delay=0.3)
+
+    async def main():
+        client = AsyncLlamaClient(url=server.url, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.0))
+        try:
+            with pytest.raises(RuntimeError):
+                await client.post_chat(payload())
+            # essai semi-ouvert abandonné par l'appelant
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.post_chat(payload()), timeout=0.1)
+            data = await client.post_chat(payload())
+            return data["choices"][0]["message"]["content"], client.breaker.state
+        finally:
+            await client.close()
+
+    try:
+        assert asyncio.run(main()) == ("ok", "closed")
+    finally:
+        server.close()
+
+
+BAD_REQUEST = (400, "application/json", json.dumps({"error": {"message": "json_schema invalide"}}))
+
+
+def test_rejected_request_is_not_retried_nor_counted():
+    server = StubServer([BAD_REQUEST])
+    pool = BackendPool([server.url.rsplit("/v1/", 1)[0]], max_failures=1)
+    client = LlamaClient(
+        backends=pool,
+        policies={"routing": CallPolicy(max_retries=2, retry_backoff=0.0)},
+        breaker=CircuitBreaker(failure_threshold=2),
+        retry_budget=RetryBudget(min_tokens=10),
+    )
+    try:
+        for _ in range(3):
+            with pytest.raises(LlamaRequestError) as excinfo:
+                client.post_chat(payload(), call_site="routing")
+            assert excinfo.value.status == 400
+    finally:
+        client.close()
+        server.close()
+
+    assert server.requests == 3
+    assert client.breaker.state == "closed"
+    assert pool.backends[0].healthy and pool.backends[0].consecutive_failures == 0
+
+
+def test_async_rejected_request_is_not_retried():
+    server = StubServer([BAD_REQUEST])
+
+    async def main():
+        client = AsyncLlamaClient(
+            url=server.url,
+            policies={"routing": CallPolicy(max_retries=2, retry_backoff=0.0)},
+            breaker=CircuitBreaker(failure_threshold=2),
+        )
+        try:
+            for _ in range(3):
+                with pytest.raises(LlamaRequestError):
+                    await client.post_chat(payload(), call_site="routing")
+            return client.breaker.state
+        finally:
+            await client.close()
+
+    try:
+        assert asyncio.run(main()) == "closed"
+    finally:
+        server.close()
+    assert server.requests == 3
@@ -0,0 +1,112 @@
+"""
+Scheduler : BusyError quand la file est pleine, ordre de priorité.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llama_client import AsyncScheduler, BusyError, PriorityClass, Scheduler
+
+FAST = PriorityClass("interactive", priority=0, max_concurrency=1, max_queue=1, max_wait=5.0)
+SLOW = PriorityClass("background", priority=1, max_concurrency=1, max_queue=8)
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "condition jamais remplie"
+        time.sleep(0.005)
+
+
+def queued(scheduler, priority: str) -> int:
+    return scheduler.snapshot()[priority]["queued"]
+
+
+def test_full_queue_raises_busy():
+    scheduler = Scheduler([FAST, SLOW], capacity=1)
+    release = threading.Event()
+    threads = [
+        threading.Thread(target=scheduler.submit, args=(release.wait,)),  # en cours
+        threading.Thread(target=scheduler.submit, args=(lambda: None,)),  # en file
+    ]
+    threads[0].start()
+    wait_until(lambda: scheduler.running == 1)
+    threads[1].start()
+    wait_until(lambda: queued(scheduler, "interactive") == 1)
+
+    with pytest.raises(BusyError):
+        scheduler.submit(lambda: None)
+    assert scheduler.snapshot()["interactive"]["rejected"] == 1
+
+    release.set()
+    for t in threads:
+        t.join()
+    assert scheduler.snapshot()["interactive"]["completed"] == 2
+
+
+def test_max_wait_raises_busy():
+    impatient = PriorityClass("interactive", priority=0, max_concurrency=1, max_queue=4, max_wait=0.05)
+    scheduler = Scheduler([impatient], capacity=1)
+    release = threading.Event()
+    running = threading.Thread(target=scheduler.submit, args=(release.wait,))
+    running.start()
+    wait_until(lambda: scheduler.running == 1)
+    try:
+        with pytest.raises(BusyError):
+            scheduler.submit(lambda: None)
+        assert queued(scheduler, "interactive") == 0
+    finally:
+        release.set()
+        running.join()
+
+
+def test_interactive_calls_go_first():
+    scheduler = Scheduler([FAST, SLOW], capacity=1)
+    release = threading.Event()
+    order = []
+    blocker = threading.Thread(target=scheduler.submit, args=(release.wait, "background"))
+    blocker.start()
+    wait_until(lambda: scheduler.running == 1)
+
+    threads = []
+    for name, priority in [("b1", "background"), ("b2", "background"), ("i1", "interactive")]:
+        t = threading.Thread(target=scheduler.submit, args=(lambda name=name: order.append(name), priority))
+        t.start()
+        threads.append(t)
+        n = len(threads)
+        wait_until(lambda: queued(scheduler, "background") + queued(scheduler, "interactive") == n)
+
+    release.set()
+    for t in [blocker, *threads]:
+        t.join()
+    # arrivé en dernier, l'appel interactif passe devant ; les autres dans l'ordre d'arrivée
+    assert order == ["i1", "b1", "b2"]
+
+
+def test_async_priority_and_busy():
+    async def main():
+        scheduler = AsyncScheduler([FAST, SLOW], capacity=1)
+        release = asyncio.Event()
+        order = []
+
+        async def record(name):
+            order.append(name)
+
+        blocker = asyncio.create_task(scheduler.submit(release.wait, "background"))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(scheduler.submit(lambda: record("b1"), "background"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(scheduler.submit(lambda: record("i1"), "interactive")))
+        await asyncio.sleep(0)
+
+        with pytest.raises(BusyError):
+            await scheduler.submit(lambda: record("rejected"))
+
+        release.set()
+        await asyncio.gather(blocker, *tasks)
+        return order
+
+    assert asyncio.run(main()) == ["i1", "b1"]
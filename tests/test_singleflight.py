@@ -0,0 +1,56 @@
+"""
+AsyncSingleFlight : annulation du leader et des suiveurs.
+"""
+
+import asyncio
+
+from llama_client import AsyncSingleFlight
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return "ok"
+
+        leader = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("k", fn))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, leader.cancelled(), calls, flight
+
+    result, leader_cancelled, calls, flight = asyncio.run(main())
+    assert result == "ok"
+    assert leader_cancelled
+    assert len(calls) == 1
+    assert flight.stats.snapshot() == {"leaders": 1, "coalesced": 1}
+
+
+def test_upstream_cancelled_when_nobody_waits():
+    async def main():
+        flight = AsyncSingleFlight()
+        upstream = []
+
+        async def fn():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                upstream.append("cancelled")
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("k", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return upstream, flight
+
+    upstream, flight = asyncio.run(main())
+    assert upstream == ["cancelled"]
+    assert not flight._calls
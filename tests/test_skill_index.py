@@ -0,0 +1,38 @@
+"""
+SkillIndex partagé par plusieurs agents (un par session).
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from agent import MultiSkillAgent, Skill, SkillIndex
+from llama_client import LlamaClient
+from llama_client.embeddings import Embedder
+from llama_client.emulator import LlamaEmulator
+
+
+def skills():
+    return [Skill(f"skill{i}", f"description {i}", [], "", examples=[f"exemple {i}"]) for i in range(4)]
+
+
+def test_index_is_built_once_for_all_sessions():
+    with LlamaEmulator() as emulator:
+        client = LlamaClient(url=emulator.url)
+        embedder = Embedder(client)
+        index = SkillIndex(embedder, top_k=2)
+        try:
+            MultiSkillAgent(skills(), skill_index=index)
+            first_index = index.index
+            assert first_index is not None
+            agents = [MultiSkillAgent(skills(), skill_index=index) for _ in range(3)]
+            assert all(agent.skill_index is index for agent in agents)
+            assert index.index is first_index
+            # 4 skills x (description + 1 exemple)
+            assert embedder.misses == 8
+
+            # catalogue modifié : l'index est reconstruit
+            MultiSkillAgent([*skills(), Skill("other", "autre chose", [], "")], skill_index=index)
+            assert index.index is not first_index
+        finally:
+            client.close()
@@ -0,0 +1,123 @@
+"""
+SlotAffinity : sauvegardes à l'éviction seulement, slots de plusieurs
+backends, slots partagés par les conversations de l'agent.
+"""
+
+from llama_client import (
+    BACKEND_URL,
+    BackendPool,
+    LlamaClient,
+    SlotAffinity,
+    get_default_client,
+    set_default_client,
+)
+from llama_client.emulator import ROUTING_PROMPT, EmulatorConfig, LlamaEmulator, intent_json
+
+
+def record_actions(client: LlamaClient) -> list:
+    """
+    (action, base_url, fichier) de chaque appel à client.slot_action.
+    """
+    actions = []
+    slot_action = client.slot_action
+
+    def recorded(id_slot, action, filename=None, base_url=None):
+        actions.append((action, base_url, filename))
+        return slot_action(id_slot, action, filename, base_url=base_url)
+
+    client.slot_action = recorded
+    return actions
+
+
+def test_saves_only_on_eviction(tmp_path):
+    with LlamaEmulator(EmulatorConfig(slots=2, slot_save_path=str(tmp_path))) as emulator:
+        client = LlamaClient(url=emulator.url)
+        actions = record_actions(client)
+        affinity = SlotAffinity(client, n_slots=2)
+        try:
+            # chaque clé a son slot : aucune sauvegarde
+            for _ in range(3):
+                for key in ("a", "b"):
+                    with affinity.pin(key):
+                        pass
+            assert actions == []
+
+            with affinity.pin("c"):  # évince "a"
+                pass
+            with affinity.pin("a"):  # évince "b", restaure "a"
+                pass
+        finally:
+            client.close()
+
+    file = affinity.filename
+    assert [(action, filename) for action, _, filename in actions] == [
+        ("save", file("a")),
+        ("save", file("b")),
+        ("restore", file("a")),
+    ]
+    assert (affinity.stats.saves, affinity.stats.restores) == (2, 1)
+
+
+def test_slots_follow_their_backend(tmp_path):
+    dirs = [tmp_path / "a", tmp_path / "b"]
+    for d in dirs:
+        d.mkdir()
+    emulators = [LlamaEmulator(EmulatorConfig(slots=1, slot_save_path=str(d))).start() for d in dirs]
+    try:
+        pool = BackendPool([e.base_url for e in emulators])
+        client = LlamaClient(backends=pool)
+        actions = record_actions(client)
+        affinity = SlotAffinity(client, n_slots=1)
+
+        routes = []
+        for key in ("a", "b", "c", "a"):
+            with affinity.pin(key) as slot:
+                id_slot, base_url = affinity.route(slot)
+                routes.append(base_url)
+                payload = {
+                    "messages": [{"role": "user", "content": key}],
+                    "temperature": 0.0,
+                    "id_slot": id_slot,
+                    BACKEND_URL: base_url,
+                }
+                client.post_chat(payload)
+        client.close()
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+
+    # chaque appel est parti vers le backend de son slot
+    assert routes[:2] == [e.base_url for e in emulators]
+    assert sum(e.stats.requests for e in emulators) == 4
+    # sauvegardes et restaurations envoyées au backend du slot
+    assert {base_url for _, base_url, _ in actions} == {e.base_url for e in emulators}
+    assert any(dirs[0].iterdir()) and any(dirs[1].iterdir())
+
+
+def test_agent_warm_up_pins_shared_slots():
+    from agent import MultiSkillAgent, Skill
+
+    skills = [
+        Skill("smalltalk", "discuter", [], "Tu discutes avec l'utilisateur."),
+        Skill("jokes", "raconter une blague", [], "Tu racontes des blagues."),
+    ]
+    with LlamaEmulator(EmulatorConfig(slots=4, time_scale=0)) as emulator:
+        emulator.script(ROUTING_PROMPT, intent_json("smalltalk"))
+        client = LlamaClient(url=emulator.url)
+        previous = get_default_client()
+        set_default_client(client)
+        try:
+            affinity = SlotAffinity(client, n_slots=4)
+            assert MultiSkillAgent(skills, slot_affinity=affinity).warm_up() > 0
+            warmed = dict(affinity.snapshot()["resident"])
+            # deux conversations : les mêmes slots, préchauffés, resservent
+            for agent in (MultiSkillAgent(skills, slot_affinity=affinity) for _ in range(2)):
+                agent.handle_user_message("salut, ça va ?")
+        finally:
+            set_default_client(previous)
+            client.close()
+
+    snapshot = affinity.snapshot()
+    assert snapshot["resident"] == warmed
+    assert snapshot["hits"] >= 4
+    assert snapshot["assigned"] == len(warmed)
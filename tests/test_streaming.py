@@ -0,0 +1,103 @@
+"""
+JsonObjectScanner et stop_at_json : arrêt au premier objet JSON complet.
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from llama_client import JsonObjectScanner, LlamaClient, extract_content, first_json_object
+from llama_client.aio import AsyncLlamaClient
+from llama_client.emulator import EmulatorConfig, LlamaEmulator
+
+PROSE = " Voici pourquoi : " + "le message parle clairement de la météo. " * 40
+
+
+def feed_by_char(text: str) -> JsonObjectScanner:
+    scanner = JsonObjectScanner()
+    for ch in text:
+        if scanner.feed(ch):
+            break
+    return scanner
+
+
+def test_stops_at_first_object():
+    text = '{"intent": "weather"} {"intent": "booking"}'
+    scanner = feed_by_char(text)
+    assert scanner.done and scanner.value == {"intent": "weather"}
+    assert scanner.text == '{"intent": "weather"}'
+    assert scanner.end == len(scanner.text)
+
+
+def test_braces_in_strings_and_escaped_quotes():
+    obj = {"city": "Paris {centre}", "note": 'il a dit "}" puis \\ fin'}
+    scanner = feed_by_char("Réponse : " + json.dumps(obj) + " fin")
+    assert scanner.value == obj
+
+
+def test_balanced_prose_block_is_skipped():
+    text = 'Par exemple {pas du json}, la réponse est ```json\n{"intent": "smalltalk"}\n``` voilà'
+    assert first_json_object(text) == {"intent": "smalltalk"}
+
+
+def test_trailing_text_only_after_object():
+    scanner = JsonObjectScanner()
+    assert not scanner.feed('{"mode": "continue"')
+    assert scanner.trailing_text() == ""
+    assert scanner.feed("}")
+    assert scanner.trailing_text() == ""
+    scanner.feed("\n  ")
+    assert scanner.trailing_text() == ""
+    scanner.feed(" Explication")
+    assert scanner.trailing_text() == "Explication"
+
+
+def test_no_object():
+    assert first_json_object("pas de JSON ici { ni là") is None
+
+
+def wait_disconnected(emulator: LlamaEmulator, timeout: float = 2.0) -> bool:
+    end = time.monotonic() + timeout
+    while emulator.stats.disconnected == 0:
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def emulator():
+    with LlamaEmulator(EmulatorConfig(gen_tps=100)) as emulator:
+        emulator.script("routeur", '{"intent": "weather"}' + PROSE)
+        yield emulator
+
+
+def routing_payload() -> dict:
+    return {"messages": [{"role": "system", "content": "routeur"}], "temperature": 0.0, "max_tokens": 512}
+
+
+def test_stop_at_json_cuts_generation(emulator):
+    client = LlamaClient(url=emulator.url)
+    start = time.monotonic()
+    try:
+        data = client.post_chat(routing_payload(), stop_at_json=True)
+    finally:
+        client.close()
+    # la prose (plus de 200 tokens à 100 tokens/s) n'a pas été attendue
+    assert time.monotonic() - start < 1.0
+    assert extract_content(data) == '{"intent": "weather"}'
+    assert wait_disconnected(emulator), "génération pas interrompue côté serveur"
+
+
+def test_async_stop_at_json_cuts_generation(emulator):
+    async def main():
+        client = AsyncLlamaClient(url=emulator.url)
+        try:
+            return await client.post_chat(routing_payload(), stop_at_json=True)
+        finally:
+            await client.close()
+
+    assert extract_content(asyncio.run(main())) == '{"intent": "weather"}'
+    assert wait_disconnected(emulator), "génération pas interrompue côté serveur"
@@ -1,20 +1,87 @@
 
 from __future__ import annotations
 
+import asyncio
+import inspect
 import json
-from dataclasses import dataclass
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import nullcontext
+from dataclasses import dataclass, field, replace
 from enum import Enum, auto
-from typing import List, Dict, Optional, Callable, Any
-
-import requests
+from pathlib import Path
+from typing import List, Dict, Optional, Callable, Any, AsyncIterator, Generator, Iterator, TypeVar, Union, ContextManager, TYPE_CHECKING
+
+# Le client partagé (llama_client/) est à la racine du dépôt
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llama_client import (
+    BACKEND_URL,
+    CancelToken,
+    ConversationMemory,
+    SlotAffinity,
+    DEBUG,
+    INFO,
+    UsageLedger,
+    annotate,
+    budget_exhausted,
+    Deadline,
+    build_messages,
+    cancel_scope,
+    collect_stream,
+    collect_stream_async,
+    deadline_scope,
+    event,
+    extract_content,
+    extract_finish_reason,
+    extract_tool_call,
+    first_json_object,
+    get_client_for,
+    optional_step_allowed,
+    span,
+    usage_scope,
+)
+
+if TYPE_CHECKING:
+    # NumPy : seulement pour l'index de skills (voir SkillIndex)
+    import numpy as np
+    from llama_client.embeddings import Embedder, SemanticCache, VectorIndex
 
 
 # =========================
 # Client LLaMA générique
 # =========================
 
-LLAMA_SERVER_URL = "http://localhost:8080/v1/chat/completions"
 MODEL_NAME = "Ministral-3-3B-Instruct-2512-Q4_K_M"  # adapte selon ton modèle local
+SMALL_MODEL_NAME = "Qwen_Qwen3-0.6B-Q8_0"  # petit modèle rapide (celui d'exo2)
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    Modèle à utiliser pour un appel : nom envoyé à llama-server ("model") et
+    URL du llama-server qui le sert (None = client partagé par défaut).
+    """
+    name: str
+    url: Optional[str] = None
+
+
+DEFAULT_MODEL = ModelSpec(MODEL_NAME)
+
+# Sites d'appel à sortie courte et structurée, confiables à un petit modèle
+CASCADE_CALL_SITES = ("classify_intent", "smart_switch", "analyze_user_message", "route_and_extract")
+
+
+def small_model_cascade(small: ModelSpec) -> Dict[str, ModelSpec]:
+    """
+    Configuration `models` de MultiSkillAgent : routage et extraction sur
+    `small`, réponses finales (et escalades) sur le modèle principal.
+    """
+    return {call_site: small for call_site in CASCADE_CALL_SITES}
 
 
 def send_llama_chat(
@@ -23,48 +90,414 @@ def send_llama_chat(
     history: Optional[List[Dict[str, str]]] = None,
     temperature: float = 0.0,
     max_tokens: int = 512,
+    cache: bool = False,
+    call_site: Optional[str] = None,
+    priority: str = "interactive",
+    model: Optional[ModelSpec] = None,
+    json_schema: Optional[Dict[str, Any]] = None,
+    stop_at_json: bool = False,
+    id_slot: Optional[int] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    backend_url: Optional[str] = None,
 ) -> str:
     """
     Client simple pour ton llama-server, style OpenAI.
+    Passe par le client partagé (connexions keep-alive réutilisées).
+    cache=True : réponse servie par le cache si le même appel déterministe
+    (temperature 0) a déjà été fait.
+    call_site : nom de l'appel ("classify_intent", "final_answer", ...) qui
+    choisit timeouts / retries / hedge (voir llama_client.DEFAULT_POLICIES).
+    priority : "interactive" ou "background" si un Scheduler est installé
+    sur le client (BusyError si le serveur est saturé).
+    model : modèle (et serveur) à utiliser, DEFAULT_MODEL par défaut.
+    json_schema : schéma JSON imposé à la sortie (décodage contraint par
+    llama-server, la réponse est toujours du JSON valide pour ce schéma).
+    stop_at_json : génération arrêtée dès que le premier objet JSON est complet.
+    id_slot : slot de llama-server à utiliser (voir SlotAffinity).
+    backend_url : backend de ce slot, quand le client répartit les appels sur
+    plusieurs llama-server (BackendPool).
+    tools : fonctions que le modèle doit appeler (format tools d'OpenAI,
+    llama-server lancé avec --jinja) ; retourne alors l'appel fait, en JSON
+    {"name": ..., "arguments": {...}}.
+    """
+    model = model or DEFAULT_MODEL
+    payload = _build_chat_payload(
+        user_content, system_prompt, history, temperature, max_tokens, model, json_schema, id_slot, tools,
+        backend_url,
+    )
+    data = get_client_for(model.url).post_chat(
+        payload, use_cache=cache, call_site=call_site, priority=priority, stop_at_json=stop_at_json
+    )
+    return _reply_text(data, tools)
+
+
+async def send_llama_chat_async(
+    user_content: str | None = None,
+    system_prompt: str = "You are a helpful assistant.",
+    history: Optional[List[Dict[str, str]]] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 512,
+    cache: bool = False,
+    call_site: Optional[str] = None,
+    priority: str = "interactive",
+    model: Optional[ModelSpec] = None,
+    json_schema: Optional[Dict[str, Any]] = None,
+    stop_at_json: bool = False,
+    id_slot: Optional[int] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    backend_url: Optional[str] = None,
+) -> str:
+    """
+    Version asyncio de send_llama_chat (client aiohttp partagé).
+    """
+    from llama_client.aio import get_async_client_for
+
+    model = model or DEFAULT_MODEL
+    payload = _build_chat_payload(
+        user_content, system_prompt, history, temperature, max_tokens, model, json_schema, id_slot, tools,
+        backend_url,
+    )
+    data = await get_async_client_for(model.url).post_chat(
+        payload, use_cache=cache, call_site=call_site, priority=priority, stop_at_json=stop_at_json
+    )
+    return _reply_text(data, tools)
+
+
+def stream_llama_chat(
+    user_content: str | None = None,
+    system_prompt: str = "You are a helpful assistant.",
+    history: Optional[List[Dict[str, str]]] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 512,
+    call_site: Optional[str] = None,
+    model: Optional[ModelSpec] = None,
+    json_schema: Optional[Dict[str, Any]] = None,
+    id_slot: Optional[int] = None,
+    backend_url: Optional[str] = None,
+) -> Iterator[str]:
     """
-    if history is None:
-        history = []
-
-    if user_content is None:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            *history,
-        ]
-    else:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            *history,
-            {"role": "user", "content": user_content},
-        ]
-
-    print("Messages envoyés au modèle:")
-    for msg in messages:
-        print(f"{msg['role'].upper()}: {msg['content']}")
+    Comme send_llama_chat, mais en streaming (SSE) : générateur des morceaux
+    de texte dès leur génération. collect_stream() reconstruit le texte complet.
+    """
+    model = model or DEFAULT_MODEL
+    payload = _build_chat_payload(
+        user_content, system_prompt, history, temperature, max_tokens, model, json_schema, id_slot,
+        backend_url=backend_url,
+    )
+    return get_client_for(model.url).stream_chat(payload, call_site=call_site)
+
 
+def stream_llama_chat_async(
+    user_content: str | None = None,
+    system_prompt: str = "You are a helpful assistant.",
+    history: Optional[List[Dict[str, str]]] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 512,
+    call_site: Optional[str] = None,
+    model: Optional[ModelSpec] = None,
+    json_schema: Optional[Dict[str, Any]] = None,
+    id_slot: Optional[int] = None,
+    backend_url: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Version asyncio de stream_llama_chat (itérateur asynchrone).
+    """
+    from llama_client.aio import get_async_client_for
+
+    model = model or DEFAULT_MODEL
+    payload = _build_chat_payload(
+        user_content, system_prompt, history, temperature, max_tokens, model, json_schema, id_slot,
+        backend_url=backend_url,
+    )
+    return get_async_client_for(model.url).stream_chat(payload, call_site=call_site)
+
+
+def _build_chat_payload(
+    user_content: str | None,
+    system_prompt: str,
+    history: Optional[List[Dict[str, str]]],
+    temperature: float,
+    max_tokens: int,
+    model: ModelSpec,
+    json_schema: Optional[Dict[str, Any]] = None,
+    id_slot: Optional[int] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    backend_url: Optional[str] = None,
+) -> Dict[str, Any]:
+    messages = build_messages(user_content, system_prompt, history)
+    event("prompt", messages=messages)
     payload = {
-        "model": MODEL_NAME,
+        "model": model.name,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
+        # garder le prompt dans le cache KV du slot : le préfixe commun avec
+        # l'appel suivant (prompt système fixe) ne sera pas retraité
+        "cache_prompt": True,
     }
+    if json_schema is not None:
+        # llama-server le convertit en grammaire GBNF : sortie toujours conforme
+        payload["json_schema"] = json_schema
+    if id_slot is not None:
+        payload["id_slot"] = id_slot
+    if backend_url is not None:
+        payload[BACKEND_URL] = backend_url
+    if tools is not None:
+        payload["tools"] = tools
+        payload["tool_choice"] = "required"
+    return payload
+
+
+def _reply_text(data: Dict[str, Any], tools: Optional[List[Dict[str, Any]]]) -> str:
+    if tools is not None:
+        tool_call = extract_tool_call(data)
+        if tool_call is not None:
+            # même forme que les autres réponses : du texte, ici le JSON de l'appel
+            return json.dumps(tool_call, ensure_ascii=False)
+    return extract_content(data)
+
+
+# =========================
+# Étapes LLM (même logique en sync et en async)
+# =========================
+
+T = TypeVar("T")
+
 
+@dataclass
+class LlmCall:
+    """
+    Appel LLM demandé par la logique de dialogue.
+
+    Les méthodes `_..._steps()` sont des générateurs qui `yield` ces appels :
+    un driver (run_steps / run_steps_async) les exécute et renvoie la réponse.
+    Si on_token est défini, l'appel est fait en streaming et on_token reçoit
+    chaque morceau de texte dès sa génération.
+    cache=True autorise le cache de réponses (appels déterministes seulement).
+    call_site identifie l'appel (politique de timeouts / retries côté client).
+    priority : classe de priorité du scheduler (les appels streamés n'y passent pas).
+    skill : skill auquel imputer les tokens consommés (comptes d'usage).
+    model : modèle de l'appel (None = DEFAULT_MODEL) ; escalation : modèle plus
+    gros à réessayer si la réponse est inexploitable (voir escalating()).
+    json_schema : schéma imposé à la sortie (décodage contraint).
+    stop_at_json : seul le premier objet JSON de la réponse est utile, la
+    génération est arrêtée dès qu'il est complet (appels non streamés).
+    affinity / slot_key : slot de llama-server épinglé pour cet appel.
+    history : messages précédents de la conversation (voir ConversationMemory).
+    tools : fonctions proposées au modèle (appels non streamés), la réponse
+    est alors l'appel de fonction en JSON (voir send_llama_chat).
+    finish_reason : rempli par run() / run_async() pour les appels non
+    streamés ("length" : réponse tronquée par max_tokens).
+    """
+    system_prompt: str
+    user_content: Optional[str] = None
+    temperature: float = 0.0
+    max_tokens: int = 512
+    on_token: Optional[Callable[[str], None]] = None
+    cache: bool = False
+    call_site: Optional[str] = None
+    priority: str = "interactive"
+    skill: Optional[str] = None
+    model: Optional[ModelSpec] = None
+    escalation: Optional[ModelSpec] = None
+    json_schema: Optional[Dict[str, Any]] = None
+    stop_at_json: bool = False
+    affinity: Optional[SlotAffinity] = None
+    slot_key: Optional[str] = None
+    history: Optional[List[Dict[str, str]]] = None
+    tools: Optional[List[Dict[str, Any]]] = None
+    finish_reason: Optional[str] = field(default=None, init=False, repr=False)
+
+    def _chat_kwargs(self, slot: Optional[int]) -> Dict[str, Any]:
+        id_slot, backend_url = self.affinity.route(slot) if slot is not None else (None, None)
+        return {
+            "system_prompt": self.system_prompt,
+            "user_content": self.user_content,
+            "history": self.history,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "call_site": self.call_site,
+            "model": self.model,
+            "json_schema": self.json_schema,
+            "id_slot": id_slot,
+            "backend_url": backend_url,
+        }
+
+    def _payload(self, slot: Optional[int]) -> Dict[str, Any]:
+        """
+        Payload d'un appel non streamé (même contenu que send_llama_chat), fait
+        ici pour garder la réponse complète et son finish_reason.
+        """
+        kwargs = self._chat_kwargs(slot)
+        return _build_chat_payload(
+            kwargs["user_content"], kwargs["system_prompt"], kwargs["history"], kwargs["temperature"],
+            kwargs["max_tokens"], kwargs["model"] or DEFAULT_MODEL, kwargs["json_schema"], kwargs["id_slot"],
+            self.tools, kwargs["backend_url"],
+        )
+
+    def _answer(self, data: Dict[str, Any]) -> str:
+        self.finish_reason = extract_finish_reason(data)
+        if self.finish_reason == "length":
+            annotate(truncated=True)
+        return _reply_text(data, self.tools)
+
+    def _span(self):
+        return span(
+            f"llm.{self.call_site or 'chat'}",
+            skill=self.skill,
+            stream=self.on_token is not None,
+            model=(self.model or DEFAULT_MODEL).name,
+        )
+
+    def _pinned_slot(self):
+        if self.affinity is None or self.slot_key is None:
+            return nullcontext()
+        return self.affinity.pin(self.slot_key)
+
+    def _pinned_slot_async(self):
+        if self.affinity is None or self.slot_key is None:
+            return nullcontext()
+        return self.affinity.pin_async(self.slot_key)
+
+    def run(self) -> str:
+        with usage_scope(skill=self.skill), self._span(), self._pinned_slot() as slot:
+            if self.on_token is not None:
+                answer = collect_stream(stream_llama_chat(**self._chat_kwargs(slot)), self.on_token)
+            else:
+                model = self.model or DEFAULT_MODEL
+                data = get_client_for(model.url).post_chat(
+                    self._payload(slot), use_cache=self.cache, call_site=self.call_site,
+                    priority=self.priority, stop_at_json=self.stop_at_json,
+                )
+                answer = self._answer(data)
+            event("raw_output", text=answer)
+            return answer
+
+    async def run_async(self) -> str:
+        with usage_scope(skill=self.skill), self._span():
+            async with self._pinned_slot_async() as slot:
+                if self.on_token is not None:
+                    answer = await collect_stream_async(
+                        stream_llama_chat_async(**self._chat_kwargs(slot)), self.on_token
+                    )
+                else:
+                    from llama_client.aio import get_async_client_for
+
+                    model = self.model or DEFAULT_MODEL
+                    data = await get_async_client_for(model.url).post_chat(
+                        self._payload(slot), use_cache=self.cache, call_site=self.call_site,
+                        priority=self.priority, stop_at_json=self.stop_at_json,
+                    )
+                    answer = self._answer(data)
+            event("raw_output", text=answer)
+            return answer
+
+
+@dataclass
+class HandlerCall:
+    """
+    Appel du handler on_ready d'un skill.
+    En async, le handler peut aussi être une coroutine.
+    """
+    handler: Callable[[Dict[str, str]], Any]
+    values: Dict[str, str]
+
+    def run(self) -> Any:
+        with span("handler", handler=getattr(self.handler, "__name__", "?")):
+            return self.handler(self.values)
+
+    async def run_async(self) -> Any:
+        with span("handler", handler=getattr(self.handler, "__name__", "?")):
+            result = self.handler(self.values)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+
+@dataclass
+class EmbedCall:
+    """
+    Vecteur d'embedding d'un texte (requête HTTP bloquante : dans un thread en async).
+    """
+    embedder: "Embedder"
+    text: str
+
+    def run(self) -> "np.ndarray":
+        with span("embedding"):
+            return self.embedder.embed_one(self.text)
+
+    async def run_async(self) -> "np.ndarray":
+        with span("embedding"):
+            return await asyncio.to_thread(self.embedder.embed_one, self.text)
+
+
+Step = Union[LlmCall, HandlerCall, EmbedCall]
+Steps = Generator[Step, Any, T]
+Prepare = Callable[[Step], Step]
+
+
+def escalating(call: LlmCall, accept: Callable[[str], bool]) -> Steps[str]:
+    """
+    Fait l'appel ; si la réponse a été tronquée par max_tokens
+    (finish_reason "length") ou si `accept` la rejette, et qu'un modèle
+    d'escalade est prévu pour ce site d'appel (rempli par l'agent), refait le
+    même appel avec ce modèle plus gros.
+    Avec un json_schema, la grammaire garantit un JSON conforme : l'escalade
+    ne couvre alors que ces deux cas (troncature, réponse conforme mais
+    inexploitable comme un skill inconnu), pas une mauvaise compréhension
+    du message qui produirait une réponse plausible.
+    Escalade optionnelle : sautée s'il ne reste pas assez de temps ou de budget.
+    """
+    raw = yield call
+    if call.escalation is None or not optional_llm_step_allowed():
+        return raw
+    truncated = call.finish_reason == "length"
+    if not truncated and accept(raw):
+        return raw
+    annotate(escalated=call.escalation.name, escalation_reason="length" if truncated else "rejected")
+    # autre modèle, peut-être autre serveur : le slot est rechoisi par l'agent
+    return (yield replace(call, model=call.escalation, escalation=None, affinity=None, slot_key=None))
+
+
+def run_steps(steps: Steps[T], prepare: Optional[Prepare] = None) -> T:
+    """
+    Driver synchrone : exécute chaque étape et renvoie son résultat au générateur.
+    Une exception est relancée DANS le générateur (qui peut la rattraper).
+    prepare : appliqué à chaque étape avant exécution (réglages de l'agent
+    comme la priorité, qui concernent aussi les appels de GenericDialog).
+    """
     try:
-        response = requests.post(LLAMA_SERVER_URL, json=payload, timeout=60)
-        response.raise_for_status()
-    except requests.RequestException as e:
-        raise RuntimeError(f"Erreur lors de l'appel à llama-server: {e}") from e
+        step = next(steps)
+        while True:
+            if prepare is not None:
+                step = prepare(step)
+            try:
+                result = step.run()
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
 
-    data = response.json()
 
+async def run_steps_async(steps: Steps[T], prepare: Optional[Prepare] = None) -> T:
+    """
+    Driver asyncio : même chose que run_steps, en attendant chaque étape.
+    """
     try:
-        return data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError) as e:
-        raise RuntimeError(f"Format de réponse inattendu: {data}") from e
+        step = next(steps)
+        while True:
+            if prepare is not None:
+                step = prepare(step)
+            try:
+                result = await step.run_async()
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(result)
+    except StopIteration as stop:
+        return stop.value
 
 
 # =========================
@@ -73,31 +506,135 @@ def send_llama_chat(
 
 def parse_json_loose(text: str) -> dict:
     """
-    Essaie de parser du JSON même si le modèle a mis des ```json ... ``` autour.
+    Premier objet JSON du texte, même si le modèle a mis des ```json ... ```
+    ou de la prose autour (accolades équilibrées, voir JsonObjectScanner).
     Retourne {} en cas d'échec.
     """
     if not text:
         return {}
-    s = text.strip()
+    return first_json_object(text) or {}
 
-    # Enlever les fences markdown éventuelles
-    if s.startswith("```"):
-        start = s.find("{")
-        end = s.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            s = s[start:end + 1]
 
-    try:
-        return json.loads(s)
-    except json.JSONDecodeError:
-        start = s.find("{")
-        end = s.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            try:
-                return json.loads(s[start:end + 1])
-            except json.JSONDecodeError:
-                pass
-    return {}
+# =========================
+# Schémas JSON (décodage contraint)
+# =========================
+
+def intent_schema(skill_names: List[str]) -> Dict[str, Any]:
+    """
+    {"intent": "..."} avec intent limité aux vrais noms de skills.
+    """
+    return {
+        "type": "object",
+        "properties": {"intent": {"type": "string", "enum": list(skill_names)}},
+        "required": ["intent"],
+        "additionalProperties": False,
+    }
+
+
+def switch_schema(skill_names: List[str]) -> Dict[str, Any]:
+    """
+    {"mode": "continue" | "switch", "intent": nom de skill ou null}.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "mode": {"type": "string", "enum": ["continue", "switch"]},
+            "intent": {"enum": [*skill_names, None]},
+        },
+        "required": ["mode", "intent"],
+        "additionalProperties": False,
+    }
+
+
+def slots_schema(slots: List["Slot"]) -> Dict[str, Any]:
+    """
+    {"slots": {nom_du_slot: string ou null, ...}} avec exactement les slots du dialogue.
+    """
+    return {
+        "type": "object",
+        "properties": {"slots": _slot_values_schema(slots)},
+        "required": ["slots"],
+        "additionalProperties": False,
+    }
+
+
+def _slot_values_schema(slots: List["Slot"]) -> Dict[str, Any]:
+    names = [s.name for s in slots]
+    return {
+        "type": "object",
+        "properties": {name: {"type": ["string", "null"]} for name in names},
+        "required": names,
+        "additionalProperties": False,
+    }
+
+
+def route_schema(skills: List["Skill"]) -> Dict[str, Any]:
+    """
+    {"intent": nom de skill, "slots": {...}} : une alternative par skill,
+    les slots étant exactement ceux du skill choisi (aucun pour un skill sans slots).
+    """
+    return {
+        "anyOf": [
+            {
+                "type": "object",
+                "properties": {
+                    "intent": {"const": skill.name},
+                    "slots": _slot_values_schema(skill.slots),
+                },
+                "required": ["intent", "slots"],
+                "additionalProperties": False,
+            }
+            for skill in skills
+        ],
+    }
+
+
+def routing_tools(skills: List["Skill"]) -> List[Dict[str, Any]]:
+    """
+    Une fonction par skill (format tools d'OpenAI), ses slots en paramètres :
+    l'appel choisi par le modèle donne à la fois l'intent et les valeurs.
+    """
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": skill.name,
+                "description": skill.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        s.name: {"type": ["string", "null"], "description": s.description}
+                        for s in skill.slots
+                    },
+                    "required": [s.name for s in skill.slots],
+                },
+            },
+        }
+        for skill in skills
+    ]
+
+
+def optional_llm_step_allowed() -> bool:
+    """
+    Une étape LLM optionnelle (escalade, reformulation de la réponse) est
+    faite seulement s'il reste du temps au tour et du budget de tokens à la session.
+    """
+    return optional_step_allowed() and not budget_exhausted()
+
+
+def format_result_plain(data: Any) -> str:
+    """
+    Réponse sans LLM à partir de données structurées : utilisée quand il ne
+    reste plus assez de temps au tour (ou de budget) pour faire formuler la réponse.
+    """
+    if not isinstance(data, dict):
+        return str(data)
+    lines = []
+    for key, value in data.items():
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        lines.append(f"- {key} : {value}")
+    return "Voici le résultat :\n" + "\n".join(lines)
 
 
 # =========================
@@ -125,6 +662,7 @@ class GenericDialog:
         self.slots: List[Slot] = slots
         self.values: Dict[str, Optional[str]] = {s.name: None for s in slots}
         self.status: DialogStatus = DialogStatus.COLLECTING
+        self._extraction_prompt_text: Optional[str] = None
 
     # --- Helpers ---
 
@@ -136,29 +674,18 @@ class GenericDialog:
 
     # --- LLM: extraction générique ---
 
-    def analyze_user_message(self, user_message: str) -> None:
+    def extraction_prompt(self) -> str:
         """
-        Demande au LLM d'extraire les valeurs de tous les slots
-        à partir du message utilisateur, en tenant compte des valeurs déjà connues.
-        Inclut :
-        - un prompt avec exemple,
-        - un retry ultra-strict si pas de JSON,
-        - la prise en compte des nombres (int/float/bool).
+        Prompt système de l'extraction : ne dépend que de la liste des slots,
+        donc identique octet pour octet à chaque appel (voir warm_up()).
         """
-        if not self.slots:
-            self.status = DialogStatus.READY
-            return
+        if self._extraction_prompt_text is None:
+            self._extraction_prompt_text = self._build_extraction_prompt()
+        return self._extraction_prompt_text
 
-        slot_specs = []
-        for s in self.slots:
-            current_val = self.values.get(s.name)
-            slot_specs.append(
-                f'- "{s.name}": {s.description}. Valeur actuelle = {current_val!r}'
-            )
-        slots_description = "\n".join(slot_specs)
-
-        # --- 1er prompt : explicatif + exemple ---
-        system_prompt = f"""
+    def _build_extraction_prompt(self) -> str:
+        slots_description = "\n".join(f'- "{s.name}": {s.description}' for s in self.slots)
+        return f"""
 Tu es un assistant chargé d'extraire des informations structurées
 à partir du message utilisateur.
 
@@ -166,7 +693,8 @@ On a une liste de "champs" (slots) à remplir :
 
 {slots_description}
 
-À partir EXCLUSIVEMENT du message utilisateur ci-dessous,
+Le message qui suit donne les valeurs déjà connues, puis le message utilisateur.
+À partir EXCLUSIVEMENT du message utilisateur,
 et éventuellement en complétant les informations déjà connues,
 tu essaies d'extraire les nouvelles valeurs pour ces slots.
 
@@ -187,11 +715,13 @@ Tu réponds STRICTEMENT au format JSON, SANS texte autour :
 
 Exemple :
 
-Slots :
-- "restaurant_name": le nom ou type de restaurant. Valeur actuelle = None
-- "date": la date de la réservation. Valeur actuelle = None
-- "time": l'heure de la réservation. Valeur actuelle = None
-- "people": le nombre de personnes. Valeur actuelle = None
+Slots : restaurant_name (nom ou type de restaurant), date, time, people
+
+Valeurs déjà connues :
+- restaurant_name = None
+- date = None
+- time = None
+- people = None
 
 Message utilisateur :
 "je veux aller au restau italien demain soir à 20h pour 3"
@@ -208,57 +738,65 @@ Réponse attendue :
 }}
 """
 
-        raw_answer = send_llama_chat(
-            system_prompt=system_prompt,
-            user_content=user_message,
-            temperature=0.0,
-            max_tokens=256,
-        )
-
-        print("Analyse LLM slots (brut, tentative 1):", raw_answer)
-        data = parse_json_loose(raw_answer)
-        slots_data = data.get("slots")
-
-        # --- Retry ultra-strict si on n'a pas de JSON exploitable ---
-        if not isinstance(slots_data, dict):
-            strict_prompt = f"""
-Tu DOIS répondre uniquement ce JSON, SANS aucun texte avant ou après.
-
-On a les slots suivants :
-
-{slots_description}
+    def _extraction_input(self, user_message: str) -> str:
+        known = "\n".join(f"- {s.name} = {self.values.get(s.name)!r}" for s in self.slots)
+        return f"""Valeurs déjà connues :
+{known}
 
 Message utilisateur :
 "{user_message}"
+"""
 
-Réponds exactement au format :
+    def analyze_user_message(self, user_message: str) -> None:
+        run_steps(self._analyze_steps(user_message))
 
-{{
-  "slots": {{
-    "NOM_DU_SLOT_1": "valeur ou null",
-    "NOM_DU_SLOT_2": "valeur ou null",
-    ...
-  }}
-}}
+    async def analyze_user_message_async(self, user_message: str) -> None:
+        await run_steps_async(self._analyze_steps(user_message))
 
-Remplace NOM_DU_SLOT_* par les vrais noms de slots.
-Toutes les valeurs doivent être des strings ou null.
-Si tu ne connais pas une valeur, mets-la à null.
-"""
-            raw_answer = send_llama_chat(
-                system_prompt=strict_prompt,
-                user_content=None,     # tout est dans le system_prompt
+    def _analyze_steps(self, user_message: str) -> Steps[None]:
+        """
+        Demande au LLM d'extraire les valeurs de tous les slots
+        à partir du message utilisateur, en tenant compte des valeurs déjà connues.
+        Inclut :
+        - un prompt système avec exemple, fixe pour ce dialogue (préfixe
+          réutilisé par le cache KV de llama-server) ; les valeurs connues
+          et le message utilisateur viennent après, dans le message,
+        - un schéma JSON construit à partir des slots (décodage contraint :
+          pas de texte autour du JSON, pas de second appel "strict"),
+        - la prise en compte des nombres (int/float/bool).
+        """
+        if not self.slots:
+            self.status = DialogStatus.READY
+            return
+
+        raw_answer = yield from escalating(
+            LlmCall(
+                system_prompt=self.extraction_prompt(),
+                user_content=self._extraction_input(user_message),
                 temperature=0.0,
                 max_tokens=256,
-            )
-            print("Analyse LLM slots (brut, tentative 2):", raw_answer)
-            data = parse_json_loose(raw_answer)
-            slots_data = data.get("slots", {})
+                cache=True,
+                call_site="analyze_user_message",
+                stop_at_json=True,
+                json_schema=slots_schema(self.slots),
+            ),
+            lambda raw: isinstance(parse_json_loose(raw).get("slots"), dict),
+        )
+
+        data = parse_json_loose(raw_answer)
+        slots_data = data.get("slots")
 
         if not isinstance(slots_data, dict):
-            print("Impossible de parser les slots, aucune mise à jour.")
+            annotate(unparsed=True)
             slots_data = {}
 
+        self.apply_values(slots_data)
+
+    def apply_values(self, slots_data: Dict[str, Any]) -> None:
+        """
+        Met à jour les valeurs avec celles extraites par le LLM (ici ou par le
+        routage en un seul appel), puis le statut du dialogue.
+        """
         # --- Mise à jour des valeurs (en acceptant aussi les nombres) ---
         for s in self.slots:
             new_val = slots_data.get(s.name)
@@ -291,8 +829,8 @@ Si tu ne connais pas une valeur, mets-la à null.
         else:
             self.status = DialogStatus.COLLECTING
 
-        print("Valeurs actuelles:", self.values)
-        print("Status:", self.status.name)
+        annotate(status=self.status.name)
+        annotate(DEBUG, values=dict(self.values))
 
     # --- Décision de la prochaine action ---
 
@@ -316,6 +854,30 @@ Si tu ne connais pas une valeur, mets-la à null.
 # Multi-skills (types de conversation)
 # =========================
 
+# Skill auquel sont imputés les tokens du routage (classify_intent, smart_switch)
+ROUTING_SKILL = "_routing"
+
+# max_tokens des réponses libres quand le budget de tokens de la session est épuisé
+CHEAP_ANSWER_MAX_TOKENS = 96
+
+# Messages qui annulent la demande en cours et vident l'historique
+RESET_COMMANDS = {"reset", "annule", "annuler", "stop"}
+
+# Prompts de routage gardés (un par liste de skills retenus avec un SkillIndex)
+MAX_CACHED_PROMPTS = 64
+
+# Skill auquel sont imputés les tokens des résumés de conversation
+MEMORY_SKILL = "_memory"
+SUMMARY_MAX_TOKENS = 160
+
+SUMMARY_PROMPT = """
+Tu résumes une conversation entre un utilisateur et un assistant.
+Garde uniquement ce qui peut servir pour la suite : demandes de l'utilisateur,
+informations qu'il a données, réponses importantes de l'assistant.
+Quelques phrases courtes, en français, sans rien inventer.
+Réponds uniquement par le résumé.
+""".strip()
+
 @dataclass
 class Skill:
     name: str
@@ -323,6 +885,145 @@ class Skill:
     slots: List[Slot]
     final_answer_system_prompt: str
     on_ready: Optional[Callable[[Dict[str, str]], Any]] = None
+    # modèle par site d'appel pour ce skill (prioritaire sur MultiSkillAgent.models)
+    models: Dict[str, ModelSpec] = field(default_factory=dict)
+    # routage local sans LLM (voir IntentMatcher) : mots entiers, ou expressions
+    # régulières, cherchés dans le message en minuscules et sans accents
+    keywords: List[str] = field(default_factory=list)
+    patterns: List[Union[str, "re.Pattern[str]"]] = field(default_factory=list)
+    # exemples de messages, indexés avec la description (voir SkillIndex)
+    examples: List[str] = field(default_factory=list)
+    # skill sans slots : réponses resservies aux messages quasi identiques
+    # (voir SemanticCache) ; générées alors sans l'historique de la conversation
+    answer_cache: Optional["SemanticCache"] = None
+
+
+# =========================
+# Routage local (mots-clés et patterns des skills)
+# =========================
+
+def fold_text(text: str) -> str:
+    """
+    Minuscules sans accents : "Réserve" -> "reserve".
+    """
+    decomposed = unicodedata.normalize("NFD", text.casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+@dataclass
+class FastPathStats:
+    hits: int = 0        # un seul skill reconnu : pas d'appel classify_intent
+    ambiguous: int = 0   # plusieurs skills reconnus : on laisse le LLM choisir
+    misses: int = 0      # aucun skill reconnu
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.ambiguous + self.misses
+        return self.hits / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "ambiguous": self.ambiguous,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 3),
+        }
+
+
+class IntentMatcher:
+    """
+    Reconnaît le skill d'un message à partir des keywords / patterns déclarés
+    sur les Skill, sans appel LLM.
+
+    Les règles de chaque skill (une expression pour ses keywords, puis ses
+    patterns tels quels, drapeaux compris) sont compilées à la construction :
+    un pattern invalide lève ValueError avec le nom du skill. Chaque skill est
+    testé séparément, un pattern trop large ne masque donc pas les autres. Le
+    résultat n'est retenu que s'il est sans ambiguïté (un seul skill reconnu),
+    sinon None et l'agent passe par classify_intent.
+    """
+
+    def __init__(self, skills: List[Skill]):
+        self.stats = FastPathStats()
+        self._rules: List[tuple[str, List["re.Pattern[str]"]]] = []
+        for skill in skills:
+            rules = []
+            if skill.keywords:
+                keywords = "|".join(re.escape(fold_text(k)) for k in skill.keywords)
+                rules.append(re.compile(rf"\b(?:{keywords})\b"))
+            for pattern in skill.patterns:
+                try:
+                    rules.append(pattern if isinstance(pattern, re.Pattern) else re.compile(pattern))
+                except re.error as e:
+                    raise ValueError(f"Pattern invalide pour le skill {skill.name!r}: {pattern!r} ({e})") from e
+            if rules:
+                self._rules.append((skill.name, rules))
+
+    def candidates(self, user_message: str) -> List[str]:
+        text = fold_text(user_message)
+        return sorted(name for name, rules in self._rules if any(rule.search(text) for rule in rules))
+
+    def match(self, user_message: str) -> Optional[str]:
+        if not self._rules:
+            return None
+        found = self.candidates(user_message)
+        if len(found) == 1:
+            self.stats.hits += 1
+            return found[0]
+        if found:
+            self.stats.ambiguous += 1
+        else:
+            self.stats.misses += 1
+        return None
+
+
+# =========================
+# Index vectoriel des skills (grands catalogues)
+# =========================
+
+class SkillIndex:
+    """
+    Index des skills par embeddings (description et examples) : seuls les
+    top_k skills les plus proches du message vont dans les prompts de
+    routage, dont la taille ne dépend alors plus du nombre de skills.
+    Demande NumPy et un llama-server lancé avec --embeddings ; la matrice
+    est gardée dans cache_path (.npz) et recalculée si les skills changent.
+
+    Un même index sert tous les agents (un par session) : il est construit
+    par le premier, les suivants le réutilisent. Avec AsyncMultiSkillAgent,
+    le construire au démarrage (build) évite de bloquer la boucle asyncio.
+
+        index = SkillIndex(Embedder(get_client_for(EMBEDDING_URL)), top_k=8, cache_path="skills.npz")
+        index.build(skills)
+        agent = MultiSkillAgent(skills, skill_index=index)
+    """
+
+    def __init__(self, embedder: "Embedder", top_k: int = 8, cache_path: Optional[Union[str, Path]] = None):
+        self.embedder = embedder
+        self.top_k = top_k
+        self.cache_path = cache_path
+        self.index: Optional["VectorIndex"] = None
+        self._texts: Optional[Dict[str, List[str]]] = None
+        self._lock = threading.Lock()
+
+    def build(self, skills: List[Skill]) -> None:
+        """
+        Sans effet si l'index est déjà construit pour les mêmes skills.
+        """
+        from llama_client.embeddings import VectorIndex
+
+        texts = {s.name: [f"{s.name} : {s.description}", *s.examples] for s in skills}
+        with self._lock:
+            if self.index is not None and texts == self._texts:
+                return
+            with span("skill_index.build", skills=len(skills)):
+                self.index = VectorIndex.build(self.embedder, texts, self.cache_path)
+            self._texts = texts
+
+    def shortlist(self, vector: "np.ndarray") -> List[str]:
+        if self.index is None:
+            raise RuntimeError("SkillIndex.build() n'a pas été appelé")
+        return [name for name, _ in self.index.search(vector, self.top_k)]
 
 
 class MultiSkillAgent:
@@ -334,30 +1035,176 @@ class MultiSkillAgent:
     - last_asked_slot_name : quel slot on est en train de demander
     - smart switch : quand on attend une réponse de slot, on demande au LLM
       s'il faut continuer ce skill ou passer à un autre.
+    - on_token : si défini, les réponses finales (texte libre) sont streamées
+      et on_token reçoit chaque morceau dès sa génération.
+    - priority : classe de priorité de tous les appels LLM de cet agent
+      ("interactive" pour un utilisateur, "background" pour du traitement de masse).
+    - turn_timeout : échéance par défaut d'un tour (secondes) ; tous les appels
+      LLM du tour s'y adaptent et les étapes optionnelles sont sautées à la fin.
+    - token_budget : tokens (prompt + génération) alloués à la session ; une fois
+      dépassé, l'agent prend les chemins économes (pas de smart switch LLM,
+      pas d'escalade de modèle, réponses finales courtes ou sans LLM).
+    - usage : comptes de tokens de la session par site d'appel, tour et skill.
+    - model : modèle principal (réponses finales, cible des escalades).
+    - models : modèle par site d'appel ("classify_intent", "smart_switch",
+      "analyze_user_message"...), complété par Skill.models ; voir
+      small_model_cascade(). Un appel fait sur un autre modèle que `model`
+      est refait sur `model` si sa réponse est inexploitable.
+    - single_pass : "json" ou "tools" pour choisir le skill d'un nouveau
+      message ET extraire ses slots en un seul appel LLM au lieu de deux
+      (classify_intent puis analyze_user_message) ; "tools" passe par l'appel
+      de fonctions natif de llama-server (--jinja), une fonction par skill.
+    - skill_index : ne met dans les prompts de routage que les skills les
+      plus proches du message (embeddings), pour les grands catalogues.
+    - history_tokens : garde l'historique de la conversation (ConversationMemory)
+      et l'injecte dans les réponses finales, borné à ce nombre de tokens ;
+      les anciens échanges sont résumés en arrière-plan.
+    - slot_affinity : épingle les appels sur des slots de llama-server, un par
+      site d'appel et skill : chacun a son propre prompt système, commun à
+      toutes les conversations ; les faire alterner dans un même slot viderait
+      son cache KV. Le préchauffage (warm_up) remplit ces mêmes slots.
     """
 
-    def __init__(self, skills: List[Skill]):
+    def __init__(
+        self,
+        skills: List[Skill],
+        on_token: Optional[Callable[[str], None]] = None,
+        priority: str = "interactive",
+        turn_timeout: Optional[float] = None,
+        token_budget: Optional[int] = None,
+        model: ModelSpec = DEFAULT_MODEL,
+        models: Optional[Dict[str, ModelSpec]] = None,
+        slot_affinity: Optional[SlotAffinity] = None,
+        history_tokens: Optional[int] = None,
+        single_pass: Optional[str] = None,
+        skill_index: Optional[SkillIndex] = None,
+    ):
+        if single_pass not in (None, "json", "tools"):
+            raise ValueError(f"single_pass inconnu: {single_pass!r} (None, \"json\" ou \"tools\")")
         self.skills: Dict[str, Skill] = {s.name: s for s in skills}
         self.dialogs: Dict[str, GenericDialog] = {
             s.name: GenericDialog(s.slots) for s in skills
         }
+        self.intent_matcher = IntentMatcher(skills)
         self.current_skill_name: Optional[str] = None
         self.awaiting_slot_answer: bool = False
         self.last_asked_slot_name: Optional[str] = None
+        self.on_token = on_token
+        self.priority = priority
+        self.turn_timeout = turn_timeout
+        self.usage = UsageLedger(budget=token_budget)
+        self.turn_count = 0
+        self.model = model
+        self.models: Dict[str, ModelSpec] = dict(models or {})
+        self.slot_affinity = slot_affinity
+        self.memory: Optional[ConversationMemory] = (
+            ConversationMemory(self._summarize_history, max_tokens=history_tokens)
+            if history_tokens else None
+        )
+        self.single_pass = single_pass
+        # prompts de routage déjà construits, par (sorte, skills listés) ; partagés
+        # avec warm_up, qui tourne dans un autre thread pendant les premiers tours
+        self._prompts: "OrderedDict[tuple[str, tuple[str, ...]], str]" = OrderedDict()
+        self._prompts_lock = threading.Lock()
+        self.skill_index = skill_index
+        if skill_index is not None and len(self.skills) > skill_index.top_k:
+            try:
+                skill_index.build(skills)
+            except RuntimeError as e:
+                # tous les skills iront dans les prompts de routage
+                event("skill_index_disabled", INFO, error=str(e))
+                self.skill_index = None
+
+    # --- Réglages appliqués à chaque appel LLM ---
+
+    def _prepare_step(self, step: Step) -> Step:
+        if isinstance(step, LlmCall):
+            step.priority = self.priority
+            if step.skill is None:
+                step.skill = self.current_skill_name
+            if step.model is None:
+                step.model = self._model_for(step.call_site, step.skill)
+                if step.model != self.model:
+                    step.escalation = self.model
+            self._pin(step, step.call_site)
+        return step
+
+    def _pin(self, call: LlmCall, call_site: Optional[str]) -> None:
+        """
+        Slot épinglé de l'appel : un par prompt système (site d'appel et skill).
+        """
+        affinity = self.slot_affinity
+        if affinity is not None and call.slot_key is None and get_client_for(call.model.url) is affinity.client:
+            call.affinity = affinity
+            call.slot_key = f"{call_site or 'chat'}/{call.skill or '-'}"
+
+    def _model_for(self, call_site: Optional[str], skill_name: Optional[str]) -> ModelSpec:
+        skill = self.skills.get(skill_name) if skill_name else None
+        if skill is not None and call_site in skill.models:
+            return skill.models[call_site]
+        return self.models.get(call_site, self.model)
 
     # --- Intent detection ---
 
     def classify_intent(self, user_message: str) -> str:
-        skills_desc = []
-        for s in self.skills.values():
-            skills_desc.append(f'- "{s.name}": {s.description}')
-        skills_text = "\n".join(skills_desc)
+        return run_steps(self._classify_intent_steps(user_message), self._prepare_step)
 
-        system_prompt = f"""
+    # --- Prompts système statiques ---
+    # Construits une fois et identiques octet pour octet d'un appel à l'autre :
+    # les données du tour vont dans le message utilisateur, après ce préfixe,
+    # pour que llama-server réutilise le préfixe déjà dans son cache KV.
+    # Avec un SkillIndex, un prompt par liste de skills retenus (ordre du catalogue).
+
+    def _shortlist_steps(self, user_message: str) -> Steps[List[str]]:
+        """
+        Skills à proposer au LLM pour ce message : tous, ou les top_k plus
+        proches d'après le SkillIndex.
+        """
+        names = list(self.skills)
+        if self.skill_index is None or self.skill_index.index is None:
+            return names
+        try:
+            vector = yield EmbedCall(self.skill_index.embedder, user_message)
+        except RuntimeError as e:
+            annotate(shortlist_error=str(e))
+            return names
+        found = set(self.skill_index.shortlist(vector))
+        shortlist = [name for name in names if name in found]
+        annotate(shortlist=shortlist)
+        return shortlist
+
+    def _prompt(self, kind: str, names: List[str], build: Callable[[List[str]], str]) -> str:
+        key = (kind, tuple(names))
+        with self._prompts_lock:
+            prompt = self._prompts.get(key)
+            if prompt is None:
+                prompt = self._prompts[key] = build(names)
+                while len(self._prompts) > MAX_CACHED_PROMPTS:
+                    self._prompts.popitem(last=False)
+            else:
+                self._prompts.move_to_end(key)
+            return prompt
+
+    def _skills_text(self, names: List[str]) -> str:
+        return "\n".join(f'- "{name}": {self.skills[name].description}' for name in names)
+
+    def _routing_prompt(self, names: List[str]) -> str:
+        return self._prompt("routing", names, self._build_routing_prompt)
+
+    def _switch_prompt(self, names: List[str]) -> str:
+        return self._prompt("switch", names, self._build_switch_prompt)
+
+    def _single_pass_prompt(self, names: List[str]) -> str:
+        if self.single_pass == "tools":
+            return self._prompt("tools", [], lambda _: self._build_tools_routing_prompt())
+        return self._prompt("single_pass", names, self._build_single_pass_prompt)
+
+    def _build_routing_prompt(self, names: List[str]) -> str:
+        return f"""
 Tu es un routeur de requêtes.
 On dispose des types de conversation (skills) suivants :
 
-{skills_text}
+{self._skills_text(names)}
 
 À partir du message utilisateur ci-dessous, tu dois choisir
 le *meilleur* skill parmi la liste.
@@ -371,18 +1218,103 @@ Tu réponds STRICTEMENT en JSON :
 - "intent" doit être exactement égal à l'un des noms listés ci-dessus.
 """
 
-        raw = send_llama_chat(
-            system_prompt=system_prompt,
-            user_content=user_message,
-            temperature=0.0,
-            max_tokens=128,
+    def _build_single_pass_prompt(self, names: List[str]) -> str:
+        def slots_text(skill: Skill) -> str:
+            if not skill.slots:
+                return "    champs : aucun"
+            return "\n".join(f'    champ "{s.name}" : {s.description}' for s in skill.slots)
+
+        skills_text = "\n".join(
+            f'- "{name}": {self.skills[name].description}\n{slots_text(self.skills[name])}' for name in names
         )
+        return f"""
+Tu es un routeur de requêtes qui extrait aussi les informations utiles.
+On dispose des types de conversation (skills) suivants, chacun avec
+les champs (slots) à remplir :
 
-        print("Analyse LLM intent (brut):", raw)
+{skills_text}
+
+À partir du message utilisateur ci-dessous :
+1. choisis le *meilleur* skill parmi la liste ;
+2. extrais du message les valeurs des champs de CE skill.
+
+Tu réponds STRICTEMENT en JSON, SANS texte autour :
+
+{{
+  "intent": "nom_du_skill",
+  "slots": {{
+    "nom_du_champ": "valeur ou null",
+    ...
+  }}
+}}
+
+- "intent" doit être exactement égal à l'un des noms listés ci-dessus.
+- "slots" contient tous les champs du skill choisi et eux seuls
+  (objet vide si le skill n'a pas de champs).
+- Les valeurs sont des chaînes de caractères, ou null si le message ne les donne pas.
+"""
+
+    def _build_tools_routing_prompt(self) -> str:
+        # les skills et leurs slots sont dans les fonctions (tools), rendues
+        # dans le prompt par le modèle de chat du serveur
+        return """
+Tu es un routeur de requêtes.
+Appelle la fonction du skill qui correspond le mieux au message utilisateur,
+avec en arguments les valeurs des champs trouvées dans ce message
+(null pour une valeur que le message ne donne pas).
+"""
+
+    def _build_switch_prompt(self, names: List[str]) -> str:
+        return f"""
+Tu es un classificateur de contexte de conversation.
+
+Le système est en train de remplir les champs (slots) d'un skill et attend
+la réponse de l'utilisateur à une question. Le message qui suit donne ce
+contexte (skill en cours, champ attendu) puis le message de l'utilisateur.
+
+Les skills possibles sont :
+{self._skills_text(names)}
+
+Ta tâche:
+1. Dire si l'utilisateur semble:
+   - répondre à la question en cours pour ce skill
+   - ou bien entamer une nouvelle demande qui correspond à un autre skill
+2. Si c'est une nouvelle demande, indiquer le skill le plus pertinent.
+
+Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
+
+{{
+  "mode": "continue" | "switch",
+  "intent": "nom_du_skill_ou_null"
+}}
+
+- "mode" = "continue" si l'utilisateur répond à la question du slot en cours.
+- "mode" = "switch" si l'utilisateur commence une nouvelle demande.
+- Si "mode" = "switch", "intent" doit être un des noms de skill valides ci-dessus
+  ou "null" si tu n'es pas sûr.
+"""
+
+    def _classify_intent_steps(self, user_message: str) -> Steps[str]:
+        names = yield from self._shortlist_steps(user_message)
+        raw = yield from escalating(
+            LlmCall(
+                system_prompt=self._routing_prompt(names),
+                user_content=user_message,
+                temperature=0.0,
+                max_tokens=128,
+                cache=True,
+                call_site="classify_intent",
+                stop_at_json=True,
+                skill=ROUTING_SKILL,
+                json_schema=intent_schema(names),
+            ),
+            lambda raw: parse_json_loose(raw).get("intent") in self.skills,
+        )
 
         data = parse_json_loose(raw)
         intent = data.get("intent")
 
+        # possible seulement si la sortie a été tronquée (le schéma limite intent aux skills)
         if intent not in self.skills:
             if "smalltalk" in self.skills:
                 return "smalltalk"
@@ -390,9 +1322,62 @@ Tu réponds STRICTEMENT en JSON :
 
         return intent
 
+    def _route_and_extract_steps(self, user_message: str) -> Steps[tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Routage et extraction des slots en un seul appel (single_pass) :
+        (skill, valeurs extraites). Si le skill retourné est inexploitable,
+        on repasse par classify_intent et les valeurs sont None (extraction
+        séparée ensuite).
+        """
+        names = yield from self._shortlist_steps(user_message)
+        skills = [self.skills[name] for name in names]
+        if self.single_pass == "tools":
+            call = LlmCall(
+                system_prompt=self._single_pass_prompt(names),
+                user_content=user_message,
+                temperature=0.0,
+                max_tokens=256,
+                cache=True,
+                call_site="route_and_extract",
+                skill=ROUTING_SKILL,
+                tools=routing_tools(skills),
+            )
+        else:
+            call = LlmCall(
+                system_prompt=self._single_pass_prompt(names),
+                user_content=user_message,
+                temperature=0.0,
+                max_tokens=256,
+                cache=True,
+                call_site="route_and_extract",
+                stop_at_json=True,
+                skill=ROUTING_SKILL,
+                json_schema=route_schema(skills),
+            )
+
+        raw = yield from escalating(call, lambda raw: self._parse_route(raw)[0] in self.skills)
+        intent, values = self._parse_route(raw)
+        if intent not in self.skills:
+            annotate(unparsed=True)
+            return (yield from self._classify_intent_steps(user_message)), None
+        return intent, values
+
+    @staticmethod
+    def _parse_route(raw: str) -> tuple[Optional[str], Optional[Dict[str, Any]]]:
+        data = parse_json_loose(raw)
+        if "name" in data:
+            # appel de fonction : {"name": skill, "arguments": slots}
+            intent, values = data.get("name"), data.get("arguments")
+        else:
+            intent, values = data.get("intent"), data.get("slots")
+        return intent, values if isinstance(values, dict) else None
+
     # --- Smart switch ---
 
     def smart_switch_decision(self, user_message: str) -> tuple[str, Optional[str]]:
+        return run_steps(self._smart_switch_steps(user_message), self._prepare_step)
+
+    def _smart_switch_steps(self, user_message: str) -> Steps[tuple[str, Optional[str]]]:
         """
         Décide, quand on attend une réponse pour un slot d'un skill courant, si :
         - on CONTINUE ce skill ("continue", None)
@@ -402,8 +1387,11 @@ Tu réponds STRICTEMENT en JSON :
         if not (self.current_skill_name and self.awaiting_slot_answer):
             return "route", None
 
+        if budget_exhausted():
+            annotate(skipped="budget")
+            return "continue", None
+
         skill = self.skills[self.current_skill_name]
-        dialog = self.dialogs[self.current_skill_name]
 
         slot_desc = ""
         if self.last_asked_slot_name:
@@ -412,53 +1400,32 @@ Tu réponds STRICTEMENT en JSON :
                     slot_desc = f'nom="{s.name}", description="{s.description}", question="{s.question}"'
                     break
 
-        skills_desc = []
-        for s in self.skills.values():
-            skills_desc.append(f'- "{s.name}": {s.description}')
-        skills_text = "\n".join(skills_desc)
-
-        system_prompt = f"""
-Tu es un classificateur de contexte de conversation.
-
+        context = f"""
 Contexte:
 - Le système est actuellement en train de traiter le skill "{self.current_skill_name}".
 - Il attend une réponse de l'utilisateur à propos d'un champ (slot) spécifique :
   {slot_desc}
 
-Les skills possibles sont :
-{skills_text}
-
 Message utilisateur actuel:
 "{user_message}"
-
-Ta tâche:
-1. Dire si l'utilisateur semble:
-   - répondre à la question en cours pour ce skill
-   - ou bien entamer une nouvelle demande qui correspond à un autre skill
-2. Si c'est une nouvelle demande, indiquer le skill le plus pertinent.
-
-Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
-
-{{
-  "mode": "continue" | "switch",
-  "intent": "nom_du_skill_ou_null"
-}}
-
-- "mode" = "continue" si l'utilisateur répond à la question du slot en cours.
-- "mode" = "switch" si l'utilisateur commence une nouvelle demande.
-- Si "mode" = "switch", "intent" doit être un des noms de skill valides ci-dessus
-  ou "null" si tu n'es pas sûr.
 """
 
-        raw = send_llama_chat(
-            system_prompt=system_prompt,
-            user_content=user_message,
-            temperature=0.0,
-            max_tokens=128,
+        names = yield from self._shortlist_steps(user_message)
+        raw = yield from escalating(
+            LlmCall(
+                system_prompt=self._switch_prompt(names),
+                user_content=context,
+                temperature=0.0,
+                max_tokens=128,
+                cache=True,
+                call_site="smart_switch",
+                stop_at_json=True,
+                skill=ROUTING_SKILL,
+                json_schema=switch_schema(names),
+            ),
+            lambda raw: self._switch_accepted(parse_json_loose(raw)),
         )
 
-        print("Analyse LLM smart switch (brut):", raw)
-
         data = parse_json_loose(raw)
         mode = data.get("mode")
         intent = data.get("intent")
@@ -474,17 +1441,167 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
             return "switch", intent
         return "switch", None
 
+    def _switch_accepted(self, data: Dict[str, Any]) -> bool:
+        """
+        Réponse du smart switch exploitable : "continue", ou "switch" vers un
+        skill connu (sinon le changement de skill serait perdu).
+        """
+        mode = data.get("mode")
+        return mode == "continue" or (mode == "switch" and data.get("intent") in self.skills)
+
+    # --- Préchauffage du cache de prompts ---
+
+    def _warm_up_calls(self, limit: Optional[int] = None) -> List[LlmCall]:
+        """
+        Un appel minimal par prompt système fixe, sur le modèle qui servira
+        vraiment ce site d'appel. Du plus utilisé (routage, à chaque tour) au
+        moins utilisé, puis inversé : chaque slot de llama-server ne garde que
+        son dernier prompt et réutilise le moins récent, les plus utiles sont
+        donc préchauffés en dernier.
+        """
+        prompts = []
+        # avec un SkillIndex, les prompts de routage changent selon le message
+        if self.skill_index is None:
+            names = list(self.skills)
+            if self.single_pass is not None:
+                prompts.append((ROUTING_SKILL, "route_and_extract", self._single_pass_prompt(names)))
+            else:
+                prompts.append((ROUTING_SKILL, "classify_intent", self._routing_prompt(names)))
+            prompts.append((ROUTING_SKILL, "smart_switch", self._switch_prompt(names)))
+        for name, skill in self.skills.items():
+            if skill.slots:
+                prompts.append((name, "analyze_user_message", self.dialogs[name].extraction_prompt()))
+        for name, skill in self.skills.items():
+            prompts.append((name, "final_answer", skill.final_answer_system_prompt))
+        prompts = prompts[:limit][::-1]
+        # en mode "tools", les fonctions font partie du prompt préchauffé
+        tools = routing_tools(list(self.skills.values())) if self.single_pass == "tools" else None
+        calls = []
+        for skill_name, call_site, prompt in prompts:
+            call = LlmCall(
+                system_prompt=prompt,
+                max_tokens=1,
+                call_site="warm_up",
+                priority="background",
+                skill=skill_name,
+                model=self._model_for(call_site, skill_name),
+                tools=tools if call_site == "route_and_extract" else None,
+            )
+            # même slot que les vrais appels de ce prompt
+            self._pin(call, call_site)
+            calls.append(call)
+        return calls
+
+    def warm_up(self, limit: Optional[int] = None) -> int:
+        """
+        Fait traiter une fois chaque prompt système fixe par llama-server
+        (cache_prompt) pour que les premiers tours ne paient pas leur
+        traitement. À lancer au démarrage, par exemple dans un thread.
+        limit : nombre de prompts à préchauffer (au plus le nombre de slots
+        du serveur, les suivants évinceraient les premiers).
+        Retourne le nombre de prompts préchauffés.
+        """
+        warmed = 0
+        with usage_scope(self.usage), span("warm_up"):
+            for call in self._warm_up_calls(limit):
+                try:
+                    call.run()
+                    warmed += 1
+                except Exception as e:
+                    event("warm_up_failed", INFO, skill=call.skill, error=str(e))
+        return warmed
+
+    # --- Historique de la conversation ---
+
+    def _history(self) -> Optional[List[Dict[str, str]]]:
+        return self.memory.messages() if self.memory is not None else None
+
+    def _remember(self, user_message: str, answer: str) -> None:
+        # un reset vient de vider l'historique : le tour "reset" n'y entre pas
+        if self.memory is not None and isinstance(answer, str) and user_message.lower() not in RESET_COMMANDS:
+            self.memory.add_turn(user_message, answer)
+
+    def _summarize_history(self, previous: Optional[str], messages: List[Dict[str, str]]) -> str:
+        """
+        Appelé par ConversationMemory dans son thread : hors de tout tour
+        (ni échéance ni annulation), en priorité "background".
+        """
+        transcript = "\n".join(
+            f"{'Utilisateur' if m['role'] == 'user' else 'Assistant'} : {m['content']}" for m in messages
+        )
+        if previous:
+            transcript = f"Résumé précédent :\n{previous}\n\nSuite de la conversation :\n{transcript}"
+        call = LlmCall(
+            system_prompt=SUMMARY_PROMPT,
+            user_content=transcript,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            call_site="summarize",
+            priority="background",
+            skill=MEMORY_SKILL,
+            model=self._model_for("summarize", MEMORY_SKILL),
+        )
+        with usage_scope(self.usage):
+            return call.run()
+
     # --- Reset de contexte ---
 
     def reset_context(self):
         self.current_skill_name = None
         self.awaiting_slot_answer = False
         self.last_asked_slot_name = None
+        if self.memory is not None:
+            self.memory.clear()
         # on peut aussi reset les dialogs si besoin
 
     # --- Orchestration d'un message utilisateur ---
 
-    def handle_user_message(self, user_message: str) -> str:
+    def _turn_deadline(self, deadline: Optional[float]) -> Optional[Deadline]:
+        seconds = deadline if deadline is not None else self.turn_timeout
+        return Deadline(seconds) if seconds is not None else None
+
+    def _turn_usage(self) -> ContextManager[Optional[UsageLedger]]:
+        self.turn_count += 1
+        return usage_scope(self.usage, turn=str(self.turn_count))
+
+    def handle_user_message(
+        self,
+        user_message: str,
+        deadline: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> str:
+        """
+        deadline : temps maximal (secondes) pour tout le tour, partagé par
+        tous les appels LLM (par défaut self.turn_timeout).
+        cancel : jeton pour abandonner le tour depuis un autre thread (nouveau
+        message, "reset") ; la génération en cours est coupée côté serveur et
+        RequestCancelled est levée.
+        """
+        with deadline_scope(self._turn_deadline(deadline)), cancel_scope(cancel), \
+                self._turn_usage(), span("turn", turn=self.turn_count):
+            event("user_message", text=user_message)
+            answer = run_steps(self._turn_steps(user_message), self._prepare_step)
+            self._remember(user_message, answer)
+            return answer
+
+    def _routing_steps(self, user_message: str) -> Steps[tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Skill du message, et valeurs de ses slots si elles ont été extraites
+        par le même appel (single_pass), sinon None.
+        Sans appel LLM quand les keywords / patterns des skills suffisent.
+        """
+        with span("routing") as s:
+            skill_name = self.intent_matcher.match(user_message)
+            if skill_name is not None:
+                s.set(skill=skill_name, fast_path=True)
+                return skill_name, None
+            if self.single_pass is not None:
+                skill_name, values = yield from self._route_and_extract_steps(user_message)
+            else:
+                skill_name, values = (yield from self._classify_intent_steps(user_message)), None
+            s.set(skill=skill_name, extracted=values is not None)
+        return skill_name, values
+
+    def _turn_steps(self, user_message: str) -> Steps[str]:
         """
         Traite un message utilisateur en combinant:
         - smart switch (si on est en slot-filling),
@@ -493,21 +1610,23 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
         - handler on_ready.
         """
 
-        if user_message.lower() in {"reset", "annule", "annuler", "stop"}:
+        if user_message.lower() in RESET_COMMANDS:
             self.reset_context()
             return "D'accord, on repart de zéro. De quoi veux-tu parler ?"
 
         skill_name: str
+        # valeurs des slots déjà extraites par le routage (single_pass)
+        extracted: Optional[Dict[str, Any]] = None
 
         # 1) Smart switch si on attend une réponse de slot
         if self.current_skill_name and self.awaiting_slot_answer:
-            decision, switch_intent = self.smart_switch_decision(user_message)
+            with span("smart_switch", skill=self.current_skill_name) as s:
+                decision, switch_intent = yield from self._smart_switch_steps(user_message)
+                s.set(decision=decision, intent=switch_intent)
 
             if decision == "continue":
                 skill_name = self.current_skill_name
-                print(f"[DEBUG] SmartSwitch => CONTINUE skill: {skill_name}")
             elif decision == "switch":
-                print(f"[DEBUG] SmartSwitch => SWITCH skill (intent={switch_intent})")
                 # on sort du skill courant
                 self.awaiting_slot_answer = False
                 self.last_asked_slot_name = None
@@ -516,19 +1635,17 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
                 if switch_intent and switch_intent in self.skills:
                     skill_name = switch_intent
                 else:
-                    skill_name = self.classify_intent(user_message)
+                    skill_name, extracted = yield from self._routing_steps(user_message)
 
                 self.current_skill_name = skill_name
             else:
                 # "route" ou autre -> fallback route normal
-                skill_name = self.classify_intent(user_message)
+                skill_name, extracted = yield from self._routing_steps(user_message)
                 self.current_skill_name = skill_name
         else:
             # pas en attente de slot -> simple routing
-            print("MEssage utilisateur reçu:", user_message)
-            skill_name = self.classify_intent(user_message)
+            skill_name, extracted = yield from self._routing_steps(user_message)
             self.current_skill_name = skill_name
-            print(f"[DEBUG] Nouveau skill sélectionné: {skill_name}")
 
         skill = self.skills[skill_name]
         dialog = self.dialogs[skill_name]
@@ -538,16 +1655,43 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
             self.awaiting_slot_answer = False
             self.last_asked_slot_name = None
 
-            answer = send_llama_chat(
+            cache = skill.answer_cache
+            vector = None
+            if cache is not None:
+                try:
+                    vector = yield EmbedCall(cache.embedder, user_message)
+                except RuntimeError as e:
+                    annotate(semantic_cache_error=str(e))
+                if vector is not None:
+                    cached = cache.lookup(vector)
+                    if cached is not None:
+                        if self.on_token is not None:
+                            self.on_token(cached)
+                        return cached
+
+            cheap = budget_exhausted()
+            start = time.perf_counter()
+            answer = yield LlmCall(
                 system_prompt=skill.final_answer_system_prompt,
                 user_content=user_message,
                 temperature=0.7,
-                max_tokens=256,
+                max_tokens=CHEAP_ANSWER_MAX_TOKENS if cheap else 256,
+                on_token=self.on_token,
+                call_site="final_answer",
+                # réponse mise en cache : elle ne doit dépendre que du message
+                history=self._history() if cache is None else None,
             )
+            if cache is not None and vector is not None and not cheap:
+                # pas les réponses raccourcies faute de budget
+                cache.store(vector, answer, time.perf_counter() - start)
             return answer
 
         # 3) Skill AVEC slots -> slot-filling
-        dialog.analyze_user_message(user_message)
+        with span("extraction", skill=skill_name, single_pass=extracted is not None):
+            if extracted is not None:
+                dialog.apply_values(extracted)
+            else:
+                yield from dialog._analyze_steps(user_message)
         action, slot = dialog.next_action()
 
         if action == "ask_slot" and slot is not None:
@@ -565,13 +1709,16 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
             # 1) Handler Python si défini
             if skill.on_ready is not None:
                 try:
-                    result = skill.on_ready(values)
+                    result = yield HandlerCall(skill.on_ready, values)
                 except Exception as e:
-                    print("Erreur dans le handler du skill:", e)
+                    event("handler_error", INFO, skill=skill.name, error=str(e))
                     result = "J'ai rencontré un problème en traitant ta demande."
 
                 if isinstance(result, str):
                     answer = result
+                elif not optional_llm_step_allowed():
+                    # plus le temps (ou le budget) de faire formuler la réponse par le LLM
+                    answer = format_result_plain(result)
                 else:
                     payload_json = json.dumps(result, ensure_ascii=False, indent=2)
                     user_question = (
@@ -580,29 +1727,38 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
                         "Formule une réponse claire et naturelle pour l'utilisateur."
                     )
 
-                    answer = send_llama_chat(
+                    answer = yield LlmCall(
                         system_prompt=skill.final_answer_system_prompt,
                         user_content=user_question,
                         temperature=0.7,
                         max_tokens=256,
+                        on_token=self.on_token,
+                        call_site="final_answer",
+                        history=self._history(),
                     )
 
                 self.dialogs[skill_name] = GenericDialog(skill.slots)
                 self.current_skill_name = None
                 return answer
 
-            # 2) Pas de handler -> fallback LLM
-            user_question = (
-                f"Les valeurs collectées pour le skill '{skill.name}' sont : {values}. "
-                "Formule une réponse appropriée pour l'utilisateur."
-            )
-
-            final_answer = send_llama_chat(
-                system_prompt=skill.final_answer_system_prompt,
-                user_content=user_question,
-                temperature=0.7,
-                max_tokens=256,
-            )
+            # 2) Pas de handler -> fallback LLM (ou texte brut si plus le temps / budget)
+            if not optional_llm_step_allowed():
+                final_answer = format_result_plain(values)
+            else:
+                user_question = (
+                    f"Les valeurs collectées pour le skill '{skill.name}' sont : {values}. "
+                    "Formule une réponse appropriée pour l'utilisateur."
+                )
+
+                final_answer = yield LlmCall(
+                    system_prompt=skill.final_answer_system_prompt,
+                    user_content=user_question,
+                    temperature=0.7,
+                    max_tokens=256,
+                    on_token=self.on_token,
+                    call_site="final_answer",
+                    history=self._history(),
+                )
 
             self.dialogs[skill_name] = GenericDialog(skill.slots)
             self.current_skill_name = None
@@ -611,3 +1767,44 @@ Tu réponds STRICTEMENT en JSON, SANS texte autour, au format:
         self.awaiting_slot_answer = False
         self.last_asked_slot_name = None
         return "Je suis un peu perdu, peux-tu reformuler ?"
+
+
+class AsyncMultiSkillAgent(MultiSkillAgent):
+    """
+    Variante asyncio de MultiSkillAgent.
+
+    Mêmes Skill / Slot / GenericDialog et même logique de tour (les étapes
+    sont partagées), mais les appels LLM sont attendus sans bloquer la boucle.
+    Un agent = une conversation : on peut en faire tourner des centaines
+    dans la même boucle, par exemple avec asyncio.gather().
+    """
+
+    async def classify_intent(self, user_message: str) -> str:
+        return await run_steps_async(self._classify_intent_steps(user_message), self._prepare_step)
+
+    async def smart_switch_decision(self, user_message: str) -> tuple[str, Optional[str]]:
+        return await run_steps_async(self._smart_switch_steps(user_message), self._prepare_step)
+
+    async def warm_up(self, limit: Optional[int] = None) -> int:
+        warmed = 0
+        with usage_scope(self.usage), span("warm_up"):
+            for call in self._warm_up_calls(limit):
+                try:
+                    await call.run_async()
+                    warmed += 1
+                except Exception as e:
+                    event("warm_up_failed", INFO, skill=call.skill, error=str(e))
+        return warmed
+
+    async def handle_user_message(
+        self,
+        user_message: str,
+        deadline: Optional[float] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> str:
+        with deadline_scope(self._turn_deadline(deadline)), cancel_scope(cancel), \
+                self._turn_usage(), span("turn", turn=self.turn_count):
+            event("user_message", text=user_message)
+            answer = await run_steps_async(self._turn_steps(user_message), self._prepare_step)
+            self._remember(user_message, answer)
+            return answer
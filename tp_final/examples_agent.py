@@ -4,14 +4,38 @@
 # =========================
 import pygame
 from typing import Any, Dict
-from agent import MultiSkillAgent, Skill, Slot
+from agent import (
+    SMALL_MODEL_NAME,
+    ModelSpec,
+    MultiSkillAgent,
+    Skill,
+    SkillIndex,
+    Slot,
+    get_client_for,
+    small_model_cascade,
+)
+# après agent, qui met la racine du dépôt dans sys.path
+from llama_client import BusyError, CircuitOpenError, DeadlineExceeded, get_default_client
 
 from pathlib import Path
 from typing import Dict
 import pygame
+import threading
 import time
 
 BASE_DIR = Path(__file__).resolve().parent
+
+# llama-server du petit modèle pour le routage et l'extraction
+# (ex: "http://localhost:8081/v1/chat/completions") ; None = tout sur le modèle principal
+SMALL_MODEL_URL = None
+# "json" ou "tools" (llama-server --jinja) : routage et extraction des slots
+# en un seul appel LLM ; None = deux appels
+SINGLE_PASS = "json"
+# llama-server lancé avec --embeddings pour l'index de skills (utile à partir de
+# quelques dizaines de skills) et le cache de réponses du smalltalk ; None = ni l'un
+# ni l'autre (tous les skills dans les prompts de routage)
+EMBEDDING_URL = None
+SKILL_INDEX_PATH = BASE_DIR / "skill_index.npz"
 MUSIC_PATH = BASE_DIR / "music" / "get_back.wav"
 
 def music_on_ready(values: Dict[str, str]) -> str:
@@ -87,6 +111,14 @@ def booking_on_ready(values: Dict[str, str]) -> str:
 
 def build_agent() -> MultiSkillAgent:
 
+    # Embeddings : index de skills et cache de réponses du smalltalk
+    embedder = smalltalk_cache = None
+    if EMBEDDING_URL:
+        from llama_client.embeddings import Embedder, SemanticCache  # NumPy
+
+        embedder = Embedder(get_client_for(EMBEDDING_URL))
+        smalltalk_cache = SemanticCache(embedder, threshold=0.92, ttl=3600)
+
     music_slots = [
         Slot(
             name="music",
@@ -105,6 +137,7 @@ Tu reçois une données structurée, tu vas recevoir le nom de la musique.
 exemple de phrase : "je veux ecouter get_back"
 """,
         on_ready=music_on_ready,
+        keywords=["musique", "chanson"],
     )
 
     write_file_slots = [
@@ -156,6 +189,8 @@ Tu reçois des données structurées (ville, date, prévisions, etc.)
 et tu dois formuler une réponse météo en français, concise et naturelle.
 """,
         on_ready=weather_on_ready,
+        examples=["quel temps fera-t-il demain à Lyon ?", "est-ce qu'il va faire beau ce week-end"],
+        keywords=["météo", "température", "il pleut", "pleuvoir", "il neige"],
     )
 
 
@@ -190,6 +225,7 @@ et tu dois formuler une réponse météo en français, concise et naturelle.
         ],
         final_answer_system_prompt="""Tu es un assistant qui permet de lire du contenu dans un fichier texte. Tu dois lire le fichier texte spécifié et retourner son contenu.""",
         on_ready=read_txt_file_on_ready,
+        patterns=[r"\b(lis|lire|ouvre|affiche)\b.*\bfichier\b"],
     )
 
     # Skill réservation de restaurant
@@ -226,6 +262,9 @@ Tu reçois soit des données structurées, soit un résumé, et tu dois
 répondre en français en récapitulant clairement la réservation.
 """,
         on_ready=booking_on_ready,
+        examples=["une table pour 4 ce soir", "je voudrais manger japonais vendredi"],
+        keywords=["restaurant", "restau"],
+        patterns=[r"\breserv\w*"],
     )
 
     # Skill smalltalk (pas de slots)
@@ -238,9 +277,20 @@ Tu es un assistant conversationnel général.
 Réponds naturellement en français, de façon sympathique et concise.
 """,
         on_ready=None,
+        answer_cache=smalltalk_cache,
     )
 
-    return MultiSkillAgent([weather_skill, booking_skill, smalltalk_skill, music_skill, write_file_skill, file_writer, file_reader])
+    skill_index = SkillIndex(embedder, top_k=5, cache_path=SKILL_INDEX_PATH) if embedder else None
+
+    return MultiSkillAgent(
+        [weather_skill, booking_skill, smalltalk_skill, music_skill, write_file_skill, file_writer, file_reader],
+        turn_timeout=90.0,
+        token_budget=50_000,
+        history_tokens=1024,
+        single_pass=SINGLE_PASS,
+        skill_index=skill_index,
+        models=small_model_cascade(ModelSpec(SMALL_MODEL_NAME, SMALL_MODEL_URL)) if SMALL_MODEL_URL else None,
+    )
 
 
 # =========================
@@ -249,6 +299,11 @@ Réponds naturellement en français, de façon sympathique et concise.
 
 def main():
     agent = build_agent()
+    # Ouvre les connexions vers llama-server avant le premier message
+    get_default_client().preconnect(n=2)
+    # Prompts système fixes traités en arrière-plan pendant qu'on tape le premier
+    # message (un par slot de llama-server, option -np)
+    threading.Thread(target=agent.warm_up, kwargs={"limit": 4}, name="warm-up", daemon=True).start()
     print("Assistant: Salut !")
     print("Tu peux me parler météo, réservation de resto, ou juste discuter.")
     print("Tape 'quit' pour arrêter, ou 'reset' pour annuler une demande en cours.\n")
@@ -259,10 +314,24 @@ def main():
             continue
         if user_msg.lower() in {"quit", "exit"}:
             print("Assistant: À bientôt !")
+            print("Tokens par skill:", {k: u.snapshot() for k, u in agent.usage.by("skill").items()})
+            print("Routage sans LLM:", agent.intent_matcher.stats.snapshot())
+            cache = agent.skills["smalltalk"].answer_cache
+            if cache is not None:
+                print("Cache de réponses du smalltalk:", cache.stats.snapshot())
             break
 
         try:
             answer = agent.handle_user_message(user_msg)
+        except DeadlineExceeded as e:
+            print("Tour trop long:", e)
+            answer = "Désolé, j'ai mis trop de temps à répondre. Peux-tu reformuler ou réessayer ?"
+        except BusyError as e:
+            print("Serveur saturé:", e)
+            answer = "Je suis très sollicité en ce moment, peux-tu réessayer dans quelques secondes ?"
+        except CircuitOpenError as e:
+            print("Modèle indisponible:", e)
+            answer = "Le modèle est momentanément indisponible, réessaie dans un instant."
         except Exception as e:
             print("Erreur interne:", e)
             answer = "Oups, j'ai eu un souci interne, peux-tu réessayer ?"